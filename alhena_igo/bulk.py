@@ -0,0 +1,211 @@
+"""
+Tuned bulk indexing into Elasticsearch.
+
+`BulkIndexer` writes DataFrames with the Elasticsearch ``_bulk`` API in
+chunks of a set number of documents, from several threads at once, and can
+relax index settings for the duration of a load: ``refresh_interval`` and
+the number of replicas are changed on the indices of an analysis, and
+restored afterwards. It also finds and deletes the indices of many analyses
+with one request per batch.
+
+Settings of indices that already exist are restored to their previous
+values. Indices created during the load get the tuned settings from a
+temporary index template, and are reset to the cluster defaults afterwards.
+
+.. currentmodule:: alhena_igo.bulk
+"""
+import contextlib
+import hashlib
+import http.client
+import json
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from alhena_igo import profiling
+
+logger = logging.getLogger('alhena_igo')
+
+DEFAULT_CHUNK_SIZE = 5000  #: documents per bulk request
+MAX_URL_INDICES = 4000  #: characters of index names per request URL
+TEMPLATE_ORDER = 1000  #: order of the temporary index template, above any regular template
+
+# query of index lookups that may name indices that do not exist
+_MISSING_OK = 'ignore_unavailable=true&allow_no_indices=true&expand_wildcards=open'
+
+
+class BulkError(Exception):
+    """An Elasticsearch request of a bulk load that failed."""
+
+
+class BulkIndexer(object):
+    """
+    Bulk writer and index settings tuner for one Elasticsearch server.
+
+    KwArgs:
+        chunk_size (int): documents per ``_bulk`` request.
+        workers (int): ``_bulk`` requests in flight at once.
+        refresh_interval (str): ``index.refresh_interval`` during a load, e.g. '-1' to disable refreshes.
+        replicas (int): ``index.number_of_replicas`` during a load, e.g. 0.
+        read_tiers (list): downsampled tiers of the reads to index with each load, see `tiers.READ_TIERS`.
+        cell_summary (bool): index a per-cell QC summary with each load, see `cell_summary`.
+        cell_summary_min_quality (float): quality threshold of the summary's ``passes_quality`` flag, default `cell_summary.DEFAULT_MIN_QUALITY`.
+    """
+
+    def __init__(self, host: str, port: int, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 1, refresh_interval: str = None, replicas: int = None,
+                 read_tiers=(), cell_summary: bool = False, cell_summary_min_quality: float = None, timeout: float = 300):
+        self.host = host
+        self.port = port
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self.workers = max(workers or 1, 1)
+        self.refresh_interval = refresh_interval
+        self.replicas = replicas
+        self.read_tiers = list(read_tiers or ())
+        self.cell_summary = cell_summary
+        self.cell_summary_min_quality = cell_summary_min_quality
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def __getstate__(self):
+        # connections stay with the process that opened them
+        state = dict(self.__dict__)
+        del state['_idle']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._idle = queue.LifoQueue()
+
+    def _request(self, method: str, path: str, body: bytes = None, content_type: str = 'application/json'):
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        try:
+            connection.request(method, path, body=body, headers={'Content-Type': content_type})
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+        result = json.loads(data) if data else None
+        if response.status >= 400:
+            raise BulkError(f"{method} {path} failed with status {response.status}: {data[:500]!r}")
+        return result
+
+    def _bulk(self, index_name: str, documents: str):
+        lines = documents.splitlines()
+        action = json.dumps({'index': {'_index': index_name}})
+        body = ''.join(f'{action}\n{line}\n' for line in lines).encode()
+
+        result = self._request('POST', '/_bulk', body, content_type='application/x-ndjson')
+        if result.get('errors'):
+            errors = [item['index']['error'] for item in result['items'] if 'error' in item.get('index', {})]
+            raise BulkError(f"Bulk load into {index_name} failed for {len(errors)} documents, e.g. {errors[0]}")
+        return len(lines)
+
+    def load_df(self, df, index_name: str):
+        """Index the rows of a DataFrame as documents, ``chunk_size`` at a time from ``workers`` threads."""
+        with profiling.stage('bulk', index=index_name) as record:
+            record['rows'] = len(df)
+
+            def chunks():
+                for start in range(0, len(df), self.chunk_size):
+                    yield df.iloc[start:start + self.chunk_size].to_json(orient='records', lines=True, date_format='iso')
+
+            if self.workers == 1:
+                return sum(self._bulk(index_name, documents) for documents in chunks())
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # bound the chunks serialized ahead of the requests in flight
+                pending = []
+                total = 0
+                for documents in chunks():
+                    pending.append(executor.submit(self._bulk, index_name, documents))
+                    if len(pending) >= 2 * self.workers:
+                        total += pending.pop(0).result()
+                return total + sum(future.result() for future in pending)
+
+    def indices(self, patterns):
+        """Return the names of open indices matching any of the names or patterns, with one request per batch of them."""
+        names = []
+        for batch in _url_batches(patterns):
+            names.extend(self._request('GET', f'/{",".join(batch)}/_settings?{_MISSING_OK}') or {})
+        return names
+
+    def delete_indices(self, indices):
+        """Delete indices, with one request per batch of names."""
+        for batch in _url_batches(indices):
+            logger.debug(f"Deleting {len(batch)} indices")
+            self._request('DELETE', f'/{",".join(batch)}')
+
+    def _tuned_settings(self):
+        settings = {}
+        if self.refresh_interval is not None:
+            settings['refresh_interval'] = self.refresh_interval
+        if self.replicas is not None:
+            settings['number_of_replicas'] = self.replicas
+        return settings
+
+    def _get_settings(self, indices):
+        """Return the explicitly set tuned settings of those of the indices that exist."""
+        result = self._request('GET', f'/{",".join(indices)}/_settings?{_MISSING_OK}')
+        previous = {}
+        for index, body in (result or {}).items():
+            settings = body.get('settings', {}).get('index', {})
+            previous[index] = {key: settings.get(key) for key in self._tuned_settings()}
+        return previous
+
+    def _put_settings(self, index: str, settings):
+        self._request('PUT', f'/{index}/_settings', json.dumps({'index': settings}).encode())
+
+    @contextlib.contextmanager
+    def tuned(self, indices):
+        """Apply the tuned settings to the named indices, existing or created in the block, for the duration of the block."""
+        settings = self._tuned_settings()
+        if not settings:
+            yield
+            return
+
+        indices = list(indices)
+        template = f"alhena_igo_bulk_{hashlib.sha1(','.join(indices).encode()).hexdigest()[:16]}"
+        previous = self._get_settings(indices)
+
+        self._request('PUT', f'/_template/{template}', json.dumps({
+            'index_patterns': indices,
+            'order': TEMPLATE_ORDER,
+            'settings': {'index': settings},
+        }).encode())
+        try:
+            for index in previous:
+                self._put_settings(index, settings)
+            yield
+        finally:
+            self._request('DELETE', f'/_template/{template}')
+            for index in self._get_settings(indices):
+                # a None value resets a setting to its default
+                restore = previous.get(index, {key: None for key in settings})
+                logger.debug(f"Restoring {restore} on {index}")
+                self._put_settings(index, restore)
+
+
+def _url_batches(names):
+    """Split index names or patterns into batches short enough for a request URL."""
+    batch = []
+    length = 0
+    for name in names:
+        if batch and length + len(name) + 1 > MAX_URL_INDICES:
+            yield batch
+            batch = []
+            length = 0
+        batch.append(name)
+        length += len(name) + 1
+    if batch:
+        yield batch
@@ -0,0 +1,144 @@
+"""
+Local on-disk cache for Isabl lookups.
+
+Lookups are stored in a SQLite file, keyed by the function and its arguments.
+Entries expire after a TTL, except those marked final (e.g. records of
+SUCCEEDED analyses), which are kept until the cache is refreshed. A refreshed
+cache ignores entries written before the refresh, so lookups made since, e.g.
+by a prefetch or another worker of the same run, are still reused.
+
+.. currentmodule:: alhena_igo.cache
+"""
+import functools
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+
+logger = logging.getLogger('alhena_igo')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'alhena_igo')
+DEFAULT_TTL = 7 * 24 * 60 * 60  #: seconds before a non-final entry expires
+
+_isabl_cache = None
+
+
+class IsablCache(object):
+    """SQLite backed key/value store of pickled Isabl lookups."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL, refresh: bool = False, refreshed_at: float = None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.refresh = refresh
+        #: with refresh, entries written before this time are ignored
+        self.refreshed_at = (refreshed_at or time.time()) if refresh else None
+        self.path = os.path.join(cache_dir, 'isabl.sqlite')
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS isabl_cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL, written REAL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(isabl_cache)")]
+            if 'written' not in columns:
+                # caches created before entries recorded when they were written
+                conn.execute("ALTER TABLE isabl_cache ADD COLUMN written REAL")
+
+    def _connect(self):
+        # A connection per operation keeps the cache safe to use from forked workers
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get(self, key: str):
+        """Return ``(True, value)`` for a live entry, otherwise ``(False, None)``."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires, written FROM isabl_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return False, None
+
+        value, expires, written = row
+        if expires is not None and expires < time.time():
+            return False, None
+        if self.refresh and (written is None or written < self.refreshed_at):
+            return False, None
+
+        return True, pickle.loads(value)
+
+    def set(self, key: str, value, final: bool = False):
+        now = time.time()
+        expires = None if final else now + self.ttl
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO isabl_cache (key, value, expires, written) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value), expires, now)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM isabl_cache")
+
+    @property
+    def settings(self):
+        return self.cache_dir, self.ttl, self.refresh, self.refreshed_at
+
+
+def configure(cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = DEFAULT_TTL, refresh: bool = False, refreshed_at: float = None):
+    """Enable the Isabl cache for this process. Worker processes pass the ``refreshed_at`` of the cache they share."""
+    global _isabl_cache
+    _isabl_cache = IsablCache(cache_dir, ttl=ttl, refresh=refresh, refreshed_at=refreshed_at)
+    return _isabl_cache
+
+
+def disable():
+    global _isabl_cache
+    _isabl_cache = None
+
+
+def get_isabl_cache():
+    """Return the configured cache, or None if caching is disabled."""
+    return _isabl_cache
+
+
+def cache_key(namespace: str, *args, **kwargs) -> str:
+    """Return the key under which `cached` stores a lookup called with these arguments."""
+    return namespace + ':' + json.dumps(
+        [[str(a) for a in args], {k: str(v) for k, v in sorted(kwargs.items())}]
+    )
+
+
+def cached(namespace: str, final=None):
+    """
+    Cache the decorated Isabl lookup when a cache is configured.
+
+    Args:
+        namespace (str): prefix for cache keys of the lookup
+
+    KwArgs:
+        final (callable): given the result, returns True if it can never change
+            and so should not expire
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_isabl_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+
+            key = cache_key(namespace, *args, **kwargs)
+
+            hit, value = cache.get(key)
+            if hit:
+                logger.debug(f"Isabl cache hit for {key}")
+                return value
+
+            value = func(*args, **kwargs)
+            cache.set(key, value, final=final is not None and final(value))
+            return value
+
+        return wrapper
+    return decorator
@@ -0,0 +1,122 @@
+"""
+Per-cell QC summary for cheap dashboard filters.
+
+`build_cell_summary` joins the align and hmmcopy metrics into one compact
+record per cell, with the metrics dashboards filter and plot on, boolean
+filter flags evaluated once at load time, and the bucket of each histogram
+metric, so that filters are term lookups and histograms are term counts.
+
+.. currentmodule:: alhena_igo.cell_summary
+"""
+import numpy as np
+import pandas as pd
+
+from alhena_igo.utils import union_categories
+
+DEFAULT_MIN_QUALITY = 0.75  #: quality threshold of the ``passes_quality`` flag
+
+#: experimental conditions of control wells, flagged by ``is_control``
+CONTROL_CONDITIONS = ('NTC', 'NCC', 'gDNA', 'NEG', 'POS')
+
+#: metrics kept in the summary, with their compact dtypes; metrics missing from both tables are left out
+SUMMARY_COLUMNS = {
+    'sample_id': 'category',
+    'library_id': 'category',
+    'experimental_condition': 'category',
+    'cell_call': 'category',
+    'quality': 'float32',
+    'total_reads': 'float32',
+    'total_mapped_reads': 'float32',
+    'coverage_depth': 'float32',
+    'coverage_breadth': 'float32',
+    'mad_neutral_state': 'float32',
+    'state_mode': 'float32',
+    'is_contaminated': 'bool',
+    'is_s_phase': 'bool',
+}
+
+#: histogram metrics, with the scale and width of their buckets
+HISTOGRAM_BUCKETS = {
+    'quality': ('linear', 0.05),
+    'mad_neutral_state': ('linear', 0.05),
+    'coverage_depth': ('linear', 0.01),
+    'coverage_breadth': ('linear', 0.05),
+    'total_reads': ('log10', 0.1),
+    'total_mapped_reads': ('log10', 0.1),
+}
+
+
+def cell_summary_index(analysis_id: str) -> str:
+    """Return the Alhena index of an analysis' cell summary."""
+    return f"{analysis_id.lower()}_cells"
+
+
+def _select(metrics, exclude=()):
+    columns = ['cell_id'] + [col for col in SUMMARY_COLUMNS if col in metrics and col not in exclude]
+    return metrics[columns].drop_duplicates('cell_id')
+
+
+def _as_bool(values):
+    """Return boolean metrics as bools, whether parsed as bools, numbers or strings such as 'True'/'False'; missing is False."""
+    if values.dtype == 'bool':
+        return values.to_numpy()
+    return values.astype(str).str.strip().str.lower().isin(['true', '1', '1.0']).to_numpy()
+
+
+def bucket(values, scale: str, width: float):
+    """Return the lower edge of the bucket of each value, NaN for missing (or, on a log scale, non-positive) values."""
+    values = np.asarray(values, dtype='float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if scale == 'log10':
+            values = np.log10(np.where(values > 0, values, np.nan))
+        # the tolerance keeps float32 metrics on an edge, e.g. 0.9 stored as 0.8999999761, in its bucket
+        edges = np.floor(values / width + 1e-6) * width
+        if scale == 'log10':
+            edges = 10 ** edges
+    # round away floating point noise, e.g. 0.15000000000000002
+    return np.round(edges, 6).astype('float32')
+
+
+def build_cell_summary(align_metrics, hmmcopy_metrics, min_quality: float = DEFAULT_MIN_QUALITY):
+    """
+    Return one summary record per cell from the align and hmmcopy metrics.
+
+    Metrics present in both tables are taken from the hmmcopy metrics. Flags:
+    ``passes_quality`` (quality at least ``min_quality``), ``is_control``
+    (a control experimental condition) and ``passes_filters`` (passes
+    quality, not contaminated and not a control). Each histogram metric gets
+    a ``<metric>_bucket`` column with the lower edge of its bucket.
+    """
+    hmmcopy = _select(hmmcopy_metrics)
+    align = _select(align_metrics, exclude=hmmcopy.columns)
+
+    frames = [hmmcopy.copy(), align.copy()]
+    union_categories(frames, ['cell_id'])
+    summary = frames[0].merge(frames[1], on='cell_id', how='outer', sort=False)
+
+    for col, dtype in SUMMARY_COLUMNS.items():
+        if col not in summary:
+            continue
+        if dtype == 'bool':
+            summary[col] = _as_bool(summary[col])
+        else:
+            summary[col] = summary[col].astype(dtype)
+
+    summary = summary[summary['cell_id'].astype(str) != 'reference'].reset_index(drop=True)
+
+    quality = summary['quality'] if 'quality' in summary else pd.Series(np.nan, index=summary.index)
+    summary['passes_quality'] = (quality >= min_quality).to_numpy()
+    if 'experimental_condition' in summary:
+        summary['is_control'] = summary['experimental_condition'].isin(CONTROL_CONDITIONS).to_numpy()
+    else:
+        summary['is_control'] = False
+    summary['passes_filters'] = summary['passes_quality'] & ~summary['is_control']
+    if 'is_contaminated' in summary:
+        summary['passes_filters'] &= ~summary['is_contaminated']
+
+    for col, (scale, width) in HISTOGRAM_BUCKETS.items():
+        if col in summary:
+            summary[f'{col}_bucket'] = bucket(summary[col], scale, width)
+
+    summary['cell_id'] = summary['cell_id'].cat.remove_unused_categories()
+    return summary
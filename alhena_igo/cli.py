@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import alhena_igo.isabl
 
 """
 This is the entry point for the command-line interface (CLI) application.
@@ -16,20 +15,23 @@ It can be used as a handy facility for running the task from a command line.
     To learn more about running Luigi, visit the Luigi project's
     `Read-The-Docs <http://luigi.readthedocs.io/en/stable/>`_ page.
 
+Heavy dependencies (pandas, alhenaloader, scgenome, isabl_cli) are imported
+by the commands that use them, so that ``version`` and ``--help`` start fast.
+
 .. currentmodule:: alhena_igo.cli
 .. moduleauthor:: Samantha Leung <leungs1@mskcc.org>
 """
+import functools
 import logging
 import click
 from typing import List
 
-import alhenaloader
-from scgenome.loaders.qc import load_qc_results
-
-import alhena_igo.isabl
 from .__init__ import __version__
-from alhena_igo import utils
-from alhena_igo.utils import process_data, _categorical_cols_align, _categorical_cols_hmmcopy, standard_hmmcopy_reads_cols
+from alhena_igo import cache
+from alhena_igo import defaults
+from alhena_igo import profiling
+from alhena_igo import ledger as load_ledger
+from alhena_igo import table_cache
 
 LOGGING_LEVELS = {
     0: logging.NOTSET,
@@ -48,6 +50,17 @@ class Info(object):
     def __init__(self):  # Note: This object must have an empty constructor.
         """Create a new instance."""
         self.verbose: int = 0
+        self.host: str = 'localhost'
+        self.port: int = 9200
+        self._es = None
+
+    @property
+    def es(self):
+        """The alhenaloader Elasticsearch client, created on first use."""
+        if self._es is None:
+            import alhenaloader
+            self._es = alhenaloader.ES(self.host, self.port)
+        return self._es
 
 
 # pass_info is a decorator for functions that pass 'Info' objects.
@@ -55,14 +68,72 @@ class Info(object):
 pass_info = click.make_pass_decorator(Info, ensure=True)
 
 
+class BulkOptions(object):
+    """The Elasticsearch bulk indexing options shared by the load commands."""
+
+    def __init__(self, chunk_size: int = None, workers: int = None, refresh_interval: str = None, replicas: int = None,
+                 read_tiers: List[str] = (), cell_summary: bool = False):
+        """Create a new instance."""
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.replicas = replicas
+        self.read_tiers = list(read_tiers)
+        self.cell_summary = cell_summary
+
+    def indexer(self, info: Info):
+        """Return a `bulk.BulkIndexer` for the options given, or None to index with alhenaloader's defaults."""
+        if self.chunk_size is None and self.workers is None and self.refresh_interval is None and self.replicas is None \
+                and not self.read_tiers and not self.cell_summary:
+            return None
+
+        from alhena_igo import bulk
+
+        return bulk.BulkIndexer(
+            info.host, info.port, chunk_size=self.chunk_size, workers=self.workers, refresh_interval=self.refresh_interval,
+            replicas=self.replicas, read_tiers=self.read_tiers, cell_summary=self.cell_summary,
+        )
+
+
+_BULK_OPTIONS = [
+    click.option('--bulk-chunk-size', type=int, help="Documents per bulk request when streaming tables into Elasticsearch"),
+    click.option('--bulk-workers', type=int, help="Bulk requests in flight at once when streaming tables into Elasticsearch"),
+    click.option('--refresh-interval', help="Index refresh interval during the load, e.g. -1 to disable refreshes; restored afterwards"),
+    click.option('--replicas', type=int, help="Index replicas during the load, e.g. 0; restored afterwards"),
+    click.option('--read-tier', 'read_tiers', multiple=True, type=click.Choice(list(defaults.READ_TIERS)), help="Also index the reads downsampled to this tier, for zoomed-out heatmaps; repeat for several"),
+    click.option('--cell-summary', is_flag=True, help="Also index a per-cell QC summary with precomputed filter flags and histogram buckets"),
+]
+
+
+def bulk_options(func):
+    """Add the bulk indexing options to a command, which gets them as one `BulkOptions` argument ``bulk_options``."""
+    @functools.wraps(func)
+    def command(*args, bulk_chunk_size, bulk_workers, refresh_interval, replicas, read_tiers, cell_summary, **kwargs):
+        options = BulkOptions(bulk_chunk_size, bulk_workers, refresh_interval, replicas, read_tiers, cell_summary)
+        return func(*args, bulk_options=options, **kwargs)
+
+    for option in reversed(_BULK_OPTIONS):
+        command = option(command)
+    return command
+
+
 # Change the options to below to suit the actual options for your task (or
 # tasks).
 @click.group()
 @click.option("--verbose", "-v", count=True, help="Enable verbose output.")
 @click.option('--host', default='localhost', help='Hostname for Elasticsearch server')
 @click.option('--port', default=9200, help='Port for Elasticsearch server')
+@click.option('--cache-dir', default=cache.DEFAULT_CACHE_DIR, show_default=True, help='Directory for the local Isabl lookup cache')
+@click.option('--cache-ttl', default=cache.DEFAULT_TTL, show_default=True, help='Seconds before cached Isabl lookups of unfinished analyses expire')
+@click.option('--refresh', is_flag=True, help='Ignore cached Isabl lookups and query Isabl again')
+@click.option('--no-cache', is_flag=True, help='Do not cache Isabl lookups')
+@click.option('--table-cache', 'use_table_cache', is_flag=True, help='Cache parsed QC tables locally, so reloads skip CSV parsing')
+@click.option('--table-cache-dir', default=table_cache.DEFAULT_TABLE_CACHE_DIR, show_default=True, help='Directory for the parsed table cache')
+@click.option('--table-cache-size', default=table_cache.DEFAULT_MAX_GB, show_default=True, help='GB of parsed tables to keep before evicting the least recently used')
+@click.option('--profile', 'profile_path', type=click.Path(dir_okay=False, writable=True), help='Write a JSON report of time, peak memory and rows per stage to this path')
 @pass_info
-def cli(info: Info, verbose: int, host: str, port: int):
+@click.pass_context
+def cli(ctx: click.Context, info: Info, verbose: int, host: str, port: int, cache_dir: str, cache_ttl: int, refresh: bool, no_cache: bool, use_table_cache: bool, table_cache_dir: str, table_cache_size: float, profile_path: str):
     """Run alhena_igo."""
     # Use the verbosity count to determine the logging level...
     if verbose > 0:
@@ -85,16 +156,77 @@ def cli(info: Info, verbose: int, host: str, port: int):
             )
         )
     info.verbose = verbose
-    info.es = alhenaloader.ES(host, port)
+    info.host = host
+    info.port = port
+
+    if no_cache:
+        cache.disable()
+    else:
+        cache.configure(cache_dir, ttl=cache_ttl, refresh=refresh)
+
+    if use_table_cache:
+        table_cache.configure(table_cache_dir, max_bytes=int(table_cache_size * 1e9))
+    else:
+        table_cache.disable()
+
+    if profile_path:
+        profiler = profiling.enable()
+        ctx.call_on_close(lambda: profiler.write(profile_path, command=ctx.invoked_subcommand))
 
 
 @cli.command()
-@click.option('--analysis', help="Analysis ID", required=True)
+@click.option('--analysis', 'analyses', multiple=True, help="Analysis ID, repeat for several")
+@click.option('--isabl', help="Clean every analysis of this Isabl project")
+@click.option('--alhena', help="Clean every analysis in this Alhena project")
+@click.option('--framework', type=click.Choice(['scp', 'mondrian']), help="Framework of the Isabl project's analyses")
+@click.option('--version', help="Isabl app version of the Isabl project's analyses")
+@click.option('--workers', default=4, show_default=True, help="Analyses to remove records of at once when cleaning several")
+@click.option('--batch-size', default=defaults.CLEAN_BATCH_SIZE, show_default=True, help="Analyses whose indices are deleted with one request when cleaning several")
 @pass_info
-def clean(info: Info, analysis: str):
-    """Delete indices/records associated with analysis ID"""
-    alhenaloader.clean_analysis(analysis, info.es)
+def clean(info: Info, analyses: List[str], isabl: str, alhena: str, framework: str, version: str, workers: int, batch_size: int):
+    """Delete indices/records associated with analysis IDs, or with every analysis of a project"""
+    import alhena_igo.isabl
+    from alhena_igo import bulk, loader
+
+    analysis_ids = list(analyses)
+    if isabl is not None:
+        if framework is None or version is None:
+            raise click.UsageError('--isabl needs --framework and --version')
+        analysis_ids += [record['dashboard_id'] for record in alhena_igo.isabl.get_ids_from_isabl(isabl, framework, version)]
+    if alhena is not None:
+        analysis_ids += sorted(info.es.get_project_analyses(alhena))
+    if not analysis_ids:
+        raise click.UsageError('Give --analysis, --isabl or --alhena')
+
+    if len(analysis_ids) == 1:
+        # looking the analysis up would cost as much as cleaning it
+        loader.clean_analysis(analysis_ids[0], info.es)
+        return
+
+    failed = []
+    cleaned = 0
+    indexer = bulk.BulkIndexer(info.host, info.port)
+    for analysis_id, error in loader.clean_analyses(analysis_ids, info.es, bulk=indexer, workers=workers, batch_size=batch_size):
+        if error is None:
+            cleaned += 1
+        else:
+            failed.append(analysis_id)
+            click.echo(click.style(f'Failed {analysis_id}: {error}', fg='red'), err=True)
+
+    click.echo(f'{cleaned} cleaned, {len(set(analysis_ids)) - cleaned - len(failed)} not in Alhena, {len(failed)} failed')
+    if failed:
+        raise SystemExit(1)
+
 
+def _parse_size(ctx, param, value):
+    if value is None:
+        return None
+
+    from alhena_igo import memory
+    try:
+        return memory.parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
 
 
 @cli.command()
@@ -102,42 +234,82 @@ def clean(info: Info, analysis: str):
 @click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load analysis into")
 @click.option('--framework', type=click.Choice(['scp', 'mondrian', 'mondrian_nf']), help="Framework: scp, mondrian or mondrian_nf (nextflow)")
 @click.option('--version', help="Isabl app version to load", required=True)
+@click.option('--chunksize', type=int, help="Stream hmmcopy reads in chunks of this many rows (mondrian_nf only)")
+@click.option('--memory-report', is_flag=True, help="Print the rows and memory used by each parsed table")
+@click.option('--engine', type=click.Choice(defaults.CSV_ENGINES), default=defaults.DEFAULT_CSV_ENGINE, show_default=True, help="CSV parse engine (mondrian_nf only)")
+@click.option('--parse-workers', default=1, show_default=True, help="Number of QC tables to parse at once (mondrian_nf only)")
+@click.option('--cells-file', type=click.File('r'), help="Only load the cells listed in this file, one cell ID per line (mondrian_nf only)")
+@click.option('--chromosome', 'chromosomes', multiple=True, help="Only load bins and segments on this chromosome, repeat for several (mondrian_nf only)")
+@click.option('--min-quality', type=float, help="Only load cells with at least this quality in the metrics (mondrian_nf only)")
+@click.option('--max-memory', callback=_parse_size, help="Memory budget of the parsed tables, e.g. 8G; tables that do not fit are streamed in chunks (mondrian_nf) or spilled to a temp file once parsed (scp, mondrian, whose parse is not bounded)")
+@bulk_options
 @pass_info
-def load(info: Info, analysis_id: str, projects: List[str], framework: str, version: str):
+def load(info: Info, analysis_id: str, projects: List[str], framework: str, version: str, chunksize: int, memory_report: bool, engine: str, parse_workers: int, cells_file, chromosomes: List[str], min_quality: float, max_memory: int, bulk_options: BulkOptions):
+    import alhena_igo.isabl
+    from alhena_igo import loader, memory, utils
+
     click.echo(f'Loading as ID {analysis_id}')
 
-    if framework == 'scp':
-        [alignment, hmmcopy, annotation] = alhena_igo.isabl.get_directories(analysis_id, framework, version)
-        data = load_qc_results(
-            'scp', 
-            alignment_results_dir=alignment, 
-            hmmcopy_results_dir=hmmcopy,
-            annotation_results_dir=annotation
+    cells = [line.strip() for line in cells_file if line.strip()] if cells_file else None
+    try:
+        data = loader.get_qc_data(
+            analysis_id, framework, version, chunksize=chunksize, engine=engine, parse_workers=parse_workers,
+            cells=cells, chromosomes=list(chromosomes) or None, min_quality=min_quality, max_memory=max_memory,
         )
-    elif framework == 'mondrian':
-        [alignment, hmmcopy] = alhena_igo.isabl.get_directories(analysis_id, framework, version)
-        data = load_qc_results(
-            'mondrian', 
-            alignment_results_dir=alignment, 
-            hmmcopy_results_dir=hmmcopy
-        )
-    elif framework == 'mondrian_nf':
-        cataloged_results = alhena_igo.isabl.get_isabl_cataloged_qc_results(analysis_id, framework, version)
-        
-        data = {
-            'align_metrics':   process_data(cataloged_results['metrics'], _categorical_cols_align),
-            'gc_metrics':      process_data(cataloged_results['gc_metrics'], _categorical_cols_align),
-            'hmmcopy_reads':   process_data(cataloged_results['reads'], _categorical_cols_hmmcopy, usecols=standard_hmmcopy_reads_cols.copy()),
-            'hmmcopy_segs':    process_data(cataloged_results['segments'], _categorical_cols_hmmcopy),
-            'hmmcopy_metrics': process_data(cataloged_results['metrics'], _categorical_cols_hmmcopy),
-        }
+    except memory.MemoryBudgetError as e:
+        raise click.ClickException(str(e))
 
-    else:
-        raise Exception(f"Unknown framework option '{framework}'")
+    if memory_report:
+        click.echo(utils.memory_report(data).to_string(index=False))
+
+    with profiling.stage('metadata', analysis=analysis_id):
+        metadata = alhena_igo.isabl.get_metadata(analysis_id)
+
+    bulk_indexer = bulk_options.indexer(info)
+    loader.index_analysis(analysis_id, data,  metadata, list(projects), info.es, framework, bulk=bulk_indexer)
 
-    metadata = alhena_igo.isabl.get_metadata(analysis_id)
 
-    alhenaloader.load_analysis(analysis_id, data,  metadata, list(projects), info.es, framework)
+@cli.command()
+@click.option('--analysis_id', 'analysis_ids', multiple=True, required=True, help="Analysis primary key of a library to merge, repeat for each library")
+@click.option('--dashboard_id', help="Alhena ID of the merged dashboard, default the analysis IDs joined by '_'")
+@click.option('--project', 'projects', multiple=True, default=["DLP"], help="Projects to load analysis into")
+@click.option('--framework', type=click.Choice(['scp', 'mondrian', 'mondrian_nf']), help="Framework: scp, mondrian or mondrian_nf (nextflow)")
+@click.option('--version', help="Isabl app version to load", required=True)
+@click.option('--memory-report', is_flag=True, help="Print the rows and memory used by each merged table")
+@click.option('--engine', type=click.Choice(defaults.CSV_ENGINES), default=defaults.DEFAULT_CSV_ENGINE, show_default=True, help="CSV parse engine (mondrian_nf only)")
+@click.option('--parse-workers', default=1, show_default=True, help="Number of QC tables to parse at once (mondrian_nf only)")
+@pass_info
+def load_merged(info: Info, analysis_ids: List[str], dashboard_id: str, projects: List[str], framework: str, version: str, memory_report: bool, engine: str, parse_workers: int):
+    """Load several analyses, e.g. libraries of one sample, as a single dashboard"""
+    import alhena_igo.isabl
+    from alhena_igo import loader, utils
+
+    dashboard_id = dashboard_id or '_'.join(analysis_ids)
+    click.echo(f"Loading {', '.join(analysis_ids)} as ID {dashboard_id}")
+
+    data = loader.get_merged_qc_data(list(analysis_ids), framework, version, engine=engine, parse_workers=parse_workers)
+
+    if memory_report:
+        click.echo(utils.memory_report(data).to_string(index=False))
+
+    with profiling.stage('metadata', analysis=dashboard_id):
+        metadata = alhena_igo.isabl.get_merged_metadata(analysis_ids, dashboard_id)
+
+    loader.index_analysis(dashboard_id, data, metadata, list(projects), info.es, framework)
+
+
+def _prefetch_isabl(analysis_ids: List[str], framework: str, version: str, concurrency: int):
+    """Resolve Isabl lookups of many analyses concurrently into the cache, falling back to lookups one by one on failure."""
+    if concurrency <= 1:
+        return
+
+    from alhena_igo import isabl_async
+    with profiling.stage('isabl_prefetch') as record:
+        record['rows'] = len(analysis_ids)
+        try:
+            isabl_async.prefetch(analysis_ids, framework, version, concurrency=concurrency)
+        except Exception as e:
+            click.echo(click.style(f"Prefetching Isabl lookups failed, looking analyses up one by one: {e}", fg="yellow"), err=True)
 
 
 @cli.command()
@@ -145,36 +317,158 @@ def load(info: Info, analysis_id: str, projects: List[str], framework: str, vers
 @click.option('--isabl', help="Project PK from Isabl to pull from", required=True)
 @click.option('--framework', type=click.Choice(['scp', 'mondrian']), help="Framework: scp or mondrian", required=True)
 @click.option('--version', help="Isabl app version to load", required=True)
+@click.option('--workers', default=1, show_default=True, help="Number of analyses to load in parallel")
+@click.option('--ledger', 'ledger_path', default=load_ledger.DEFAULT_LEDGER_PATH, show_default=True, help="Local ledger of loaded analyses and their source files")
+@click.option('--no-ledger', is_flag=True, help="Only compare against analyses in Alhena, without the ledger")
+@click.option('--verify-sources', is_flag=True, help="Also compare the result files of analyses already loaded, reloading those that changed")
+@click.option('--isabl-concurrency', default=defaults.ISABL_CONCURRENCY, show_default=True, help="Isabl lookups to run at once when prefetching directories and metadata into the cache")
+@click.option('--pipeline-depth', default=0, show_default=True, help="With one worker, parse up to this many analyses ahead of the one being indexed (0 to parse and index in turn)")
+@bulk_options
 @pass_info
-def load_project(info: Info, alhena: List[str], isabl: str, framework:str, version: str):
-    projects = list(set(list(alhena) + ["DLP"]))
+def load_project(info: Info, alhena: List[str], isabl: str, framework:str, version: str, workers: int, ledger_path: str, no_ledger: bool, verify_sources: bool, isabl_concurrency: int, pipeline_depth: int, bulk_options: BulkOptions):
+    import alhena_igo.isabl
+    from alhena_igo import loader
 
-    isabl_records = alhena_igo.isabl.get_ids_from_isabl(isabl, framework, version)
-    isabl_pks = [record['dashboard_id'] for record in isabl_records]
-    alhena_analyses = [record['dashboard_id'] for record in info.es.get_analyses()]
+    projects = list(set(list(alhena) + ["DLP"]))
+    ledger = None if no_ledger else load_ledger.LoadLedger(ledger_path)
+
+    with profiling.stage('discovery'):
+        isabl_records = alhena_igo.isabl.get_ids_from_isabl(isabl, framework, version)
+        isabl_pks = [record['dashboard_id'] for record in isabl_records]
+        alhena_analyses = [record['dashboard_id'] for record in info.es.get_analyses()]
+
+    _prefetch_isabl(isabl_pks, framework, version, isabl_concurrency)
+
+    bulk_indexer = bulk_options.indexer(info)
+    plan = loader.plan_loads(isabl_pks, alhena_analyses, framework, version, ledger, verify_sources=verify_sources, bulk=bulk_indexer)
+    resume = plan[load_ledger.RESUME]
+    diff = plan[load_ledger.LOAD] + plan[load_ledger.RELOAD] + resume
+
+    click.echo(
+        f'{len(plan[load_ledger.SKIP])} unchanged, {len(plan[load_ledger.LOAD])} new, '
+        f'{len(plan[load_ledger.RELOAD])} changed, {len(resume)} partial'
+    )
+    click.echo(f'Loading {len(diff)} analyses with {workers} worker(s)')
+
+    failed = []
+    results = loader.load_analyses(
+        diff, framework, version, projects, info.host, info.port,
+        workers=workers, clean=True, es=info.es, ledger=ledger, resume=resume, pipeline_depth=pipeline_depth, bulk=bulk_indexer,
+    )
+    for analysis_id, error in results:
+        if error is None:
+            click.echo(f'Loaded {analysis_id}')
+        else:
+            failed.append(analysis_id)
+            click.echo(click.style(f'Failed {analysis_id}: {error}', fg='red'), err=True)
 
-    diff = list(set(isabl_pks) - set(alhena_analyses))
+    loaded = [pk for pk in isabl_pks if pk not in failed]
+    for project in projects:
+        info.es.add_analyses_to_project(project, loaded)
+        if ledger is not None:
+            # so that sync can remove them once they leave the Isabl project
+            ledger.add_members(isabl, project, loaded)
 
-    for analysis_id in diff: 
-        alhenaloader.clean_analysis(analysis_id, info.es)
+    click.echo(f'{len(diff) - len(failed)} loaded, {len(failed)} failed')
+    if failed:
+        click.echo(f"Failed analyses: {', '.join(sorted(failed))}", err=True)
+        raise SystemExit(1)
 
-        click.echo(f'Loading as ID {analysis_id}')
 
-        if framework == 'mondrian':
-            [alignment, hmmcopy] = alhena_igo.isabl.get_directories(analysis_id, framework, version)
-            data = load_qc_results(alignment, hmmcopy)
-        elif framework == 'scp':
-            [alignment, hmmcopy, annotation] = alhena_igo.isabl.get_directories(analysis_id, framework, version)
-            data = load_qc_results(alignment, hmmcopy, annotation)
+@cli.command()
+@click.option('--alhena', 'alhena', help='Projects to load into', multiple=True, default=[])
+@click.option('--isabl', help="Project PK from Isabl to pull from", required=True)
+@click.option('--framework', type=click.Choice(['scp', 'mondrian']), help="Framework: scp or mondrian", required=True)
+@click.option('--version', help="Isabl app version to load", required=True)
+@click.option('--workers', default=1, show_default=True, help="Number of analyses to load in parallel")
+@click.option('--ledger', 'ledger_path', default=load_ledger.DEFAULT_LEDGER_PATH, show_default=True, help="Local ledger of loaded analyses and project memberships")
+@click.option('--dry-run', is_flag=True, help="Print the plan and estimated volume without changing anything")
+@click.option('--verify-sources', is_flag=True, help="Also compare the result files of analyses already loaded, reloading those that changed")
+@click.option('--isabl-concurrency', default=defaults.ISABL_CONCURRENCY, show_default=True, help="Isabl lookups to run at once when prefetching directories and metadata into the cache")
+@click.option('--pipeline-depth', default=0, show_default=True, help="With one worker, parse up to this many analyses ahead of the one being indexed (0 to parse and index in turn)")
+@bulk_options
+@pass_info
+def sync(info: Info, alhena: List[str], isabl: str, framework: str, version: str, workers: int, ledger_path: str, dry_run: bool, verify_sources: bool, isabl_concurrency: int, pipeline_depth: int, bulk_options: BulkOptions):
+    """Sync an Isabl project into Alhena: add, reload and remove analyses and update project memberships."""
+    from alhena_igo import sync as project_sync
+
+    projects = sorted(set(list(alhena) + ["DLP"]))
+    ledger = load_ledger.LoadLedger(ledger_path)
+
+    bulk_indexer = bulk_options.indexer(info)
+    plan = project_sync.plan_sync(isabl, projects, framework, version, info.es, ledger, verify_sources=verify_sources, bulk=bulk_indexer)
+    click.echo(plan.summary())
+
+    if dry_run:
+        rows, size = project_sync.estimate_volume(plan, framework, version)
+        click.echo(f'Estimated volume: {rows:,} rows from {size / 1e6:,.1f} MB of compressed CSV')
+        return
+
+    if plan.is_empty():
+        click.echo('Nothing to do')
+        return
+
+    _prefetch_isabl(plan.to_load, framework, version, isabl_concurrency)
+
+    failed = []
+    results = project_sync.run_sync(
+        plan, framework, version, info.host, info.port, info.es, ledger, workers=workers, pipeline_depth=pipeline_depth, bulk=bulk_indexer,
+    )
+    for analysis_id, error in results:
+        if error is None:
+            click.echo(f'Loaded {analysis_id}')
         else:
-            raise Exception(f"Unknown framework '{framework}'.")
+            failed.append(analysis_id)
+            click.echo(click.style(f'Failed {analysis_id}: {error}', fg='red'), err=True)
 
-        metadata = alhena_igo.isabl.get_metadata(analysis_id)
+    click.echo(f'{len(plan.to_load) - len(failed)} loaded, {len(failed)} failed, {len(plan.remove)} removed')
+    if failed:
+        click.echo(f"Failed analyses: {', '.join(sorted(failed))}", err=True)
+        raise SystemExit(1)
 
-        alhenaloader.load_analysis(analysis_id, data,  metadata, list(projects), info.es, framework)
 
-    for project in projects:
-        info.es.add_analyses_to_project(project, isabl_pks)
+@cli.command()
+@click.option('--app', 'apps', type=(click.Choice(sorted(defaults.WATCHED_APPS)), str), multiple=True, required=True, help="Framework and Isabl app version to watch, e.g. --app mondrian v0.1.0; repeat for several")
+@click.option('--alhena', 'alhena', help='Projects to load into', multiple=True, default=[])
+@click.option('--isabl', help="Only watch analyses of this Isabl project PK")
+@click.option('--interval', default=defaults.WATCH_INTERVAL, show_default=True, help="Seconds between polls of Isabl")
+@click.option('--since', help="ISO timestamp to poll from when the ledger has no cursor yet, default now")
+@click.option('--workers', default=1, show_default=True, help="Number of analyses to load in parallel")
+@click.option('--retries', default=defaults.WATCH_RETRIES, show_default=True, help="Retries of a failed load, one per poll")
+@click.option('--once', is_flag=True, help="Poll once, load what was found and exit")
+@click.option('--ledger', 'ledger_path', default=load_ledger.DEFAULT_LEDGER_PATH, show_default=True, help="Local ledger of loaded analyses and poll cursors")
+@click.option('--isabl-concurrency', default=defaults.ISABL_CONCURRENCY, show_default=True, help="Isabl lookups to run at once when prefetching directories and metadata into the cache")
+@bulk_options
+@pass_info
+def watch(info: Info, apps, alhena: List[str], isabl: str, interval: float, since: str, workers: int, retries: int, once: bool, ledger_path: str, isabl_concurrency: int, bulk_options: BulkOptions):
+    """Poll Isabl for newly SUCCEEDED analyses and load them as they appear."""
+    from alhena_igo import watch as isabl_watch
+
+    projects = sorted(set(list(alhena) + ["DLP"]))
+    ledger = load_ledger.LoadLedger(ledger_path)
+
+    watcher = isabl_watch.Watcher(
+        list(apps), projects, info.host, info.port, info.es, ledger,
+        isabl_project=isabl, workers=workers, since=since, retries=retries,
+        bulk=bulk_options.indexer(info),
+        concurrency=isabl_concurrency,
+    )
+    click.echo(f"Watching {', '.join(f'{framework} {version}' for framework, version in apps)} every {interval}s")
+
+    failed = []
+    try:
+        with watcher:
+            for analysis_id, error in watcher.run(interval=interval, polls=1 if once else None):
+                if error is None:
+                    click.echo(f'Loaded {analysis_id}')
+                else:
+                    failed.append(analysis_id)
+                    click.echo(click.style(f'Failed {analysis_id}: {error}', fg='red'), err=True)
+    except KeyboardInterrupt:
+        click.echo('Stopped watching')
+
+    if once and failed:
+        raise SystemExit(1)
 
 
 @cli.command()
@@ -0,0 +1,35 @@
+"""
+Defaults and choices of command-line options.
+
+These are kept apart from the modules that use them so that the CLI can
+declare its options without importing pandas, alhenaloader, scgenome or
+isabl_cli. Each command imports those when it runs.
+
+.. currentmodule:: alhena_igo.defaults
+"""
+
+#: engines for parsing csverve files; pyarrow parses with multiple threads but cannot stream chunks
+CSV_ENGINES = ['c', 'pyarrow']
+DEFAULT_CSV_ENGINE = 'c'
+
+#: bin size of each fixed-size read tier, None for chromosome arms
+READ_TIERS = {
+    '1mb': 1000000,
+    '10mb': 10000000,
+    'arm': None,
+}
+
+#: Isabl app whose SUCCEEDED analyses are dashboards of each framework
+WATCHED_APPS = {
+    'mondrian': 'MONDRIAN-HMMCOPY',
+    'mondrian_nf': 'MONDRIAN-QC',
+    'scp': 'SCDNA-ANNOTATION',
+}
+
+WATCH_INTERVAL = 60  #: seconds between polls of Isabl when watching
+WATCH_RETRIES = 2  #: retries of a failed load when watching, one per poll
+
+ISABL_CONCURRENCY = 8  #: Isabl requests in flight at once
+
+#: analyses whose indices are looked up and deleted together when cleaning many analyses
+CLEAN_BATCH_SIZE = 100
@@ -1,10 +1,11 @@
-from scgenome.loaders.qc import load_qc_results
 import isabl_cli as ii
-import pandas as pd
 import alhenaloader
+import collections
 import logging
 import os
 
+from alhena_igo.cache import cached
+
 
 # def clean(aliquot_id, host, port, projects=None):
 #     analysis_id = get_id(aliquot_id)
@@ -42,6 +43,8 @@ import os
 #     es.add_analysis_to_projects(analysis_id, projects)
 
 
+# not final: the analysis picked can change as analyses are added to the experiment
+@cached('analysis_filtered_by_assembly')
 def get_analysis_filtered_by_assembly(experiment_sys_id, app_name, assembly):
     """
     Assembly filter does not work in Isabl for some reason, so fitlering in the
@@ -52,6 +55,10 @@ def get_analysis_filtered_by_assembly(experiment_sys_id, app_name, assembly):
         targets__system_id=experiment_sys_id,
     )
 
+    return _filter_by_assembly(analyses, experiment_sys_id, app_name, assembly)
+
+
+def _filter_by_assembly(analyses, experiment_sys_id, app_name, assembly):
     for analysis in analyses:
         if analysis.application.assembly.name == assembly:
             return analysis
@@ -59,6 +66,7 @@ def get_analysis_filtered_by_assembly(experiment_sys_id, app_name, assembly):
     raise Exception(f"Unable to retrieve analyses for {experiment_sys_id} - {app_name} - {assembly}")
 
 
+@cached('cataloged_qc_results', final=lambda results: results is not None)
 def get_isabl_cataloged_qc_results(analysis_pk: str, framework: str, version: str):
     if framework == 'mondrian':
         pass
@@ -83,6 +91,16 @@ def get_directories(analysis_pk: str, framework: str, version: str):
     MONDRIAN-HMMCOPY, MONDRIAN-NF-QC or SCDNA-ANNOTATION analysis primary key.
     """
 
+    return _get_directories_entry(analysis_pk, framework, version)['directories']
+
+
+def _directories_entry(analysis, directories):
+    """Return the directories of an analysis with its status, which decides whether they are cached for good."""
+    return {'status': analysis.status, 'directories': directories}
+
+
+@cached('analysis_directories', final=lambda entry: entry['status'] == 'SUCCEEDED')
+def _get_directories_entry(analysis_pk: str, framework: str, version: str):
     if framework == 'mondrian':
         hmmcopy = ii.get_analyses(pk=analysis_pk, application__name='MONDRIAN-HMMCOPY')
         assert len(hmmcopy) == 1
@@ -95,7 +113,7 @@ def get_directories(analysis_pk: str, framework: str, version: str):
             assembly
         )
 
-        return [alignment.storage_url, hmmcopy[0].storage_url]
+        return _directories_entry(hmmcopy[0], [alignment.storage_url, hmmcopy[0].storage_url])
 
     elif framework == 'mondrian_nf':
         qc = ii.get_analyses(
@@ -108,7 +126,7 @@ def get_directories(analysis_pk: str, framework: str, version: str):
         
 
         # quick way to add support mondrian-nf using exisiting mondrian logic
-        return [qc[0].storage_url]
+        return _directories_entry(qc[0], [qc[0].storage_url])
     
 
     elif framework == 'scp':
@@ -129,16 +147,36 @@ def get_directories(analysis_pk: str, framework: str, version: str):
             assembly
        	)
         
-        return [alignment.storage_url, hmmcopy.storage_url, annotation[0].storage_url]
+        return _directories_entry(annotation[0], [alignment.storage_url, hmmcopy.storage_url, annotation[0].storage_url])
 
     else:
         raise Exception(f"Unknown framework '{framework}'")
 
 
+@cached('assembly', final=lambda assembly: True)
+def get_assembly(pk: str):
+    """Return the name of the reference assembly an analysis was run against, e.g. GRCh37."""
+    return ii.get_instance("analyses", int(pk))["application"]["assembly"]["name"]
+
+
 def get_metadata(pk: str):
     """Return metadata object given target aliquot ID"""
 
+    return _get_metadata_entry(pk)['metadata']
+
+
+@cached('analysis_metadata', final=lambda entry: entry['status'] == 'SUCCEEDED')
+def _get_metadata_entry(pk: str):
     analysis = ii.get_instance("analyses", int(pk))
+    return _metadata_entry(pk, analysis)
+
+
+def _metadata_entry(pk, analysis):
+    """Return the metadata record of an analysis with its status, which decides whether it is cached for good."""
+    return {'status': analysis['status'], 'metadata': _metadata_record(pk, analysis)}
+
+
+def _metadata_record(pk, analysis):
     data = analysis["targets"][0]
 
     dashboard_id = pk
@@ -152,6 +190,24 @@ def get_metadata(pk: str):
     return metadata_record
 
 
+def get_merged_metadata(pks, dashboard_id):
+    """Return the metadata object of a dashboard merging several analyses."""
+
+    targets = [ii.get_instance("analyses", int(pk))["targets"][0] for pk in pks]
+
+    def join(values):
+        return ",".join(dict.fromkeys(values))
+
+    library_id = join(target["library_id"] for target in targets)
+    sample_id = join(target["sample"]["identifier"] for target in targets)
+    description = join(target["aliquot_id"] for target in targets)
+
+    additional_metadata = {"merged_analyses": join(str(pk) for pk in pks)}
+
+    metadata_record = alhenaloader.process_analysis_entry(dashboard_id, library_id, sample_id, description, additional_metadata)
+    return metadata_record
+
+
 def get_analysis(app, version, exp_system_id):
     """Return analysis record corresponding to system ID"""
     analyses = ii.get_analyses(
@@ -166,18 +222,21 @@ def get_analysis(app, version, exp_system_id):
     return None
 
 
-def get_id(aliquot_id, framework, version):
-    app = ''
-
+def _get_app(framework):
+    """Return the Isabl application that identifies a dashboard for the framework."""
     if framework == 'mondrian':
-        app = 'MONDRIAN-HMMCOPY'
+        return 'MONDRIAN-HMMCOPY'
     elif framework == 'mondrian-nf':
-        app = 'MONDRIAN-NF-QC'
+        return 'MONDRIAN-NF-QC'
     elif framework == 'scp':
-        app = 'SCDNA-ANNOTATION'
+        return 'SCDNA-ANNOTATION'
     else:
         raise Exception(f"Unknown framework '{framework}'.")
 
+
+def get_id(aliquot_id, framework, version):
+    app = _get_app(framework)
+
     analysis = ii.get_analyses(
         application__name=app,
         status='SUCCEEDED',
@@ -188,32 +247,64 @@ def get_id(aliquot_id, framework, version):
     return str(analysis[0].pk)
 
 
-def get_ids_from_isabl(project_pk, framework, version):
+def _get_analyses_by_target(project_pk, app, version):
+    """
+    Return SUCCEEDED analyses of the app in the project, keyed by target system ID.
+
+    This fetches all analyses with one (paginated) query instead of one query
+    per experiment.
+    """
+    analyses = ii.get_analyses(
+        application__name=app,
+        application__version=version,
+        targets__projects__pk=project_pk,
+        status='SUCCEEDED',
+    )
+
+    analyses_by_target = collections.defaultdict(list)
+    for analysis in analyses:
+        for target in analysis.targets:
+            analyses_by_target[target.system_id].append(analysis)
+
+    return analyses_by_target
+
+
+def get_ids_from_isabl(project_pk, framework, version, batched=True):
+    """
+    Return dashboard records for every experiment in the Isabl project with
+    exactly one SUCCEEDED analysis of the framework's app and version.
+
+    With ``batched`` the analyses are fetched for the whole project at once and
+    joined to experiments in memory, otherwise they are fetched per experiment.
+    """
     experiments = ii.get_experiments(
         projects__pk=project_pk,
         technique__name='Single Cell DNA Seq',
     )
 
-    app = ''
-    if framework == 'mondrian':
-        app = 'MONDRIAN-HMMCOPY'
-    elif framework == 'mondrian-nf':
-        app = 'MONDRIAN-NF-QC'
-    elif framework == 'scp':
-        app = 'SCDNA-ANNOTATION'
-    else:
-        raise Exception(f"Unknown framework '{framework}'.")
+    app = _get_app(framework)
+
+    if batched:
+        analyses_by_target = _get_analyses_by_target(project_pk, app, version)
 
     data = []
     for experiment in experiments:
-        analysis = get_analysis(app, version, experiment.system_id)
+        if batched:
+            analyses = analyses_by_target.get(experiment.system_id, [])
+            analysis = analyses[0] if len(analyses) == 1 else None
+        else:
+            analysis = get_analysis(app, version, experiment.system_id)
+
         if analysis is not None:
-            data.append({
-                'system_id': experiment.system_id,
-                'sample': experiment.sample.identifier,
-                'aliquot': experiment.aliquot_id,
-                "dashboard_id": str(analysis.pk),
-            })
+            data.append(_dashboard_record(experiment, analysis))
     
     return data
 
+
+def _dashboard_record(experiment, analysis):
+    return {
+        'system_id': experiment.system_id,
+        'sample': experiment.sample.identifier,
+        'aliquot': experiment.aliquot_id,
+        "dashboard_id": str(analysis.pk),
+    }
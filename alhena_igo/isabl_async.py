@@ -0,0 +1,412 @@
+"""
+Asynchronous Isabl lookups for resolving many analyses at once.
+
+`AsyncIsablClient` talks to the Isabl REST API directly, with the same
+``ISABL_API_URL`` and API token as isabl_cli. Requests run over a pool of
+persistent HTTP connections, at most ``concurrency`` at a time, and requests
+failing with a connection error or a 429/5xx response are retried with
+exponential backoff. HTTPS certificates are verified unless
+``ISABL_VERIFY_SSL`` is set to 0, false or no.
+
+The client is not built on an asyncio HTTP library: each request is a
+blocking `http.client` call run on a thread pool of ``concurrency`` threads,
+which the coroutines await. That keeps the client free of extra
+dependencies; the concurrency is that of the threads.
+
+The lookups here mirror `alhena_igo.isabl`, and `prefetch` stores their
+results in the Isabl cache under the same keys, so that the synchronous
+lookups of a load hit the cache.
+
+.. currentmodule:: alhena_igo.isabl_async
+"""
+import asyncio
+import http.client
+import json
+import logging
+import os
+import queue
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import urlencode, urljoin, urlsplit
+
+import alhena_igo.cache
+import alhena_igo.isabl
+from alhena_igo import defaults
+
+logger = logging.getLogger('alhena_igo')
+
+DEFAULT_CONCURRENCY = defaults.ISABL_CONCURRENCY  #: Isabl requests in flight at once
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  #: seconds before the first retry, doubled for each further retry
+DEFAULT_TIMEOUT = 60
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class IsablRequestError(Exception):
+    """An Isabl request that failed, or kept failing after all retries."""
+
+
+class IsablRecord(dict):
+    """A JSON object from Isabl, with keys also readable as attributes like isabl_cli instances."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _default_api_url():
+    # as isabl_cli resolves it
+    api_url = os.environ.get('ISABL_API_URL', 'http://localhost:8000/api/v1/')
+    return api_url if api_url.endswith('/') else api_url + '/'
+
+
+def _default_token():
+    try:
+        from isabl_cli.settings import user_settings
+        return user_settings.api_token
+    except Exception:
+        return None
+
+
+def _default_verify():
+    return os.environ.get('ISABL_VERIFY_SSL', '1').strip().lower() not in ('0', 'false', 'no')
+
+
+def _ssl_context(verify: bool):
+    context = ssl.create_default_context()
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def _api_filters(filters):
+    """Return query parameters for filters, as isabl_cli formats them."""
+    params = []
+    for key, value in filters.items():
+        key = key.replace('.', '__')
+        if isinstance(value, (str, int, float)):
+            params.append((key, value))
+        elif key.endswith('__in'):
+            params.append((key, ','.join(map(str, value))))
+        else:
+            params.extend((key, str(v)) for v in value)
+    return params
+
+
+class _ConnectionPool(object):
+    """Persistent HTTP connections to one host, reused by the client's threads."""
+
+    def __init__(self, api_url: str, timeout: float = DEFAULT_TIMEOUT, verify: bool = True):
+        url = urlsplit(api_url)
+        self.https = url.scheme == 'https'
+        self.netloc = url.netloc
+        self.timeout = timeout
+        self._context = _ssl_context(verify) if self.https else None
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout, context=self._context)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def request(self, method: str, path: str, headers):
+        """Return the status and body of a request, on an idle connection if there is one."""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+        return response.status, body
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class AsyncIsablClient(object):
+    """
+    Isabl REST client for use from asyncio code, as an async context manager.
+
+    KwArgs:
+        api_url (str): Isabl API URL, default ``ISABL_API_URL`` as for isabl_cli.
+        token (str): API token, default the isabl_cli user token.
+        concurrency (int): maximum number of requests in flight.
+        retries (int): retries of a request failing with a connection error or 429/5xx.
+        backoff (float): seconds before the first retry, doubled for each further retry.
+        verify (bool): verify HTTPS certificates, default unless ``ISABL_VERIFY_SSL`` is 0, false or no.
+    """
+
+    def __init__(self, api_url: str = None, token: str = None, concurrency: int = DEFAULT_CONCURRENCY,
+                 retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF, timeout: float = DEFAULT_TIMEOUT,
+                 verify: bool = None):
+        self.api_url = api_url or _default_api_url()
+        self.token = token if token is not None else _default_token()
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0  #: requests sent, including retries
+
+        self._pool = _ConnectionPool(self.api_url, timeout=timeout, verify=_default_verify() if verify is None else verify)
+        self._executor = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+        self._pool.close()
+
+    def _url(self, path: str) -> str:
+        return path if path.startswith('http') else urljoin(self.api_url, path.lstrip('/'))
+
+    async def request(self, url: str, params=None):
+        """GET a URL or API path and return its decoded JSON."""
+        url = self._url(url)
+        query = urlencode(list(params or []) + [('format', 'json')])
+        split = urlsplit(url)
+        path = split.path + '?' + (split.query + '&' if split.query else '') + query
+
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Token {self.token}'
+
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            error = None
+            async with self._semaphore:
+                self.requests += 1
+                try:
+                    status, body = await loop.run_in_executor(self._executor, self._pool.request, 'GET', path, headers)
+                except (http.client.HTTPException, OSError) as e:
+                    error = f'{type(e).__name__}: {e}'
+                else:
+                    if status < 400:
+                        return json.loads(body, object_hook=IsablRecord)
+                    if status not in RETRY_STATUSES:
+                        raise IsablRequestError(f"GET {url} failed with status {status}: {body[:200]!r}")
+                    error = f'status {status}'
+
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"GET {url} failed with {error}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+        raise IsablRequestError(f"GET {url} failed after {self.retries + 1} attempts: {error}")
+
+    async def get_instances(self, endpoint: str, **filters):
+        """Return every instance of an endpoint matching the filters, following pagination."""
+        params = _api_filters({'limit': 5000, **filters})
+        page = await self.request(f'/{endpoint}', params)
+        instances = list(page['results'])
+        while page['next']:
+            page = await self.request(page['next'])
+            instances.extend(page['results'])
+        return instances
+
+    async def get_instance(self, endpoint: str, identifier):
+        return await self.request(f'/{endpoint}/{identifier}')
+
+    async def get_analyses(self, **filters):
+        return await self.get_instances('analyses', **filters)
+
+    async def get_experiments(self, **filters):
+        return await self.get_instances('experiments', **filters)
+
+
+async def get_analysis_filtered_by_assembly(client: AsyncIsablClient, experiment_sys_id, app_name, assembly):
+    analyses = await client.get_analyses(application__name=app_name, targets__system_id=experiment_sys_id)
+    return alhena_igo.isabl._filter_by_assembly(analyses, experiment_sys_id, app_name, assembly)
+
+
+async def get_directories(client: AsyncIsablClient, analysis_pk: str, framework: str, version: str):
+    """As `alhena_igo.isabl.get_directories`, with lookups of the related analyses run concurrently."""
+    return (await _get_directories_entry(client, analysis_pk, framework, version))['directories']
+
+
+async def _get_directories_entry(client: AsyncIsablClient, analysis_pk: str, framework: str, version: str):
+    _entry = alhena_igo.isabl._directories_entry
+    if framework == 'mondrian':
+        hmmcopy = await client.get_analyses(pk=analysis_pk, application__name='MONDRIAN-HMMCOPY')
+        assert len(hmmcopy) == 1
+
+        alignment = await get_analysis_filtered_by_assembly(
+            client, hmmcopy[0].targets[0].system_id, 'MONDRIAN-ALIGNMENT', hmmcopy[0].application.assembly.name
+        )
+        return _entry(hmmcopy[0], [alignment.storage_url, hmmcopy[0].storage_url])
+
+    elif framework == 'mondrian_nf':
+        qc = await client.get_analyses(pk=analysis_pk, application__name='MONDRIAN-QC')
+        assert len(qc) == 1
+        return _entry(qc[0], [qc[0].storage_url])
+
+    elif framework == 'scp':
+        annotation = await client.get_analyses(pk=analysis_pk, application__name='SCDNA-ANNOTATION')
+        assert len(annotation) == 1
+
+        system_id = annotation[0].targets[0].system_id
+        assembly = annotation[0].application.assembly.name
+        hmmcopy, alignment = await asyncio.gather(
+            get_analysis_filtered_by_assembly(client, system_id, 'SCDNA-HMMCOPY', assembly),
+            get_analysis_filtered_by_assembly(client, system_id, 'SCDNA-ALIGNMENT', assembly),
+        )
+        return _entry(annotation[0], [alignment.storage_url, hmmcopy.storage_url, annotation[0].storage_url])
+
+    else:
+        raise Exception(f"Unknown framework '{framework}'")
+
+
+async def get_metadata(client: AsyncIsablClient, pk: str):
+    """As `alhena_igo.isabl.get_metadata`."""
+    return (await _get_metadata_entry(client, pk))['metadata']
+
+
+async def _get_metadata_entry(client: AsyncIsablClient, pk: str):
+    analysis = await client.get_instance('analyses', int(pk))
+    return alhena_igo.isabl._metadata_entry(pk, analysis)
+
+
+async def get_ids_from_isabl(client: AsyncIsablClient, project_pk, framework: str, version: str, batched: bool = True):
+    """
+    As `alhena_igo.isabl.get_ids_from_isabl`.
+
+    Experiments and analyses are fetched concurrently, and without ``batched``
+    the per-experiment analysis lookups run concurrently too.
+    """
+    app = alhena_igo.isabl._get_app(framework)
+    analysis_filters = {'application__name': app, 'application__version': version, 'status': 'SUCCEEDED'}
+
+    experiments = client.get_experiments(projects__pk=project_pk, technique__name='Single Cell DNA Seq')
+    if batched:
+        experiments, analyses = await asyncio.gather(
+            experiments, client.get_analyses(targets__projects__pk=project_pk, **analysis_filters)
+        )
+        analyses_by_target = {}
+        for analysis in analyses:
+            for target in analysis.targets:
+                analyses_by_target.setdefault(target.system_id, []).append(analysis)
+        matches = [analyses_by_target.get(experiment.system_id, []) for experiment in experiments]
+    else:
+        experiments = await experiments
+        matches = await asyncio.gather(*[
+            client.get_analyses(targets__system_id=experiment.system_id, **analysis_filters)
+            for experiment in experiments
+        ])
+
+    return [
+        alhena_igo.isabl._dashboard_record(experiment, analyses[0])
+        for experiment, analyses in zip(experiments, matches)
+        if len(analyses) == 1
+    ]
+
+
+async def resolve_with(client: AsyncIsablClient, pks: List[str], framework: str, version: str, directories: bool = True, metadata: bool = True):
+    """As `resolve`, with an open client."""
+    async def resolve_one(pk):
+        result = {}
+        if directories:
+            entry = await _get_directories_entry(client, pk, framework, version)
+            result['directories'] = entry['directories']
+            result['status'] = entry['status']
+        if metadata:
+            entry = await _get_metadata_entry(client, pk)
+            result['metadata'] = entry['metadata']
+            result['status'] = entry['status']
+        return result
+
+    results = await asyncio.gather(*[resolve_one(pk) for pk in pks], return_exceptions=True)
+    return dict(zip(pks, results))
+
+
+async def _resolve(pks: List[str], framework: str, version: str, directories: bool, metadata: bool, **client_options):
+    async with AsyncIsablClient(**client_options) as client:
+        return await resolve_with(client, pks, framework, version, directories, metadata)
+
+
+def resolve(pks: List[str], framework: str, version: str, directories: bool = True, metadata: bool = True, **client_options):
+    """
+    Look up directories and metadata of many analyses concurrently.
+
+    Returns a dict of pk to a dict with ``directories``, ``metadata`` and the
+    analysis ``status``, or to the exception raised looking the analysis up.
+    ``client_options`` are passed on to `AsyncIsablClient`.
+    """
+    return asyncio.run(_resolve(list(pks), framework, version, directories, metadata, **client_options))
+
+
+def _cache_keys(pk: str, framework: str, version: str):
+    return alhena_igo.cache.cache_key('analysis_directories', pk, framework, version), alhena_igo.cache.cache_key('analysis_metadata', pk)
+
+
+async def prefetch_with(client: AsyncIsablClient, pks: List[str], framework: str, version: str):
+    """As `prefetch`, with an open client, e.g. one kept open between polls."""
+    cache = alhena_igo.cache.get_isabl_cache()
+    if cache is None:
+        return 0
+
+    pks = [pk for pk in pks if not all(cache.get(key)[0] for key in _cache_keys(pk, framework, version))]
+    if not pks:
+        return 0
+
+    start = time.time()
+    results = await resolve_with(client, pks, framework, version)
+
+    prefetched = 0
+    for pk, result in results.items():
+        if isinstance(result, Exception):
+            logger.warning(f"Prefetching Isabl lookups of {pk} failed: {result}")
+            continue
+        directories_key, metadata_key = _cache_keys(pk, framework, version)
+        # final as the `cached` lookups in alhena_igo.isabl would mark them
+        final = result['status'] == 'SUCCEEDED'
+        cache.set(directories_key, {'status': result['status'], 'directories': result['directories']}, final=final)
+        cache.set(metadata_key, {'status': result['status'], 'metadata': result['metadata']}, final=final)
+        prefetched += 1
+
+    logger.info(f"Prefetched Isabl lookups of {prefetched} analyses in {time.time() - start:.1f}s")
+    return prefetched
+
+
+async def _prefetch(pks: List[str], framework: str, version: str, **client_options):
+    async with AsyncIsablClient(**client_options) as client:
+        return await prefetch_with(client, pks, framework, version)
+
+
+def prefetch(pks: List[str], framework: str, version: str, **client_options):
+    """
+    Resolve directories and metadata of many analyses into the Isabl cache.
+
+    Later calls to `alhena_igo.isabl.get_directories` and `get_metadata`
+    for these analyses, e.g. in load workers, are then cache hits. Does
+    nothing if the cache is disabled, and skips analyses already cached.
+    Returns the number of analyses whose lookups were cached; failed lookups
+    are logged and left to the synchronous path.
+    """
+    if alhena_igo.cache.get_isabl_cache() is None:
+        return 0
+
+    return asyncio.run(_prefetch(list(pks), framework, version, **client_options))
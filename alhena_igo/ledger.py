@@ -0,0 +1,242 @@
+"""
+Local ledger of analyses loaded into Alhena.
+
+For each analysis the ledger records the source files it was loaded from
+(with sizes and modification times), the app version and parse options, the
+load status and which load steps completed. `load_project` uses it to skip
+unchanged analyses, resume partial loads and reload analyses whose inputs
+changed. It also records which analyses `sync` added to each Alhena project,
+and how far `watch` has polled Isabl.
+
+.. currentmodule:: alhena_igo.ledger
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from alhena_igo.cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger('alhena_igo')
+
+DEFAULT_LEDGER_PATH = os.path.join(DEFAULT_CACHE_DIR, 'ledger.sqlite')
+
+LOADING = 'loading'
+LOADED = 'loaded'
+
+SKIP = 'skip'
+LOAD = 'load'
+RELOAD = 'reload'
+RESUME = 'resume'
+
+
+def fingerprint(paths):
+    """
+    Return size and modification time of every file under the given paths.
+
+    Directories are walked recursively. Missing paths are recorded with a size
+    of None so that their appearance counts as a change.
+    """
+    files = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                for filename in filenames:
+                    filepath = os.path.join(root, filename)
+                    stat = os.stat(filepath)
+                    files[filepath] = [stat.st_size, stat.st_mtime]
+        elif os.path.exists(path):
+            stat = os.stat(path)
+            files[path] = [stat.st_size, stat.st_mtime]
+        else:
+            files[path] = [None, None]
+
+    return files
+
+
+class Checkpoint(object):
+    """Completed load steps of one analysis, persisted in the ledger."""
+
+    def __init__(self, ledger, analysis_id: str):
+        self.ledger = ledger
+        self.analysis_id = analysis_id
+
+    def is_done(self, step: str) -> bool:
+        with self.ledger._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM load_steps WHERE analysis_id = ? AND step = ?",
+                (self.analysis_id, step)
+            ).fetchone()
+        return row is not None
+
+    def done(self, step: str):
+        with self.ledger._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO load_steps (analysis_id, step) VALUES (?, ?)",
+                (self.analysis_id, step)
+            )
+
+
+class LoadLedger(object):
+    """SQLite ledger of analysis loads. Only the path is kept, so it can be passed to pool workers."""
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self.path = path
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS loads ("
+                "analysis_id TEXT PRIMARY KEY, framework TEXT, version TEXT, "
+                "sources TEXT, options TEXT, status TEXT, error TEXT, updated REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS load_steps ("
+                "analysis_id TEXT, step TEXT, PRIMARY KEY (analysis_id, step))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS project_members ("
+                "isabl_project TEXT, alhena_project TEXT, analysis_id TEXT, "
+                "PRIMARY KEY (isabl_project, alhena_project, analysis_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cursors ("
+                "name TEXT PRIMARY KEY, value TEXT, updated REAL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get(self, analysis_id: str):
+        """Return the ledger entry of an analysis as a dict, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT framework, version, sources, options, status, error, updated "
+                "FROM loads WHERE analysis_id = ?", (analysis_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        framework, version, sources, options, status, error, updated = row
+        return {
+            'analysis_id': analysis_id,
+            'framework': framework,
+            'version': version,
+            'sources': json.loads(sources),
+            'options': json.loads(options),
+            'status': status,
+            'error': error,
+            'updated': updated,
+        }
+
+    def start(self, analysis_id: str, framework: str, version: str, sources, options, resume: bool = False):
+        """Record that a load started. Unless resuming, completed steps of earlier loads are dropped."""
+        with self._connect() as conn:
+            if not resume:
+                conn.execute("DELETE FROM load_steps WHERE analysis_id = ?", (analysis_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO loads "
+                "(analysis_id, framework, version, sources, options, status, error, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                (analysis_id, framework, version, json.dumps(sources), json.dumps(options, sort_keys=True), LOADING, time.time())
+            )
+
+    def finish(self, analysis_id: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE loads SET status = ?, error = NULL, updated = ? WHERE analysis_id = ?",
+                (LOADED, time.time(), analysis_id)
+            )
+
+    def fail(self, analysis_id: str, error: str):
+        """Record an error. The load stays partial, so it can be resumed."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE loads SET error = ?, updated = ? WHERE analysis_id = ?",
+                (error, time.time(), analysis_id)
+            )
+
+    def remove(self, analysis_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM loads WHERE analysis_id = ?", (analysis_id,))
+            conn.execute("DELETE FROM load_steps WHERE analysis_id = ?", (analysis_id,))
+
+    def get_members(self, isabl_project: str):
+        """Return the analyses synced from an Isabl project, as a dict of Alhena project to set of IDs."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT alhena_project, analysis_id FROM project_members WHERE isabl_project = ?",
+                (isabl_project,)
+            ).fetchall()
+
+        members = {}
+        for alhena_project, analysis_id in rows:
+            members.setdefault(alhena_project, set()).add(analysis_id)
+        return members
+
+    def add_members(self, isabl_project: str, alhena_project: str, analysis_ids):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO project_members (isabl_project, alhena_project, analysis_id) VALUES (?, ?, ?)",
+                [(isabl_project, alhena_project, analysis_id) for analysis_id in analysis_ids]
+            )
+
+    def remove_members(self, isabl_project: str, alhena_project: str, analysis_ids):
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM project_members WHERE isabl_project = ? AND alhena_project = ? AND analysis_id = ?",
+                [(isabl_project, alhena_project, analysis_id) for analysis_id in analysis_ids]
+            )
+
+    def get_cursor(self, name: str):
+        """Return the value of a named cursor, e.g. the Isabl modification time `watch` has polled up to, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def set_cursor(self, name: str, value: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cursors (name, value, updated) VALUES (?, ?, ?)",
+                (name, value, time.time())
+            )
+
+    def is_loaded(self, analysis_id: str, version: str, options) -> bool:
+        """Return whether an analysis finished loading with this version and options, whatever its sources."""
+        entry = self.get(analysis_id)
+        return (
+            entry is not None
+            and entry['status'] == LOADED
+            and entry['version'] == version
+            and entry['options'] == json.loads(json.dumps(options, sort_keys=True))
+        )
+
+    def checkpoint(self, analysis_id: str) -> Checkpoint:
+        return Checkpoint(self, analysis_id)
+
+    def plan(self, analysis_id: str, version: str, sources, options, in_alhena: bool) -> str:
+        """
+        Return what to do with an analysis: SKIP, LOAD, RELOAD or RESUME.
+
+        Analyses in Alhena that the ledger has no record of were loaded before
+        the ledger existed and are skipped.
+        """
+        entry = self.get(analysis_id)
+
+        if entry is None:
+            return SKIP if in_alhena else LOAD
+
+        unchanged = (
+            entry['version'] == version
+            and entry['sources'] == sources
+            and entry['options'] == json.loads(json.dumps(options, sort_keys=True))
+        )
+
+        if not unchanged:
+            return RELOAD
+        if entry['status'] == LOADED:
+            return SKIP if in_alhena else RELOAD
+        return RESUME
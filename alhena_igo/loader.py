@@ -0,0 +1,817 @@
+"""
+Helpers that pull QC results for an analysis and load them into Alhena.
+
+.. currentmodule:: alhena_igo.loader
+"""
+import contextlib
+import logging
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import List
+
+import alhenaloader
+import pandas as pd
+from scgenome.loaders.qc import load_qc_results
+
+import alhena_igo.cache
+import alhena_igo.cell_summary
+import alhena_igo.isabl
+import alhena_igo.ledger
+import alhena_igo.memory
+import alhena_igo.table_cache
+import alhena_igo.tiers
+from alhena_igo import defaults, profiling
+from alhena_igo.utils import RowFilter, TableLoader, cells_passing_quality, process_data_chunks, union_categories, _categorical_cols_align, _categorical_cols_hmmcopy, standard_hmmcopy_reads_cols
+from alhena_igo.utils import memory_report, _dtypes_hmmcopy_reads, _dtypes_hmmcopy_segs, _dtypes_metrics, _dtypes_gc_metrics
+
+logger = logging.getLogger('alhena_igo')
+
+#: mondrian_nf QC tables: cataloged result, categorical columns, columns to read and compact dtypes
+MONDRIAN_NF_TABLES = {
+    'align_metrics':   ('metrics', _categorical_cols_align, None, _dtypes_metrics),
+    'gc_metrics':      ('gc_metrics', _categorical_cols_align, None, _dtypes_gc_metrics),
+    'hmmcopy_reads':   ('reads', _categorical_cols_hmmcopy, standard_hmmcopy_reads_cols, _dtypes_hmmcopy_reads),
+    'hmmcopy_segs':    ('segments', _categorical_cols_hmmcopy, None, _dtypes_hmmcopy_segs),
+    'hmmcopy_metrics': ('metrics', _categorical_cols_hmmcopy, None, _dtypes_metrics),
+}
+
+#: Alhena index suffixes of tables that can be streamed in chunks
+STREAMED_TABLE_INDEX = {
+    'hmmcopy_reads': 'bins',
+}
+
+#: rows of a whole streamable table loaded through alhenaloader when indexing with a bulk indexer, which writes the rest
+BULK_HEAD_ROWS = 5000
+#: rows of the rest written and checkpointed at a time
+BULK_SLICE_ROWS = 100000
+
+#: indices `alhenaloader.load_analysis` creates for an analysis, named ``<analysis>_<suffix>``
+ALHENA_INDEX_SUFFIXES = ['qc', 'segs', 'bins', 'gc_bias']
+
+#: analyses whose indices are looked up and deleted together when cleaning many analyses
+CLEAN_BATCH_SIZE = defaults.CLEAN_BATCH_SIZE
+
+# Elasticsearch client for pool worker processes, created once per process
+_worker_es = None
+
+
+def analysis_indices(analysis_id: str) -> List[str]:
+    """
+    Return the names of every index an analysis can have in Alhena.
+
+    These are exact names rather than a ``<analysis>_*`` pattern, which would
+    also match the indices of merged analyses such as ``1_2``.
+    """
+    return [f"{analysis_id.lower()}_{suffix}" for suffix in ALHENA_INDEX_SUFFIXES] + derived_indices(analysis_id)
+
+
+def derived_indices(analysis_id: str) -> List[str]:
+    """Return the names of the indices of an analysis built at load time, which `alhenaloader.clean_analysis` does not know of."""
+    return (
+        [alhena_igo.tiers.tier_index(analysis_id, tier) for tier in defaults.READ_TIERS]
+        + [alhena_igo.cell_summary.cell_summary_index(analysis_id)]
+    )
+
+
+def clean_analysis(analysis_id: str, es, bulk=None):
+    """
+    Remove an analysis from Alhena: its records, project memberships and every index, including the derived ones.
+
+    With a `bulk.BulkIndexer`, the derived indices are found and deleted with
+    one request each, instead of one per index.
+    """
+    with profiling.stage('clean', analysis=analysis_id):
+        if bulk is not None:
+            bulk.delete_indices(bulk.indices(derived_indices(analysis_id)))
+        else:
+            for index in derived_indices(analysis_id):
+                es.delete_index(index)
+        alhenaloader.clean_analysis(analysis_id, es)
+
+
+def _parse_mondrian_nf_table(cataloged_results, table: str, table_loader: TableLoader = None, chunksize: int = None, row_filter: RowFilter = None):
+    result, categorical_cols, usecols, dtype = MONDRIAN_NF_TABLES[table]
+    usecols = list(usecols) if usecols else None
+
+    if chunksize:
+        return process_data_chunks(cataloged_results[result], categorical_cols, usecols=usecols, dtype=dtype, chunksize=chunksize, row_filter=row_filter)
+
+    with profiling.stage('table', table=table) as record:
+        data = table_loader.load(cataloged_results[result], categorical_cols, usecols=usecols, dtype=dtype)
+        record['rows'] = len(data)
+        record['memory_bytes'] = int(data.memory_usage(index=True, deep=True).sum())
+
+    return data
+
+
+def get_row_filter(cataloged_results, cells: List[str] = None, chromosomes: List[str] = None, min_quality: float = None):
+    """
+    Return the `RowFilter` for the given predicates, or None if there are none.
+
+    ``min_quality`` is resolved to the cells whose quality in the cataloged
+    metrics is at least that value.
+    """
+    if cells is None and chromosomes is None and min_quality is None:
+        return None
+
+    row_filter = RowFilter(cells=cells, chromosomes=chromosomes)
+    if min_quality is not None:
+        row_filter = row_filter.intersect_cells(cells_passing_quality(cataloged_results['metrics'], min_quality))
+
+    return row_filter
+
+
+def _plan_memory(cataloged_results, budget, chunksize: int = None):
+    """
+    Return the chunk size to stream ``hmmcopy_reads`` in within a `memory.MemoryBudget`, None to parse it whole.
+
+    Tables are estimated before they are parsed, without row filters, so the
+    estimates are upper bounds. Raises a `memory.MemoryBudgetError` if the
+    tables that cannot be streamed, or chunks of the reads, do not fit.
+    """
+    estimates = {}
+    fixed = {}
+    for table, (result, categorical_cols, usecols, dtype) in MONDRIAN_NF_TABLES.items():
+        dtype = {**{col: 'category' for col in categorical_cols}, **dtype}
+        with profiling.stage('estimate', table=table):
+            estimates[table] = alhena_igo.memory.estimate_table(cataloged_results[result], usecols=list(usecols) if usecols else None, dtype=dtype)
+        # tables from the same cataloged result share a single read
+        shared = any(MONDRIAN_NF_TABLES[other][0] == result for other in fixed)
+        if table not in STREAMED_TABLE_INDEX and not shared:
+            rows, bytes_per_row = estimates[table]
+            fixed[table] = int(rows * bytes_per_row)
+
+    budget.check("Parsing the QC tables", fixed)
+    for table, nbytes in fixed.items():
+        budget.track(table, nbytes)
+
+    rows, bytes_per_row = estimates['hmmcopy_reads']
+    max_rows = budget.chunk_rows('hmmcopy_reads', bytes_per_row)
+    if chunksize is None and rows <= max_rows:
+        return None
+
+    chunksize = min(chunksize or max_rows, max_rows)
+    logger.info(
+        f"Streaming an estimated {rows} rows of hmmcopy_reads in chunks of {chunksize} rows to fit "
+        f"the memory budget of {alhena_igo.memory.format_size(budget.max_bytes)}"
+    )
+    return chunksize
+
+
+def _fit_memory_budget(data, budget):
+    """
+    Track the resident size of parsed tables, spilling streamable tables that do not fit to temp files.
+
+    Spilled tables are replaced by a `memory.SpilledTable` of chunks that fit
+    beside the other tables. Raises a `memory.MemoryBudgetError` if the tables
+    that cannot be streamed do not fit.
+    """
+    for table in list(budget.resident):
+        budget.release(table)
+
+    streamable = {}
+    for table, df in data.items():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        if table in STREAMED_TABLE_INDEX:
+            streamable[table] = alhena_igo.memory.frame_bytes(df)
+        else:
+            budget.track(table, alhena_igo.memory.frame_bytes(df))
+
+    budget.check("Indexing the QC tables", {})
+    for table, nbytes in streamable.items():
+        df = data[table]
+        if budget.used + nbytes * alhena_igo.memory.STREAM_OVERHEAD <= budget.max_bytes:
+            budget.track(table, nbytes)
+            continue
+
+        chunksize = budget.chunk_rows(table, nbytes / max(len(df), 1))
+        with profiling.stage('spill', table=table) as record:
+            record['rows'] = len(df)
+            record['memory_bytes'] = nbytes
+            data[table] = alhena_igo.memory.SpilledTable(df, chunksize)
+        logger.info(
+            f"Spilled {alhena_igo.memory.format_size(nbytes)} of {table} to {data[table].path}, "
+            f"to be indexed in chunks of {chunksize} rows"
+        )
+
+    return data
+
+
+def get_mondrian_nf_data(cataloged_results, chunksize: int = None, engine: str = None, parse_workers: int = 1, cells: List[str] = None, chromosomes: List[str] = None, min_quality: float = None, max_memory: int = None):
+    """
+    Parse the mondrian_nf QC tables from cataloged MONDRIAN-QC results.
+
+    Tables are parsed concurrently in a pool of ``parse_workers`` threads, and
+    tables from the same cataloged result share a single read. If ``chunksize``
+    is given ``hmmcopy_reads`` is returned as a lazy iterator of chunks
+    instead, and is read as it is indexed.
+
+    ``cells``, ``chromosomes`` and ``min_quality`` restrict the rows loaded.
+    They are applied chunk by chunk as tables are parsed, see `get_row_filter`.
+
+    With ``max_memory`` bytes, ``hmmcopy_reads`` is streamed in chunks that
+    fit the budget when it does not fit whole, see `memory`.
+    """
+    row_filter = get_row_filter(cataloged_results, cells=cells, chromosomes=chromosomes, min_quality=min_quality)
+
+    budget = None
+    if max_memory is not None:
+        budget = alhena_igo.memory.MemoryBudget(max_memory)
+        chunksize = _plan_memory(cataloged_results, budget, chunksize=chunksize)
+
+    data = {}
+    if chunksize:
+        data['hmmcopy_reads'] = _parse_mondrian_nf_table(cataloged_results, 'hmmcopy_reads', chunksize=chunksize, row_filter=row_filter)
+
+    table_loader = TableLoader(engine=engine, row_filter=row_filter)
+    with ThreadPoolExecutor(max_workers=max(parse_workers, 1)) as executor:
+        futures = {
+            table: executor.submit(_parse_mondrian_nf_table, cataloged_results, table, table_loader=table_loader)
+            for table in MONDRIAN_NF_TABLES if table not in data
+        }
+        for table, future in futures.items():
+            data[table] = future.result()
+
+    data = {table: data[table] for table in MONDRIAN_NF_TABLES}
+    if budget is not None:
+        _fit_memory_budget(data, budget)
+
+    return data
+
+
+def _load_qc_results(framework: str, **results_dirs):
+    """Call scgenome's `load_qc_results`, through the table cache if it is enabled."""
+    cache = alhena_igo.table_cache.get_table_cache()
+    if cache is None:
+        return load_qc_results(framework, **results_dirs)
+
+    sources = alhena_igo.ledger.fingerprint(sorted(d for d in results_dirs.values() if d))
+    key = cache.key(framework, sorted(results_dirs.items()), sources)
+
+    data = cache.get_tables(key)
+    if data is None:
+        data = load_qc_results(framework, **results_dirs)
+        cache.set_tables(key, data)
+
+    return data
+
+
+def get_qc_data(analysis_id: str, framework: str, version: str, chunksize: int = None, engine: str = None, parse_workers: int = 1, cells: List[str] = None, chromosomes: List[str] = None, min_quality: float = None, max_memory: int = None):
+    """
+    Return the QC tables for an analysis, keyed by table name.
+
+    For mondrian_nf, if ``chunksize`` is given ``hmmcopy_reads`` is returned as
+    an iterator of chunks of that many rows instead of a single DataFrame,
+    ``engine`` selects the CSV parse engine (see `utils.CSV_ENGINES`) and
+    ``parse_workers`` tables are parsed at once. ``cells``, ``chromosomes``
+    and ``min_quality`` filter rows while parsing.
+
+    With ``max_memory`` bytes, tables that can be streamed are returned as
+    chunks when they do not fit the budget: read in chunks for mondrian_nf,
+    and spilled to a temp file once parsed otherwise. A
+    `memory.MemoryBudgetError` is raised if the other tables do not fit,
+    before parsing for mondrian_nf.
+    """
+    filtered = cells is not None or chromosomes is not None or min_quality is not None
+    if filtered and framework != 'mondrian_nf':
+        raise Exception(f"Row filters are only supported for mondrian_nf, not '{framework}'")
+
+    if framework == 'scp':
+        with profiling.stage('isabl_lookup', analysis=analysis_id):
+            [alignment, hmmcopy, annotation] = alhena_igo.isabl.get_directories(analysis_id, framework, version)
+        with profiling.stage('load_qc_results', analysis=analysis_id) as record:
+            data = _load_qc_results(
+                'scp',
+                alignment_results_dir=alignment,
+                hmmcopy_results_dir=hmmcopy,
+                annotation_results_dir=annotation
+            )
+            record['rows'] = sum(len(df) for df in data.values())
+    elif framework == 'mondrian':
+        with profiling.stage('isabl_lookup', analysis=analysis_id):
+            [alignment, hmmcopy] = alhena_igo.isabl.get_directories(analysis_id, framework, version)
+        with profiling.stage('load_qc_results', analysis=analysis_id) as record:
+            data = _load_qc_results(
+                'mondrian',
+                alignment_results_dir=alignment,
+                hmmcopy_results_dir=hmmcopy
+            )
+            record['rows'] = sum(len(df) for df in data.values())
+    elif framework == 'mondrian_nf':
+        with profiling.stage('isabl_lookup', analysis=analysis_id):
+            cataloged_results = alhena_igo.isabl.get_isabl_cataloged_qc_results(analysis_id, framework, version)
+
+        data = get_mondrian_nf_data(
+            cataloged_results, chunksize=chunksize, engine=engine, parse_workers=parse_workers,
+            cells=cells, chromosomes=chromosomes, min_quality=min_quality, max_memory=max_memory,
+        )
+
+        logger.info(f"Parsed QC tables for {analysis_id}:\n{memory_report(data).to_string(index=False)}")
+    else:
+        raise Exception(f"Unknown framework option '{framework}'")
+
+    if max_memory is not None and framework != 'mondrian_nf':
+        _fit_memory_budget(data, alhena_igo.memory.MemoryBudget(max_memory))
+
+    return data
+
+
+def get_merged_qc_data(analysis_ids: List[str], framework: str, version: str, engine: str = None, parse_workers: int = 1):
+    """
+    Parse the QC tables of several analyses and combine them table by table.
+
+    Categoricals are unioned across every table of every analysis, so each
+    column shares one dictionary of categories (e.g. one set of ``cell_id``)
+    and only the integer codes are repeated. Every analysis is parsed before
+    the union, so all of their tables are held in memory at once. Tables that
+    can be streamed are returned as an iterator over the analyses' frames,
+    which are indexed one library at a time rather than concatenated into a
+    copy. The other tables are concatenated.
+    """
+    parsed = [
+        get_qc_data(analysis_id, framework, version, engine=engine, parse_workers=parse_workers)
+        for analysis_id in analysis_ids
+    ]
+
+    with profiling.stage('union_categories') as record:
+        frames = [df for data in parsed for df in data.values()]
+        record['rows'] = sum(len(df) for df in frames)
+        union_categories(frames)
+
+    merged = {}
+    for table in parsed[0]:
+        dfs = [data[table] for data in parsed if table in data]
+        if table in STREAMED_TABLE_INDEX:
+            merged[table] = iter(dfs)
+        else:
+            merged[table] = pd.concat(dfs, ignore_index=True)
+
+    return merged
+
+
+def get_sources(analysis_id: str, framework: str, version: str):
+    """Return the result directories or files an analysis is loaded from."""
+    if framework == 'mondrian_nf':
+        cataloged_results = alhena_igo.isabl.get_isabl_cataloged_qc_results(analysis_id, framework, version)
+        return sorted(set(cataloged_results[result] for result, _, _, _ in MONDRIAN_NF_TABLES.values()))
+
+    return list(alhena_igo.isabl.get_directories(analysis_id, framework, version))
+
+
+def index_analysis(analysis_id: str, data, metadata, projects: List[str], es, framework: str, checkpoint=None, bulk=None):
+    """
+    Index QC tables and the analysis record into Alhena.
+
+    Tables given as iterators of DataFrame chunks are streamed: the first chunk
+    is loaded through alhenaloader with the other tables, which creates the
+    index, and the remaining chunks are appended to that index one at a time.
+
+    With a `ledger.Checkpoint`, steps that completed in an earlier, partial
+    load are skipped and each completed step is recorded.
+
+    With a `bulk.BulkIndexer`, the analysis' indices get its tuned settings
+    for the duration of the load, and streamed chunks are written with it.
+    Streamable tables parsed whole are streamed too, so that the bulk
+    options apply to them: the first `BULK_HEAD_ROWS` rows are loaded through
+    alhenaloader and the rest written by the indexer.
+    If it has ``read_tiers``, downsampled tiers of the reads are built as the
+    reads are indexed, and indexed afterwards, see `tiers`. The arm tier
+    splits chromosomes at the centromeres of the analysis' assembly in Isabl. With
+    ``cell_summary``, a summary record per cell is indexed too, see
+    `cell_summary`.
+    """
+    data = dict(data)
+    streams = {}
+    for table, value in data.items():
+        if not isinstance(value, pd.DataFrame):
+            chunks = iter(value)
+            first = next(chunks, None)
+            data[table] = first if first is not None else _empty_table(table)
+            streams[table] = chunks
+        elif bulk is not None and table in STREAMED_TABLE_INDEX and len(value) > BULK_HEAD_ROWS:
+            data[table] = value.iloc[:BULK_HEAD_ROWS]
+            streams[table] = _slices(value, BULK_HEAD_ROWS, BULK_SLICE_ROWS)
+
+    read_tiers = None
+    if bulk is not None and bulk.read_tiers and data.get('hmmcopy_reads') is not None:
+        assembly = None
+        if any(alhena_igo.tiers.READ_TIERS[tier] is None for tier in bulk.read_tiers):
+            assembly = alhena_igo.isabl.get_assembly(analysis_id)
+        read_tiers = alhena_igo.tiers.ReadTiers(bulk.read_tiers, assembly=assembly)
+        _add_to_tiers(read_tiers, data['hmmcopy_reads'], analysis_id)
+
+    writer = bulk if bulk is not None else es
+    tuned = bulk.tuned(analysis_indices(analysis_id)) if bulk is not None else contextlib.nullcontext()
+
+    with tuned:
+        if checkpoint is not None and checkpoint.is_done('analysis'):
+            logger.info(f"Resuming {analysis_id}, skipping tables already loaded")
+        else:
+            with profiling.stage('index', analysis=analysis_id) as record:
+                record['rows'] = sum(len(df) for df in data.values())
+                alhenaloader.load_analysis(analysis_id, data, metadata, list(projects), es, framework)
+            if checkpoint is not None:
+                checkpoint.done('analysis')
+
+        for table, chunks in streams.items():
+            data[table] = None
+            index_name = f"{analysis_id.lower()}_{STREAMED_TABLE_INDEX[table]}"
+            for i, chunk in enumerate(chunks, start=1):
+                if read_tiers is not None and table == 'hmmcopy_reads':
+                    _add_to_tiers(read_tiers, chunk, analysis_id)
+
+                step = f'{table}:{i}'
+                if checkpoint is not None and checkpoint.is_done(step):
+                    continue
+
+                logger.debug(f"Loading {len(chunk)} rows of {table} into {index_name}")
+                with profiling.stage('index_chunk', analysis=analysis_id, table=table) as record:
+                    record['rows'] = len(chunk)
+                    writer.load_df(chunk, index_name)
+                if checkpoint is not None:
+                    checkpoint.done(step)
+
+        if read_tiers is not None:
+            _index_tiers(analysis_id, read_tiers, bulk, checkpoint)
+
+        if bulk is not None and bulk.cell_summary:
+            _index_cell_summary(analysis_id, data, bulk, checkpoint)
+
+
+def _empty_table(table: str) -> pd.DataFrame:
+    """An empty frame with the columns and compact dtypes of a QC table, for a stream without chunks."""
+    _, _, columns, dtype = MONDRIAN_NF_TABLES.get(table, (None, None, None, {}))
+    df = pd.DataFrame(columns=columns or [])
+    return df.astype({col: dtype[col] for col in df.columns if col in dtype})
+
+
+def _slices(df, start: int, rows: int):
+    for i in range(start, len(df), rows):
+        yield df.iloc[i:i + rows]
+
+
+def _index_table(analysis_id: str, step: str, df, index_name: str, bulk, checkpoint=None):
+    """Index a table derived at load time into its own index, replacing the index of an earlier load."""
+    if checkpoint is not None and checkpoint.is_done(step):
+        return
+
+    # drop documents of an earlier load, which alhenaloader does not clean
+    bulk.delete_indices(bulk.indices([index_name]))
+    with profiling.stage('index_derived', analysis=analysis_id, table=step) as record:
+        record['rows'] = len(df)
+        bulk.load_df(df, index_name)
+    if checkpoint is not None:
+        checkpoint.done(step)
+
+
+def _index_cell_summary(analysis_id: str, data, bulk, checkpoint=None):
+    align_metrics = data.get('align_metrics')
+    hmmcopy_metrics = data.get('hmmcopy_metrics')
+    if align_metrics is None or hmmcopy_metrics is None:
+        logger.warning(f"Not building a cell summary of {analysis_id} without align and hmmcopy metrics")
+        return
+
+    with profiling.stage('cell_summary', analysis=analysis_id) as record:
+        min_quality = bulk.cell_summary_min_quality
+        if min_quality is None:
+            min_quality = alhena_igo.cell_summary.DEFAULT_MIN_QUALITY
+        summary = alhena_igo.cell_summary.build_cell_summary(align_metrics, hmmcopy_metrics, min_quality=min_quality)
+        record['rows'] = len(summary)
+
+    _index_table(analysis_id, 'cells', summary, alhena_igo.cell_summary.cell_summary_index(analysis_id), bulk, checkpoint)
+
+
+def _add_to_tiers(read_tiers, reads, analysis_id: str):
+    with profiling.stage('tiers', analysis=analysis_id) as record:
+        record['rows'] = len(reads)
+        read_tiers.add(reads)
+
+
+def _index_tiers(analysis_id: str, read_tiers, bulk, checkpoint=None):
+    """Index the downsampled tiers of an analysis' reads, each into its own index."""
+    with profiling.stage('tiers', analysis=analysis_id):
+        tables = read_tiers.tables()
+
+    for tier, df in tables.items():
+        _index_table(analysis_id, f'tier:{tier}', df, alhena_igo.tiers.tier_index(analysis_id, tier), bulk, checkpoint)
+
+
+def ledger_options(parse_options, bulk=None):
+    """
+    Return the options a load is recorded with in the ledger: its parse options and the layout of its streamed steps.
+
+    Checkpoints record streamed chunks by position, which only holds for the
+    same layout: with a `bulk.BulkIndexer` whole tables are split at
+    `BULK_HEAD_ROWS` and every `BULK_SLICE_ROWS` rows, and the chunk size of
+    streamed tables is a parse option. A load with a different layout is
+    then planned as a reload rather than resumed.
+    """
+    options = dict(parse_options)
+    if bulk is not None:
+        options['bulk_stream'] = [BULK_HEAD_ROWS, BULK_SLICE_ROWS]
+    return options
+
+
+def parse_analysis(analysis_id: str, framework: str, version: str, ledger=None, resume: bool = False, bulk=None, **parse_options):
+    """
+    Parse stage of a load: return the QC tables, metadata and `ledger.Checkpoint` of an analysis.
+
+    With a `ledger.LoadLedger` the start of the load, its sources and its
+    `ledger_options` for ``bulk`` are recorded. The checkpoint is None without a ledger.
+    """
+    checkpoint = None
+    if ledger is not None:
+        sources = alhena_igo.ledger.fingerprint(get_sources(analysis_id, framework, version))
+        ledger.start(analysis_id, framework, version, sources, ledger_options(parse_options, bulk), resume=resume)
+        checkpoint = ledger.checkpoint(analysis_id)
+
+    try:
+        data = get_qc_data(analysis_id, framework, version, **parse_options)
+        with profiling.stage('metadata', analysis=analysis_id):
+            metadata = alhena_igo.isabl.get_metadata(analysis_id)
+    except Exception as e:
+        if ledger is not None:
+            ledger.fail(analysis_id, str(e))
+        raise
+
+    return data, metadata, checkpoint
+
+
+def index_parsed(analysis_id: str, data, metadata, projects: List[str], es, framework: str, clean: bool = False, ledger=None, checkpoint=None, bulk=None):
+    """
+    Index stage of a load: index an analysis returned by `parse_analysis`, optionally removing previous records first.
+
+    A resumed load is cleaned too unless its checkpoint has the tables loaded
+    by alhenaloader done, since loading them again into partly filled
+    indices would duplicate documents.
+    """
+    try:
+        if clean and (checkpoint is None or not checkpoint.is_done('analysis')):
+            clean_analysis(analysis_id, es, bulk=bulk)
+
+        index_analysis(analysis_id, data, metadata, projects, es, framework, checkpoint=checkpoint, bulk=bulk)
+    except Exception as e:
+        if ledger is not None:
+            ledger.fail(analysis_id, str(e))
+        raise
+
+    if ledger is not None:
+        ledger.finish(analysis_id)
+
+
+def load_analysis(analysis_id: str, framework: str, version: str, projects: List[str], es, clean: bool = False, ledger=None, resume: bool = False, bulk=None, **parse_options):
+    """
+    Load a single analysis into Alhena, optionally removing any previous records first.
+
+    With a `ledger.LoadLedger` the sources and progress of the load are
+    recorded, and with ``resume`` steps completed by an earlier partial load
+    are skipped. ``bulk`` is an optional `bulk.BulkIndexer` to index with.
+    ``parse_options`` are passed on to `get_qc_data`.
+
+    The analysis is cleaned once parsed, see `index_parsed`.
+    """
+    data, metadata, checkpoint = parse_analysis(analysis_id, framework, version, ledger=ledger, resume=resume, bulk=bulk, **parse_options)
+    index_parsed(analysis_id, data, metadata, projects, es, framework, clean=clean, ledger=ledger, checkpoint=checkpoint, bulk=bulk)
+
+
+def load_pipelined(analysis_ids: List[str], framework: str, version: str, projects: List[str], es, depth: int = 1, clean: bool = False, ledger=None, resume=(), bulk=None, **parse_options):
+    """
+    Load many analyses, parsing the next analyses while the current one is indexed.
+
+    A thread runs `parse_analysis` for each analysis in turn and hands the
+    results to the indexing loop through a queue of at most ``depth``
+    analyses, so at most ``depth`` + 2 parsed analyses are held in memory.
+    Yields ``(analysis_id, error)`` as each analysis is indexed, like
+    `load_analyses`. Analyses are cleaned just before they are indexed.
+    """
+    resume = set(resume)
+    parsed = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def produce():
+        for analysis_id in analysis_ids:
+            if stop.is_set():
+                break
+            try:
+                result = parse_analysis(analysis_id, framework, version, ledger=ledger, resume=analysis_id in resume, bulk=bulk, **parse_options)
+            except Exception as e:
+                logger.exception(f"Failed to parse {analysis_id}")
+                result = e
+            parsed.put((analysis_id, result))
+        parsed.put(None)
+
+    producer = threading.Thread(target=produce, name='parse', daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            with profiling.stage('pipeline_wait'):
+                item = parsed.get()
+            if item is None:
+                break
+
+            analysis_id, result = item
+            if isinstance(result, Exception):
+                yield analysis_id, result
+                continue
+
+            data, metadata, checkpoint = result
+            try:
+                index_parsed(
+                    analysis_id, data, metadata, projects, es, framework,
+                    clean=clean, ledger=ledger, checkpoint=checkpoint, bulk=bulk
+                )
+            except Exception as e:
+                logger.exception(f"Failed to load {analysis_id}")
+                yield analysis_id, e
+            else:
+                yield analysis_id, None
+    finally:
+        # unblock the producer if the caller stopped early
+        stop.set()
+        while producer.is_alive():
+            try:
+                parsed.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+
+def plan_loads(analysis_ids: List[str], alhena_ids: List[str], framework: str, version: str, ledger, verify_sources: bool = False, bulk=None, **parse_options):
+    """
+    Decide for each analysis whether to skip, load, reload or resume it.
+
+    Returns a dict of `ledger` actions to analysis IDs. Without a ledger,
+    analyses already in Alhena are skipped and the rest are loaded.
+
+    Analyses in Alhena that the ledger has fully loaded with the same version
+    and options are skipped without walking their result directories, unless
+    ``verify_sources`` is set to also reload analyses whose files changed.
+    Options are compared as `ledger_options` for the ``bulk`` indexer the
+    analyses will be loaded with.
+    """
+    alhena_ids = set(alhena_ids)
+    options = ledger_options(parse_options, bulk)
+    plan = {action: [] for action in (alhena_igo.ledger.SKIP, alhena_igo.ledger.LOAD, alhena_igo.ledger.RELOAD, alhena_igo.ledger.RESUME)}
+
+    for analysis_id in analysis_ids:
+        if ledger is None:
+            action = alhena_igo.ledger.SKIP if analysis_id in alhena_ids else alhena_igo.ledger.LOAD
+        elif ledger.get(analysis_id) is None:
+            action = ledger.plan(analysis_id, version, None, options, analysis_id in alhena_ids)
+        elif not verify_sources and analysis_id in alhena_ids and ledger.is_loaded(analysis_id, version, options):
+            action = alhena_igo.ledger.SKIP
+        else:
+            sources = alhena_igo.ledger.fingerprint(get_sources(analysis_id, framework, version))
+            action = ledger.plan(analysis_id, version, sources, options, analysis_id in alhena_ids)
+        plan[action].append(analysis_id)
+
+    return plan
+
+
+def _init_worker(host: str, port: int, cache_settings, table_cache_settings, profile: bool):
+    global _worker_es
+    _worker_es = alhenaloader.ES(host, port)
+
+    if profile:
+        profiling.enable()
+
+    if cache_settings is not None:
+        cache_dir, ttl, refresh, refreshed_at = cache_settings
+        alhena_igo.cache.configure(cache_dir, ttl=ttl, refresh=refresh, refreshed_at=refreshed_at)
+
+    if table_cache_settings is not None:
+        table_cache_dir, max_bytes = table_cache_settings
+        alhena_igo.table_cache.configure(table_cache_dir, max_bytes=max_bytes)
+
+
+def worker_pool(host: str, port: int, workers: int) -> ProcessPoolExecutor:
+    """Return a pool of load worker processes, each with its own Elasticsearch client and this process' cache and profiling settings."""
+    isabl_cache = alhena_igo.cache.get_isabl_cache()
+    cache_settings = isabl_cache.settings if isabl_cache is not None else None
+    parsed_table_cache = alhena_igo.table_cache.get_table_cache()
+    table_cache_settings = parsed_table_cache.settings if parsed_table_cache is not None else None
+    profile = profiling.get_profiler() is not None
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(host, port, cache_settings, table_cache_settings, profile))
+
+
+def _load_in_worker(analysis_id: str, framework: str, version: str, projects: List[str], clean: bool, ledger, resume: bool, bulk, parse_options):
+    load_analysis(analysis_id, framework, version, projects, _worker_es, clean=clean, ledger=ledger, resume=resume, bulk=bulk, **parse_options)
+
+    profiler = profiling.get_profiler()
+    return profiler.drain() if profiler is not None else []
+
+
+def load_analyses(analysis_ids: List[str], framework: str, version: str, projects: List[str], host: str, port: int, workers: int = 1, clean: bool = False, es=None, ledger=None, resume=(), pipeline_depth: int = 0, bulk=None, **parse_options):
+    """
+    Load many analyses, yielding ``(analysis_id, error)`` as each one finishes.
+
+    ``error`` is None on success. A failing analysis is reported and the
+    remaining analyses keep loading. With ``workers`` > 1 the analyses are
+    loaded in a pool of processes, each with its own Elasticsearch client.
+    Analyses in ``resume`` continue a partial load recorded in ``ledger``,
+    and are only cleaned if alhenaloader did not finish loading their tables. ``parse_options`` are passed on to `get_qc_data`.
+
+    ``bulk`` is an optional `bulk.BulkIndexer` to index with.
+
+    With one worker and a ``pipeline_depth`` above 0, analyses are loaded
+    with `load_pipelined`, parsing ahead of indexing by up to that many
+    analyses.
+    """
+    resume = set(resume)
+
+    if workers <= 1:
+        if es is None:
+            es = alhenaloader.ES(host, port)
+        if pipeline_depth > 0:
+            yield from load_pipelined(
+                analysis_ids, framework, version, projects, es,
+                depth=pipeline_depth, clean=clean, ledger=ledger, resume=resume, bulk=bulk, **parse_options
+            )
+            return
+        for analysis_id in analysis_ids:
+            try:
+                load_analysis(
+                    analysis_id, framework, version, projects, es,
+                    clean=clean, ledger=ledger, resume=analysis_id in resume, bulk=bulk, **parse_options
+                )
+            except Exception as e:
+                logger.exception(f"Failed to load {analysis_id}")
+                yield analysis_id, e
+            else:
+                yield analysis_id, None
+        return
+
+    profiler = profiling.get_profiler()
+
+    with worker_pool(host, port, workers) as executor:
+        futures = {
+            executor.submit(
+                _load_in_worker, analysis_id, framework, version, list(projects),
+                clean, ledger, analysis_id in resume, bulk, parse_options
+            ): analysis_id
+            for analysis_id in analysis_ids
+        }
+        for future in as_completed(futures):
+            analysis_id = futures[future]
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Failed to load {analysis_id}: {error}")
+            elif profiler is not None:
+                profiler.extend(future.result())
+            yield analysis_id, error
+
+
+def _clean_records(analysis_id: str, es):
+    with profiling.stage('clean', analysis=analysis_id):
+        alhenaloader.clean_analysis(analysis_id, es)
+
+
+def clean_analyses(analysis_ids: List[str], es, bulk=None, workers: int = 1, batch_size: int = CLEAN_BATCH_SIZE):
+    """
+    Remove many analyses from Alhena, yielding ``(analysis_id, error)`` for each analysis removed.
+
+    Analyses are looked up in Alhena once, and analyses that are not there
+    are skipped instead of cleaned one by one. With a `bulk.BulkIndexer`,
+    the indices of each batch of analyses are found and deleted with one
+    request each, and analyses with indices but no record are cleaned too.
+    Records and project memberships are then removed with
+    `alhenaloader.clean_analysis`, on up to ``workers`` analyses at a time.
+    Without one, each analysis is removed with `clean_analysis`.
+    """
+    analysis_ids = list(dict.fromkeys(analysis_ids))
+    # with a bulk indexer every index of a batch is already deleted
+    clean = _clean_records if bulk is not None else clean_analysis
+    with profiling.stage('clean_lookup'):
+        existing = set(record['dashboard_id'] for record in es.get_analyses())
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for start in range(0, len(analysis_ids), batch_size):
+            batch = analysis_ids[start:start + batch_size]
+
+            found = set()
+            if bulk is not None:
+                with profiling.stage('clean_indices') as record:
+                    owners = {index: analysis_id for analysis_id in batch for index in analysis_indices(analysis_id)}
+                    indices = bulk.indices(list(owners))
+                    record['rows'] = len(indices)
+                    bulk.delete_indices(indices)
+                found = set(owners[index] for index in indices)
+
+            missing = [analysis_id for analysis_id in batch if analysis_id not in existing and analysis_id not in found]
+            if missing:
+                logger.info(f"Skipping {len(missing)} analyses not in Alhena: {', '.join(missing)}")
+
+            futures = {
+                executor.submit(clean, analysis_id, es): analysis_id
+                for analysis_id in batch if analysis_id not in missing
+            }
+            for future in as_completed(futures):
+                analysis_id = futures[future]
+                error = future.exception()
+                if error is not None:
+                    logger.error(f"Failed to clean {analysis_id}: {error}")
+                yield analysis_id, error
@@ -0,0 +1,145 @@
+"""
+Memory budget of a load.
+
+With a budget, the in-memory size of each QC table is estimated before it is
+parsed, from a sample of its rows and `utils.estimate_rows`. Tables that can
+be streamed are read in chunks sized to fit the budget left by the other
+tables, and the load fails before parsing if even that cannot fit. Tables
+parsed whole, as scgenome parses them, are measured once parsed, and
+streamable tables are spilled to an Arrow IPC temp file when they do not
+fit, to be indexed one chunk at a time.
+
+.. currentmodule:: alhena_igo.memory
+"""
+import logging
+import os
+import re
+import tempfile
+
+from alhena_igo.utils import estimate_rows, read_csverve
+
+logger = logging.getLogger('alhena_igo')
+
+SAMPLE_ROWS = 1000  #: rows parsed to estimate the in-memory size of a table
+MIN_CHUNK_ROWS = 10000  #: smallest chunk worth streaming a table in
+
+#: bytes held per byte of a streamed chunk: the chunk, its bulk documents and the next chunk being parsed
+STREAM_OVERHEAD = 3
+
+_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+
+class MemoryBudgetError(Exception):
+    """A load that cannot fit its memory budget."""
+
+
+def parse_size(value) -> int:
+    """Parse a size in bytes such as '512M', '8G' or '1.5GB' into a number of bytes."""
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?)B?\s*', str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size '{value}', expected e.g. 512M or 8G")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def format_size(nbytes: int) -> str:
+    for unit in ('T', 'G', 'M', 'K'):
+        if nbytes >= _UNITS[unit]:
+            return f"{nbytes / _UNITS[unit]:.1f} {unit}B"
+    return f"{nbytes} B"
+
+
+def frame_bytes(df) -> int:
+    """Return the resident size of a DataFrame."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def estimate_table(filepath, usecols=None, dtype=None, sample_rows: int = SAMPLE_ROWS):
+    """Return the estimated rows and bytes per row of a csverve table once parsed with ``dtype``."""
+    sample = next(iter(read_csverve(filepath, usecols=usecols, dtype=dtype, chunksize=sample_rows)))
+    if len(sample) == 0:
+        return 0, 0
+    return estimate_rows(filepath, sample_rows=sample_rows), frame_bytes(sample) / len(sample)
+
+
+class MemoryBudget(object):
+    """
+    Track the resident size of parsed tables against a budget of ``max_bytes``.
+
+    Tables are tracked by name with `track` as they are parsed, and `chunk_rows`
+    sizes the chunks of a streamed table to fit what the tracked tables leave.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.resident = {}  #: bytes of each tracked table
+
+    @property
+    def used(self) -> int:
+        return sum(self.resident.values())
+
+    def track(self, table: str, nbytes: int):
+        self.resident[table] = nbytes
+
+    def release(self, table: str):
+        self.resident.pop(table, None)
+
+    def check(self, what: str, sizes):
+        """Raise a `MemoryBudgetError` if tables of the given sizes, keyed by table, do not fit beside the tracked tables."""
+        needed = self.used + sum(sizes.values())
+        if needed > self.max_bytes:
+            breakdown = ', '.join(f"{table} {format_size(nbytes)}" for table, nbytes in {**self.resident, **sizes}.items())
+            raise MemoryBudgetError(
+                f"{what} needs an estimated {format_size(needed)} ({breakdown}), "
+                f"over the memory budget of {format_size(self.max_bytes)}"
+            )
+
+    def chunk_rows(self, table: str, bytes_per_row: float) -> int:
+        """Return the rows per chunk of a streamed table that fit beside the tracked tables."""
+        available = self.max_bytes - self.used
+        rows = int(available / (max(bytes_per_row, 1) * STREAM_OVERHEAD))
+        if rows < MIN_CHUNK_ROWS:
+            raise MemoryBudgetError(
+                f"Streaming {table} needs at least {format_size(MIN_CHUNK_ROWS * bytes_per_row * STREAM_OVERHEAD)} "
+                f"for chunks of {MIN_CHUNK_ROWS} rows, but only {format_size(max(available, 0))} of the memory "
+                f"budget of {format_size(self.max_bytes)} is left beside {format_size(self.used)} of other tables"
+            )
+        return rows
+
+
+class SpilledTable(object):
+    """
+    A table spilled to an Arrow IPC temp file, iterated as DataFrame chunks of ``chunksize`` rows.
+
+    The table is written a slice at a time, and chunks are read back from a
+    memory map as they are iterated. The temp file is removed once iterated.
+    """
+
+    def __init__(self, data, chunksize: int, spill_dir: str = None):
+        import pyarrow as pa
+
+        self.rows = len(data)
+        fd, self.path = tempfile.mkstemp(dir=spill_dir, prefix='alhena_igo_spill_', suffix='.arrow')
+        try:
+            schema = pa.Schema.from_pandas(data, preserve_index=False)
+            with os.fdopen(fd, 'wb') as sink:
+                with pa.ipc.new_file(sink, schema) as writer:
+                    for start in range(0, max(self.rows, 1), chunksize):
+                        writer.write_batch(pa.RecordBatch.from_pandas(data.iloc[start:start + chunksize], schema=schema, preserve_index=False))
+        except BaseException:
+            self.close()
+            raise
+
+    def __iter__(self):
+        import pyarrow as pa
+
+        try:
+            # the memory map is not closed here, chunks may still be views on it
+            reader = pa.ipc.open_file(pa.memory_map(self.path, 'r'))
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i).to_pandas()
+        finally:
+            self.close()
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,134 @@
+"""
+Stage-level timing and memory instrumentation.
+
+Code wraps each stage of a load in `stage`, which is a no-op unless profiling
+is enabled. When enabled, every stage records its wall time, the resident
+set size of the process at its end and how much it grew during the stage,
+and optionally rows processed, the size of the files read (``file_bytes``)
+and the in-memory size of the tables built (``memory_bytes``), labelled by
+analysis and table. The growth of a stage includes whatever stages of other
+threads allocated meanwhile.
+
+.. currentmodule:: alhena_igo.profiling
+"""
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+_profiler = None
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+#: byte counts a stage may record, totalled per stage
+BYTE_FIELDS = ['file_bytes', 'memory_bytes']
+
+
+def peak_rss_mb() -> float:
+    """Return the peak resident set size of this process over its lifetime in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return maxrss / 1e6 if sys.platform == 'darwin' else maxrss / 1e3
+
+
+def rss_mb():
+    """Return the current resident set size of this process in MB, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 1e6
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Profiler(object):
+    """Collects stage records. Safe to use from several threads."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **labels):
+        record = {'stage': name, **labels, 'rows': None, **{field: None for field in BYTE_FIELDS}}
+        start = time.perf_counter()
+        rss_start = rss_mb()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - start
+            record['rss_mb'] = rss_mb()
+            record['rss_delta_mb'] = None if rss_start is None or record['rss_mb'] is None else record['rss_mb'] - rss_start
+            record['pid'] = os.getpid()
+            with self._lock:
+                self.records.append(record)
+
+    def extend(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+    def drain(self):
+        """Return and forget the records collected so far."""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def report(self, command: str = None):
+        """Return the profile as a JSON-serializable dict, with totals per stage."""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'count': 0, 'wall_seconds': 0.0, 'rows': 0, **{field: 0 for field in BYTE_FIELDS}})
+            total['count'] += 1
+            total['wall_seconds'] += record['wall_seconds']
+            total['rows'] += record['rows'] or 0
+            for field in BYTE_FIELDS:
+                total[field] += record.get(field) or 0
+
+        return {
+            'command': command,
+            'started': self.started,
+            'wall_seconds': time.time() - self.started,
+            # worker processes only report the resident size at the end of their stages
+            'peak_rss_mb': max([peak_rss_mb()] + [record['rss_mb'] for record in self.records if record.get('rss_mb') is not None]),
+            'totals': totals,
+            'stages': self.records,
+        }
+
+    def write(self, path: str, command: str = None):
+        with open(path, 'w') as f:
+            json.dump(self.report(command), f, indent=2, default=str)
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler():
+    """Return the active profiler, or None if profiling is disabled."""
+    return _profiler
+
+
+@contextlib.contextmanager
+def stage(name: str, **labels):
+    """
+    Time a stage if profiling is enabled.
+
+    Yields a dict on which the caller may set ``rows``, ``file_bytes`` and ``memory_bytes``.
+    """
+    if _profiler is None:
+        yield {}
+        return
+
+    with _profiler.stage(name, **labels) as record:
+        yield record
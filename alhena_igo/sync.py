@@ -0,0 +1,147 @@
+"""
+Plan and run a project-wide sync between an Isabl project and Alhena.
+
+A sync first computes the full plan: analyses to add, reload or resume,
+analyses to remove because they are no longer SUCCEEDED or no longer in the
+Isabl project, and Alhena project memberships to change. The plan is then
+run with bulk operations, or only printed for a dry run.
+
+Memberships are compared with the Alhena projects as they are in
+Elasticsearch. Since an Alhena project such as DLP holds the analyses of
+many Isabl projects, only analyses the ledger records as loaded from this
+Isabl project, by `sync` or `load-project`, are removed.
+
+.. currentmodule:: alhena_igo.sync
+"""
+import logging
+from typing import List
+
+import alhena_igo.isabl
+from alhena_igo import ledger as load_ledger
+from alhena_igo import loader
+from alhena_igo.utils import estimate_rows
+
+logger = logging.getLogger('alhena_igo')
+
+
+class SyncPlan(object):
+    """The changes needed to bring Alhena in line with an Isabl project."""
+
+    def __init__(self, isabl_project: str, projects: List[str], loads, remove, members_add, members_remove):
+        self.isabl_project = isabl_project
+        self.projects = projects
+        self.loads = loads  #: dict of ledger action to analysis IDs
+        self.remove = remove  #: analyses to clean from Alhena
+        self.members_add = members_add  #: dict of Alhena project to analysis IDs to add
+        self.members_remove = members_remove  #: dict of Alhena project to analysis IDs to remove
+
+    @property
+    def to_load(self):
+        return self.loads[load_ledger.LOAD] + self.loads[load_ledger.RELOAD] + self.loads[load_ledger.RESUME]
+
+    def is_empty(self):
+        return not (
+            self.to_load or self.remove
+            or any(self.members_add.values()) or any(self.members_remove.values())
+        )
+
+    def summary(self):
+        lines = [
+            f"Isabl project {self.isabl_project} -> Alhena projects {', '.join(self.projects)}",
+            f"  unchanged: {len(self.loads[load_ledger.SKIP])}",
+        ]
+        for action in (load_ledger.LOAD, load_ledger.RELOAD, load_ledger.RESUME):
+            lines.append(f"  {action}: {len(self.loads[action])} {' '.join(sorted(self.loads[action]))}")
+        lines.append(f"  remove: {len(self.remove)} {' '.join(sorted(self.remove))}")
+        for project in sorted(set(self.members_add) | set(self.members_remove)):
+            lines.append(
+                f"  {project}: +{len(self.members_add.get(project, []))} "
+                f"-{len(self.members_remove.get(project, []))} memberships"
+            )
+        return '\n'.join(lines)
+
+
+def plan_sync(isabl_project: str, projects: List[str], framework: str, version: str, es, ledger, verify_sources: bool = False, bulk=None, **parse_options) -> SyncPlan:
+    """Compute the sync plan for an Isabl project without changing anything. See `loader.plan_loads` for ``verify_sources`` and ``bulk``."""
+    isabl_records = alhena_igo.isabl.get_ids_from_isabl(isabl_project, framework, version)
+    isabl_pks = [record['dashboard_id'] for record in isabl_records]
+    alhena_analyses = set(record['dashboard_id'] for record in es.get_analyses())
+
+    loads = loader.plan_loads(isabl_pks, alhena_analyses, framework, version, ledger, verify_sources=verify_sources, bulk=bulk, **parse_options)
+
+    # Analyses loaded from the Isabl project before that are no longer SUCCEEDED or in it
+    members = ledger.get_members(isabl_project)
+    synced = set().union(*members.values()) if members else set()
+    remove = sorted((synced - set(isabl_pks)) & alhena_analyses)
+
+    members_add = {}
+    members_remove = {}
+    for project in sorted(set(projects) | set(members)):
+        current = set(es.get_project_analyses(project))
+        wanted = set(isabl_pks) if project in projects else set()
+        members_add[project] = sorted(wanted - current)
+        members_remove[project] = sorted((current & synced) - wanted)
+
+    return SyncPlan(isabl_project, list(projects), loads, remove, members_add, members_remove)
+
+
+def estimate_volume(plan: SyncPlan, framework: str, version: str):
+    """Return the estimated number of rows and compressed bytes to index for the plan."""
+    rows = 0
+    size = 0
+    for analysis_id in plan.to_load:
+        files = load_ledger.fingerprint(loader.get_sources(analysis_id, framework, version))
+        for filepath, (file_size, _) in files.items():
+            if file_size is None or not filepath.endswith('.csv.gz'):
+                continue
+            size += file_size
+            rows += estimate_rows(filepath)
+
+    return rows, size
+
+
+def run_sync(plan: SyncPlan, framework: str, version: str, host: str, port: int, es, ledger, workers: int = 1, pipeline_depth: int = 0, bulk=None, **parse_options):
+    """
+    Run a sync plan, yielding ``(analysis_id, error)`` for each analysis loaded.
+
+    Removed analyses are cleaned first with `loader.clean_analyses`, then
+    analyses are loaded, then project memberships are updated with one bulk
+    call per Alhena project. Analyses that fail to load are not added to any
+    project. ``bulk`` is an optional `bulk.BulkIndexer` to load with.
+    """
+    from alhena_igo.bulk import BulkIndexer
+
+    removed = set()
+    for analysis_id, error in loader.clean_analyses(plan.remove, es, bulk=bulk or BulkIndexer(host, port), workers=workers):
+        if error is None:
+            logger.info(f"Removed {analysis_id}")
+            removed.add(analysis_id)
+            ledger.remove(analysis_id)
+
+    failed = set()
+    results = loader.load_analyses(
+        plan.to_load, framework, version, plan.projects, host, port,
+        workers=workers, clean=True, es=es, ledger=ledger, resume=plan.loads[load_ledger.RESUME],
+        pipeline_depth=pipeline_depth, bulk=bulk, **parse_options
+    )
+    for analysis_id, error in results:
+        if error is not None:
+            failed.add(analysis_id)
+        yield analysis_id, error
+
+    for project, analysis_ids in plan.members_remove.items():
+        # cleaning an analysis already removes it from its projects
+        analysis_ids = [analysis_id for analysis_id in analysis_ids if analysis_id not in removed]
+        for analysis_id in analysis_ids:
+            es.remove_analysis_from_projects(analysis_id, projects=[project])
+        ledger.remove_members(plan.isabl_project, project, analysis_ids)
+        ledger.remove_members(plan.isabl_project, project, removed)
+
+    loaded = [analysis_id for analysis_ids in plan.loads.values() for analysis_id in analysis_ids if analysis_id not in failed]
+    for project, analysis_ids in plan.members_add.items():
+        analysis_ids = [analysis_id for analysis_id in analysis_ids if analysis_id not in failed]
+        if analysis_ids:
+            es.add_analyses_to_project(project, analysis_ids)
+        if project in plan.projects:
+            # also own analyses of the Isabl project that were in the Alhena project already
+            ledger.add_members(plan.isabl_project, project, loaded)
@@ -0,0 +1,172 @@
+"""
+Local on-disk cache of parsed QC tables.
+
+Parsed tables are stored as uncompressed Arrow IPC files, keyed by the source
+files (path, size and modification time) and the parse options, such as
+columns, dtypes and row filters. A warm read memory-maps the file instead of
+decoding the gzipped CSV again. The cache is bounded in size and evicts the
+least recently used tables first.
+
+.. currentmodule:: alhena_igo.table_cache
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from alhena_igo.cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger('alhena_igo')
+
+DEFAULT_TABLE_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'tables')
+DEFAULT_MAX_GB = 20.0  #: default size bound of the table cache
+
+_table_cache = None
+
+
+def source_stat(filepath: str):
+    """Return the path, size and modification time identifying a version of a source file."""
+    stat = os.stat(filepath)
+    return [os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns]
+
+
+class TableCache(object):
+    """Directory of Arrow IPC files of parsed tables, evicted least recently used first."""
+
+    SUFFIX = '.arrow'
+
+    def __init__(self, cache_dir: str = DEFAULT_TABLE_CACHE_DIR, max_bytes: int = int(DEFAULT_MAX_GB * 1e9)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Return a cache key for JSON-serializable parts, e.g. `source_stat` and parse options."""
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def get(self, key: str):
+        """Return the cached table as a DataFrame, or None on a miss."""
+        import pyarrow as pa
+
+        path = self._path(key)
+        try:
+            source = pa.memory_map(path, 'r')
+        except FileNotFoundError:
+            return None
+
+        # mark as recently used
+        os.utime(path)
+
+        # numeric columns without nulls stay views on the memory map
+        table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
+
+    def set(self, key: str, data):
+        """Store a table, then evict tables until the cache fits its size bound. Return whether the table was stored."""
+        import pyarrow as pa
+
+        try:
+            table = pa.Table.from_pandas(data)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            logger.warning(f"Not caching table: {e}")
+            return False
+
+        # write to a temporary file first, so readers never see a partial table
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.evict()
+        return True
+
+    def get_tables(self, key: str):
+        """Return a dict of tables stored with `set_tables`, or None if any of them is missing."""
+        manifest_path = os.path.join(self.cache_dir, key + '.json')
+        try:
+            with open(manifest_path) as f:
+                tables = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        data = {}
+        for table in tables:
+            data[table] = self.get(self.key(key, table))
+            if data[table] is None:
+                return None
+
+        return data
+
+    def set_tables(self, key: str, data):
+        """Store a dict of tables under one key, listing them in a manifest only once every table is stored."""
+        manifest_path = os.path.join(self.cache_dir, key + '.json')
+        stored = [self.set(self.key(key, table), df) for table, df in data.items()]
+        if not all(stored):
+            # a manifest from an earlier store would now list a mix of old and new tables
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            return
+
+        with open(manifest_path, 'w') as f:
+            json.dump(list(data), f)
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.cache_dir, '*' + self.SUFFIX)))
+
+    def evict(self):
+        """Remove least recently used tables until the cache is within ``max_bytes``."""
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*' + self.SUFFIX)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.debug(f"Evicting {path} from the table cache")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.cache_dir, '*' + self.SUFFIX)) + glob.glob(os.path.join(self.cache_dir, '*.json')):
+            os.remove(path)
+
+    @property
+    def settings(self):
+        return self.cache_dir, self.max_bytes
+
+
+def configure(cache_dir: str = DEFAULT_TABLE_CACHE_DIR, max_bytes: int = int(DEFAULT_MAX_GB * 1e9)):
+    """Enable the table cache for this process."""
+    global _table_cache
+    _table_cache = TableCache(cache_dir, max_bytes=max_bytes)
+    return _table_cache
+
+
+def disable():
+    global _table_cache
+    _table_cache = None
+
+
+def get_table_cache():
+    """Return the configured table cache, or None if it is disabled."""
+    return _table_cache
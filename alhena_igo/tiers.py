@@ -0,0 +1,236 @@
+"""
+Downsampled tiers of the hmmcopy reads for zoomed-out heatmaps.
+
+Each tier aggregates the per-bin copy number of every cell into coarser
+bins: fixed 1 Mb or 10 Mb bins, or chromosome arms. Reads are aggregated
+chunk by chunk with vectorized groupbys into partial sums, so that tiers of
+streamed reads are built as the chunks go by. Each chunk's partial sums are
+folded into one running aggregate per tier with compact dtypes, so a tier
+holds at most one row per cell and coarse bin, whatever the number of chunks.
+
+Chromosome arms are split at the centromeres of the reads' reference
+assembly, as Isabl records it; an assembly without a `CENTROMERES` table
+cannot have an arm tier.
+
+Per coarse bin, ``copy`` and ``gc`` are the mean over the fine bins,
+``state`` the rounded mean state, ``reads`` the total, and ``n_bins`` the
+number of fine bins.
+
+.. currentmodule:: alhena_igo.tiers
+"""
+import numpy as np
+import pandas as pd
+
+from alhena_igo import defaults
+
+#: bin size of each fixed-size tier, None for chromosome arms
+READ_TIERS = defaults.READ_TIERS
+
+#: centromeres of each reference assembly, as (start, end) by chromosome, splitting chromosomes into p and q arms
+CENTROMERES = {
+    # the centromere gaps of the UCSC hg19 gap table
+    'GRCh37': {
+        '1': (121535434, 124535434),
+        '2': (92326171, 95326171),
+        '3': (90504854, 93504854),
+        '4': (49660117, 52660117),
+        '5': (46405641, 49405641),
+        '6': (58830166, 61830166),
+        '7': (58054331, 61054331),
+        '8': (43838887, 46838887),
+        '9': (47367679, 50367679),
+        '10': (39254935, 42254935),
+        '11': (51644205, 54644205),
+        '12': (34856694, 37856694),
+        '13': (16000000, 19000000),
+        '14': (16000000, 19000000),
+        '15': (17000000, 20000000),
+        '16': (35335801, 38335801),
+        '17': (22263006, 25263006),
+        '18': (15460898, 18460898),
+        '19': (24681782, 27681782),
+        '20': (26369569, 29369569),
+        '21': (11288129, 14288129),
+        '22': (13000000, 16000000),
+        'X': (58632012, 61632012),
+        'Y': (10104553, 13104553),
+    },
+    # the acen bands of the UCSC hg38 cytoband table
+    'GRCh38': {
+        '1': (121700000, 125100000),
+        '2': (91800000, 96000000),
+        '3': (87800000, 94000000),
+        '4': (48200000, 51800000),
+        '5': (46100000, 51400000),
+        '6': (58500000, 62600000),
+        '7': (58100000, 62100000),
+        '8': (43200000, 47200000),
+        '9': (42200000, 45500000),
+        '10': (38000000, 41600000),
+        '11': (51000000, 55800000),
+        '12': (33200000, 37800000),
+        '13': (16500000, 18900000),
+        '14': (16100000, 18200000),
+        '15': (17500000, 20500000),
+        '16': (35300000, 38400000),
+        '17': (22700000, 27400000),
+        '18': (15400000, 21500000),
+        '19': (24200000, 28100000),
+        '20': (25700000, 30400000),
+        '21': (10900000, 13000000),
+        '22': (13700000, 17400000),
+        'X': (58100000, 61000000),
+        'Y': (10300000, 10600000),
+    },
+}
+
+_SUMS = ['copy_sum', 'copy_count', 'state_sum', 'state_count', 'gc_sum', 'gc_count', 'reads', 'n_bins']
+
+#: compact dtypes of the running aggregates; states are small integers, so their float32 sums are exact
+_PARTIAL_DTYPES = {
+    'copy_sum': 'float32', 'copy_count': 'int32',
+    'state_sum': 'float32', 'state_count': 'int32',
+    'gc_sum': 'float32', 'gc_count': 'int32',
+    'reads': 'int32', 'n_bins': 'int32',
+    'start': 'int32', 'end': 'int32',
+}
+
+
+def tier_index(analysis_id: str, tier: str) -> str:
+    """Return the Alhena index of a tier of an analysis' reads."""
+    return f"{analysis_id.lower()}_bins_{tier}"
+
+
+def centromeres(assembly: str):
+    """Return the centromeres of a reference assembly, raising a ValueError for an assembly without a table."""
+    if assembly not in CENTROMERES:
+        raise ValueError(f"No centromeres known for assembly '{assembly}' to build the arm tier, expected one of {', '.join(CENTROMERES)}")
+    return CENTROMERES[assembly]
+
+
+def _arms(reads, centromeres):
+    """Return the arm, 'p' or 'q', of each bin by its midpoint; chromosomes without a known centromere are one 'p' arm."""
+    chromosomes = reads['chr'].astype('category')
+    names = chromosomes.cat.categories.astype(str).str.replace('^chr', '', regex=True)
+    midpoints = np.array([sum(centromeres.get(name, (np.inf, np.inf))) / 2 for name in names])
+
+    # vectorized lookup through the category codes
+    centromere = midpoints[chromosomes.cat.codes.to_numpy()]
+    bin_mid = (reads['start'].to_numpy(dtype='int64') + reads['end'].to_numpy(dtype='int64')) / 2
+    return pd.Categorical(np.where(bin_mid < centromere, 'p', 'q'), categories=['p', 'q'])
+
+
+def _partial(reads, tier: str, centromeres=None):
+    """Aggregate a chunk of reads into partial sums per cell and coarse bin of the tier."""
+    size = READ_TIERS[tier]
+    if size is None:
+        key = _arms(reads, centromeres)
+    else:
+        key = reads['start'].to_numpy(dtype='int64') // size
+
+    frame = pd.DataFrame({
+        'cell_id': reads['cell_id'].array,
+        'chr': reads['chr'].array,
+        'bin': key,
+        'copy': reads['copy'].to_numpy(dtype='float64'),
+        'state': reads['state'].to_numpy(dtype='float64'),
+        'gc': reads['gc'].to_numpy(dtype='float64') if 'gc' in reads else np.nan,
+        'reads': reads['reads'].to_numpy(dtype='int64') if 'reads' in reads else 0,
+        'start': reads['start'].to_numpy(dtype='int64'),
+        'end': reads['end'].to_numpy(dtype='int64'),
+    })
+    # hmmcopy marks unusable bins with a negative gc
+    frame.loc[frame['gc'] < 0, 'gc'] = np.nan
+
+    return frame.groupby(['cell_id', 'chr', 'bin'], observed=True, sort=False).agg(
+        copy_sum=('copy', 'sum'), copy_count=('copy', 'count'),
+        state_sum=('state', 'sum'), state_count=('state', 'count'),
+        gc_sum=('gc', 'sum'), gc_count=('gc', 'count'),
+        reads=('reads', 'sum'), n_bins=('start', 'size'),
+        start=('start', 'min'), end=('end', 'max'),
+    ).astype(_PARTIAL_DTYPES)
+
+
+def _combine(partial):
+    """Sum partial sums that share a cell and coarse bin."""
+    grouped = partial.groupby(level=['cell_id', 'chr', 'bin'], observed=True, sort=False)
+    return grouped[_SUMS].sum().join(grouped['start'].min()).join(grouped['end'].max()).astype(_PARTIAL_DTYPES)
+
+
+def _fold(total, partial):
+    """Fold the partial sums of a chunk into the running aggregate of a tier."""
+    if total is None:
+        return partial
+
+    shared = partial.index.isin(total.index)
+    if shared.any():
+        # only coarse bins split across chunks are in both, so only those are regrouped
+        in_partial = total.index.isin(partial.index[shared])
+        total = pd.concat([total[~in_partial], _combine(pd.concat([total[in_partial], partial[shared]]))])
+        partial = partial[~shared]
+
+    return pd.concat([total, partial])
+
+
+def _finalize(partial, tier: str):
+    """Turn the aggregate of a tier into the tier table."""
+    if partial is None:
+        return pd.DataFrame(columns=['cell_id', 'chr', 'start', 'end', 'copy', 'state', 'gc', 'reads', 'n_bins'])
+
+    size = READ_TIERS[tier]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        copy = partial['copy_sum'] / partial['copy_count']
+        state = (partial['state_sum'] / partial['state_count']).round()
+        gc = partial['gc_sum'] / partial['gc_count']
+
+    data = pd.DataFrame({
+        'copy': copy.astype('float32'),
+        'state': state.astype('Int8' if state.isna().any() else 'int8'),
+        'gc': gc.astype('float32'),
+        'reads': partial['reads'].astype('int32'),
+        'n_bins': partial['n_bins'].astype('int32'),
+        'start': partial['start'].astype('int32'),
+        'end': partial['end'].astype('int32'),
+    }).reset_index()
+
+    if size is None:
+        data = data.rename(columns={'bin': 'arm'})
+        data['arm'] = data['arm'].astype('category')
+    else:
+        # nominal boundaries, so that tiers of different cells line up
+        data['start'] = (data['bin'] * size + 1).astype('int32')
+        data['end'] = np.minimum((data['bin'] + 1) * size, data['end']).astype('int32')
+        data = data.drop(columns='bin')
+
+    for col in ('cell_id', 'chr'):
+        data[col] = data[col].astype('category')
+
+    return data.sort_values(['cell_id', 'chr', 'start'], ignore_index=True)
+
+
+class ReadTiers(object):
+    """Accumulate chunks of hmmcopy reads into downsampled tiers. The arm tier needs the reads' reference ``assembly``."""
+
+    def __init__(self, tiers=tuple(READ_TIERS), assembly: str = None):
+        for tier in tiers:
+            if tier not in READ_TIERS:
+                raise ValueError(f"Unknown read tier '{tier}', expected one of {', '.join(READ_TIERS)}")
+        self.tiers = list(tiers)
+        self.centromeres = centromeres(assembly) if any(READ_TIERS[tier] is None for tier in self.tiers) else None
+        self._totals = {tier: None for tier in self.tiers}
+
+    def add(self, reads):
+        """Aggregate a chunk of reads into each tier."""
+        for tier in self.tiers:
+            self._totals[tier] = _fold(self._totals[tier], _partial(reads, tier, self.centromeres))
+
+    def tables(self):
+        """Return the tier tables, keyed by tier."""
+        return {tier: _finalize(self._totals[tier], tier) for tier in self.tiers}
+
+
+def downsample_reads(reads, tiers=tuple(READ_TIERS), assembly: str = None):
+    """Return downsampled tiers of a reads table, keyed by tier."""
+    read_tiers = ReadTiers(tiers, assembly=assembly)
+    read_tiers.add(reads)
+    return read_tiers.tables()
@@ -1,6 +1,19 @@
 
+from concurrent.futures import Future
+import os
+import struct
+import threading
+import zlib
+
 from csverve.core import CsverveInput
+from csverve.errors import CsverveParseError
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+from alhena_igo import defaults
+from alhena_igo import profiling
+from alhena_igo import table_cache
 
 
 standard_hmmcopy_reads_cols = [
@@ -14,6 +27,12 @@ standard_hmmcopy_reads_cols = [
     'state',
 ]
 
+DEFAULT_CHUNKSIZE = 1000000  #: rows per chunk when streaming a table
+
+#: engines for parsing csverve files; pyarrow parses with multiple threads but cannot stream chunks
+CSV_ENGINES = defaults.CSV_ENGINES
+DEFAULT_CSV_ENGINE = defaults.DEFAULT_CSV_ENGINE
+
 _categorical_cols_align = [
     'cell_id',
     'sample_id',
@@ -27,10 +46,68 @@ _categorical_cols_hmmcopy = [
     'library_id',
 ]
 
+# Compact dtypes applied while parsing each QC table. A column is only cast if
+# the csverve dtype is of the same kind, e.g. an int column is never cast to
+# int8 if the file declares it as float.
+_dtypes_hmmcopy_reads = {
+    'chr': 'category',
+    'start': 'int32',
+    'end': 'int32',
+    'cell_id': 'category',
+    'gc': 'float32',
+    'reads': 'int32',
+    'copy': 'float32',
+    'state': 'int8',
+    'sample_id': 'category',
+    'library_id': 'category',
+}
+
+_dtypes_hmmcopy_segs = {
+    'chr': 'category',
+    'start': 'int32',
+    'end': 'int32',
+    'cell_id': 'category',
+    'state': 'int8',
+    'median': 'float32',
+    'multiplier': 'int8',
+    'sample_id': 'category',
+    'library_id': 'category',
+}
+
+_dtypes_metrics = {
+    'cell_id': 'category',
+    'sample_id': 'category',
+    'library_id': 'category',
+    'experimental_condition': 'category',
+    'cell_call': 'category',
+    'sample_type': 'category',
+    'index_i5': 'category',
+    'index_i7': 'category',
+    'primer_i5': 'category',
+    'primer_i7': 'category',
+    'state_mode': 'int8',
+    'row': 'int16',
+    'column': 'int16',
+    'img_col': 'int16',
+    'order': 'int32',
+}
+
+_dtypes_gc_metrics = {
+    'cell_id': 'category',
+    'sample_id': 'category',
+    'library_id': 'category',
+    **{str(gc): 'float32' for gc in range(101)},
+}
+
 
 def union_categories(dfs, cat_cols=None):
     """ Recreate specified categoricals on the union of categories inplace.
 
+    Categories are unioned from each frame's category index rather than from
+    its values, and each column is recoded only if its categories change, so
+    the cost scales with the number of categories, plus one pass over the
+    codes of each recoded column.
+
     Args:
         dfs (list of pandas.DataFrame): pandas dataframes to unify categoricals in-place.
     
@@ -46,38 +123,415 @@ def union_categories(dfs, cat_cols=None):
                 if df[col].dtype.name == 'category':
                     cat_cols.add(col)
 
-    # Get a list of categories for each column
-    col_categories = collections.defaultdict(set)
     for col in cat_cols:
-        for df in dfs:
-            if col in df:
-                col_categories[col].update(df[col].values)
+        frames = [df for df in dfs if col in df]
+        if not frames:
+            continue
 
-    # Remove None and nan as they cannot be in the list of categories
-    for col in col_categories:
-        col_categories[col] = col_categories[col] - set([None, np.nan])
+        for df in frames:
+            if df[col].dtype.name != 'category':
+                df[col] = df[col].astype('category')
 
-    # Create a pandas index for each set of categories
-    for col, categories in col_categories.items():
-        col_categories[col] = pd.Index(categories)
+        # Union the category indexes of empty categoricals, which never touches the codes
+        categories = union_categoricals(
+            [pd.Categorical([], dtype=df[col].dtype) for df in frames],
+            ignore_order=True,
+        ).categories
 
-    # Set all categorical columns as having teh same set of categories
-    for col in cat_cols:
-        for df in dfs:
-            if col in df:
-                df[col] = df[col].astype('category')
-                df[col] = df[col].cat.set_categories(col_categories[col])
+        for df in frames:
+            if not df[col].cat.categories.equals(categories):
+                df[col] = df[col].cat.set_categories(categories)
+
+
+def _compact_dtypes(csv_dtypes, dtype):
+    """ Return the csverve dtypes overridden by compatible entries of ``dtype``. """
+    dtypes = dict(csv_dtypes)
+
+    for col, compact in dtype.items():
+        if col not in dtypes:
+            continue
+
+        kind = pd.api.types.pandas_dtype(dtypes[col]).kind
+        compact_kind = pd.api.types.pandas_dtype(compact).kind
+
+        if compact == 'category':
+            if kind in 'OSU':
+                dtypes[col] = compact
+        elif compact_kind == kind:
+            dtypes[col] = compact
+
+    return dtypes
+
+
+def read_csverve(filepath, usecols=None, dtype=None, chunksize=None, engine=None):
+    """ Read a csverve file, casting columns to ``dtype`` as they are parsed.
+
+    Args:
+        filepath (str): path to the csverve file
+
+    KwArgs:
+        usecols (list of str): columns to read, default None for all columns.
+        dtype (dict): compact dtypes by column, applied where compatible with the csverve metadata.
+        chunksize (int): if given, return an iterator of DataFrames of this many rows.
+        engine (str): one of `CSV_ENGINES`, default `DEFAULT_CSV_ENGINE`. Chunked
+            reads always use the 'c' engine.
+    """
+    engine = engine or DEFAULT_CSV_ENGINE
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine '{engine}', expected one of {CSV_ENGINES}")
+    if chunksize:
+        engine = 'c'
+
+    csv_input = CsverveInput(filepath)
+
+    dtypes = _compact_dtypes(csv_input.dtypes, dtype or {})
+    columns = usecols if usecols else csv_input.columns
+
+    try:
+        data = pd.read_csv(
+            filepath,
+            compression='gzip',
+            chunksize=chunksize,
+            sep=csv_input.separator,
+            header=0 if csv_input.header else None,
+            names=None if csv_input.header else csv_input.columns,
+            dtype=dtypes,
+            usecols=usecols,
+            engine=engine,
+        )
+    except pd.errors.EmptyDataError:
+        data = pd.DataFrame(columns=columns).astype({col: dtypes[col] for col in columns})
+        return iter([data]) if chunksize else data
+
+    if chunksize:
+        # map keeps no reference to the chunks it yields, unlike a generator
+        return map(lambda chunk: _verify_columns(chunk, columns, filepath), data)
 
+    if engine == 'pyarrow':
+        # keep the column order of the file, as the c engine does
+        data = data[[col for col in csv_input.columns if col in data]]
 
-def process_data(filepath, _categorical_cols , usecols=None):
-    data = CsverveInput(filepath).read_csv(usecols=usecols)
+    return _verify_columns(data, columns, filepath)
 
+
+def _verify_columns(data, columns, filepath):
+    """ Raise a `CsverveParseError` if the parsed columns differ from the csverve metadata, as csverve does. """
+    if set(data.columns) != set(columns):
+        raise CsverveParseError(f"metadata mismatch in {filepath}")
+    return data
+
+
+def _drop_reference(data):
     data.query(f"cell_id != 'reference'", inplace=True)
 
     #data['library_id'] = [a.split('-')[-3] for a in data['cell_id']]
 
+    return data
+
+
+def _encode_categoricals(data, _categorical_cols):
     for col in _categorical_cols:
         if col in data:
-            data[col] = pd.Categorical(data[col])
+            if data[col].dtype.name == 'category':
+                data[col] = data[col].cat.remove_unused_categories()
+            else:
+                data[col] = pd.Categorical(data[col])
+
+    return data
+
+
+def _process_frame(data, _categorical_cols):
+    return _encode_categoricals(_drop_reference(data), _categorical_cols)
+
+
+class RowFilter(object):
+    """ Row predicates applied while a QC table is parsed.
+
+    A predicate is only applied to tables that have its column, e.g. a
+    chromosome subset does not filter the metrics tables.
+
+    KwArgs:
+        cells (list of str): cell IDs to keep, default None for all cells.
+        chromosomes (list of str): chromosomes to keep, default None for all chromosomes.
+    """
+
+    def __init__(self, cells=None, chromosomes=None):
+        self.cells = sorted(set(cells)) if cells is not None else None
+        self.chromosomes = sorted(set(chromosomes)) if chromosomes is not None else None
+
+    def _predicates(self):
+        if self.cells is not None:
+            yield 'cell_id', self.cells
+        if self.chromosomes is not None:
+            yield 'chr', self.chromosomes
+
+    def columns(self, available):
+        """ Return the columns of ``available`` that predicates are applied to. """
+        return [col for col, _ in self._predicates() if col in available]
+
+    def mask(self, data):
+        """ Return a boolean array of the rows of ``data`` that pass every applicable predicate. """
+        keep = np.ones(len(data), dtype=bool)
+        for col, values in self._predicates():
+            if col in data:
+                keep &= data[col].isin(values).to_numpy()
+        return keep
+
+    def intersect_cells(self, cells):
+        """ Return a filter that also requires cells to be in ``cells``. """
+        cells = set(cells)
+        if self.cells is not None:
+            cells &= set(self.cells)
+        return RowFilter(cells=cells, chromosomes=self.chromosomes)
+
+
+def cells_passing_quality(metrics_filepath, min_quality):
+    """ Return the IDs of cells whose ``quality`` in the metrics file is at least ``min_quality``. """
+    metrics = read_csverve(metrics_filepath, usecols=['cell_id', 'quality'])
+    return metrics.loc[metrics['quality'] >= min_quality, 'cell_id'].tolist()
+
+
+def _read_filtered_chunks(filepath, row_filter, usecols=None, dtype=None, chunksize=DEFAULT_CHUNKSIZE):
+    """ Yield chunks of a csverve file without the reference cell and rows failing ``row_filter``. """
+    columns = CsverveInput(filepath).columns
+    read_cols = None
+    if usecols:
+        # predicate columns are read even if not requested, then dropped
+        extra = [col for col in row_filter.columns(columns) + ['cell_id'] if col in columns and col not in usecols]
+        read_cols = list(usecols) + list(dict.fromkeys(extra))
+
+    for data in read_csverve(filepath, usecols=read_cols, dtype=dtype, chunksize=chunksize):
+        keep = row_filter.mask(data)
+        if 'cell_id' in data:
+            keep &= (data['cell_id'] != 'reference').to_numpy()
+        data = data.loc[keep]
+        if read_cols is not None and len(read_cols) > len(usecols):
+            data = data[[col for col in data.columns if col in usecols]]
+        yield data
+
+
+def read_filtered(filepath, row_filter, usecols=None, dtype=None, chunksize=DEFAULT_CHUNKSIZE):
+    """ Read a csverve file chunk by chunk, keeping only the columns and rows requested.
+
+    Rows are filtered as each chunk is parsed, so only one chunk of the full
+    file and the rows kept are held in memory. The reference cell is dropped.
+
+    Args:
+        filepath (str): path to the csverve file
+        row_filter (RowFilter): predicates rows must pass
+
+    KwArgs:
+        usecols (list of str): columns to read, default None for all columns.
+        dtype (dict): compact dtypes by column to apply while parsing.
+        chunksize (int): number of rows to parse per chunk.
+    """
+    chunks = list(_read_filtered_chunks(filepath, row_filter, usecols=usecols, dtype=dtype, chunksize=chunksize))
+
+    # chunks are categorical on their own categories, which concat would turn to objects
+    union_categories(chunks)
+    data = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].reset_index(drop=True)
+
+    return data
+
+
+def read_table(filepath, usecols=None, dtype=None, engine=None, row_filter=None):
+    """ Read a QC table without the reference cell, through the table cache if it is enabled.
+
+    Cached tables are keyed by the file's path, size and modification time,
+    the columns, the effective dtypes and the row filter.
+
+    Args:
+        filepath (str): path to the csverve file
+
+    KwArgs:
+        usecols (list of str): columns to read, default None for all columns.
+        dtype (dict): compact dtypes by column to apply while parsing.
+        engine (str): CSV parse engine, one of `CSV_ENGINES`.
+        row_filter (RowFilter): predicates rows must pass, see `read_filtered`.
+    """
+    cache = table_cache.get_table_cache()
+    if cache is not None:
+        key = cache.key(
+            table_cache.source_stat(filepath),
+            usecols,
+            _compact_dtypes(CsverveInput(filepath).dtypes, dtype or {}),
+            vars(row_filter) if row_filter is not None else None,
+        )
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    if row_filter is not None:
+        data = read_filtered(filepath, row_filter, usecols=usecols, dtype=dtype)
+    else:
+        data = _drop_reference(read_csverve(filepath, usecols=usecols, dtype=dtype, engine=engine))
+
+    if cache is not None:
+        cache.set(key, data)
+
+    return data
+
+
+def process_data(filepath, _categorical_cols , usecols=None, dtype=None, engine=None):
+    """ Read a QC table, dropping the reference cell and encoding categoricals.
+
+    Args:
+        filepath (str): path to the csverve file
+        _categorical_cols (list of str): columns to convert to categoricals
+
+    KwArgs:
+        usecols (list of str): columns to read, default None for all columns.
+        dtype (dict): compact dtypes by column to apply while parsing, e.g. `_dtypes_hmmcopy_reads`.
+        engine (str): CSV parse engine, one of `CSV_ENGINES`.
+    """
+    dtype = {**{col: 'category' for col in _categorical_cols}, **(dtype or {})}
+    data = read_table(filepath, usecols=usecols, dtype=dtype, engine=engine)
+
+    return _encode_categoricals(data, _categorical_cols)
+
+
+def process_data_chunks(filepath, _categorical_cols, usecols=None, dtype=None, chunksize=DEFAULT_CHUNKSIZE, row_filter=None):
+    """ Read a csverve file in chunks, yielding each chunk processed as in `process_data`.
+
+    Only one chunk of the file is held in memory at a time. With a
+    `RowFilter` rows that fail its predicates are dropped from each chunk.
+
+    Args:
+        filepath (str): path to the csverve file
+        _categorical_cols (list of str): columns to convert to categoricals
+
+    KwArgs:
+        usecols (list of str): columns to read, default None for all columns.
+        dtype (dict): compact dtypes by column to apply while parsing.
+        chunksize (int): number of rows to read per chunk.
+        row_filter (RowFilter): predicates rows must pass, default None for all rows.
+    """
+    dtype = {**{col: 'category' for col in _categorical_cols}, **(dtype or {})}
+    if row_filter is not None:
+        for data in _read_filtered_chunks(filepath, row_filter, usecols=usecols, dtype=dtype, chunksize=chunksize):
+            yield _encode_categoricals(data, _categorical_cols)
+        return
+
+    for data in read_csverve(filepath, usecols=usecols, dtype=dtype, chunksize=chunksize):
+        yield _process_frame(data, _categorical_cols)
+
+
+class TableLoader(object):
+    """ Parse QC tables, reading each csverve file at most once.
+
+    Parsed files are memoized by path, columns and effective dtypes, so tables
+    derived from the same cataloged result (e.g. align and hmmcopy metrics)
+    share a single read. Safe to use from several threads: a table requested
+    while its file is being parsed waits for that parse.
+
+    KwArgs:
+        engine (str): CSV parse engine, one of `CSV_ENGINES`.
+        row_filter (RowFilter): predicates rows must pass. Filtered tables are
+            read in chunks with the 'c' engine, see `read_filtered`.
+    """
+
+    def __init__(self, engine=None, row_filter=None):
+        self.engine = engine
+        self.row_filter = row_filter
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    def _parse(self, filepath, usecols, dtype):
+        dtypes = _compact_dtypes(CsverveInput(filepath).dtypes, dtype)
+        key = (filepath, tuple(usecols) if usecols else None, tuple(sorted(dtypes.items())))
+
+        with self._lock:
+            future = self._parsed.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._parsed[key] = Future()
+
+        if is_owner:
+            try:
+                with profiling.stage('parse', file=os.path.basename(filepath)) as record:
+                    data = read_table(filepath, usecols=usecols, dtype=dtype, engine=self.engine, row_filter=self.row_filter)
+                    record['rows'] = len(data)
+                    record['file_bytes'] = os.path.getsize(filepath)
+                future.set_result(data)
+            except Exception as e:
+                future.set_exception(e)
+
+        return future.result()
+
+    def load(self, filepath, _categorical_cols, usecols=None, dtype=None):
+        """ Return a table as `process_data` would, parsing the file only if not already parsed.
+
+        The returned DataFrame is a shallow copy of the memoized parse, so
+        assigning columns on it does not affect other tables from the same file.
+        """
+        dtype = {**{col: 'category' for col in _categorical_cols}, **(dtype or {})}
+        data = self._parse(filepath, usecols, dtype).copy(deep=False)
+
+        with profiling.stage('categorical', file=os.path.basename(filepath)):
+            return _encode_categoricals(data, _categorical_cols)
+
+    def clear(self):
+        with self._lock:
+            self._parsed = {}
+
+
+#: compressed bytes read at a time when sampling the first lines of a gzipped file
+_SAMPLE_BLOCK_SIZE = 65536
+
+
+def estimate_rows(filepath, sample_rows=1000):
+    """ Estimate the number of rows of a gzipped CSV without decompressing all of it.
+
+    The uncompressed size is divided by the mean length of the first
+    ``sample_rows`` lines. It is read from the gzip trailer, which only holds
+    the size modulo 4 GiB, and the multiple of 4 GiB to add is the one closest
+    to the compressed size times the compression ratio of the sampled lines.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        trailer_size = struct.unpack('<I', f.read(4))[0]
+        f.seek(0)
+
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        sample = b''
+        consumed = 0
+        ended = False
+        while sample.count(b'\n') <= sample_rows:
+            block = f.read(_SAMPLE_BLOCK_SIZE)
+            consumed += len(block)
+            sample += decompressor.decompress(block)
+            if not block or decompressor.eof:
+                ended = True
+                break
+
+    lines = sample.split(b'\n')
+    if ended and len(lines) <= sample_rows + 1:
+        # the whole file was sampled, so the count is exact (less the header and the empty end of the last line)
+        return max(len(lines) - (1 if lines[-1] == b'' else 0) - 1, 0)
+
+    lengths = [len(line) + 1 for line in lines[:sample_rows + 1]]
+    from_ratio = os.path.getsize(filepath) * len(sample) / consumed
+    wraps = max(round((from_ratio - trailer_size) / 2 ** 32), 0)
+    uncompressed_size = trailer_size + wraps * 2 ** 32
+
+    return int(uncompressed_size / (sum(lengths) / len(lengths)))
+
+
+def memory_report(data):
+    """ Return rows and in-memory size of each QC table as a DataFrame.
+
+    Args:
+        data (dict of pandas.DataFrame): QC tables keyed by table name.
+    """
+    report = []
+    for table, df in data.items():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        report.append({
+            'table': table,
+            'rows': len(df),
+            'columns': len(df.columns),
+            'megabytes': df.memory_usage(index=True, deep=True).sum() / 1e6,
+        })
 
-    return data
\ No newline at end of file
+    return pd.DataFrame(report, columns=['table', 'rows', 'columns', 'megabytes'])
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+Watch Isabl for newly SUCCEEDED analyses and load them into Alhena.
+
+A `Watcher` polls Isabl for analyses of the watched apps modified since a
+cursor, instead of listing whole projects again, and keeps the cursor in the
+ledger so that a restarted watch carries on where it stopped. New analyses
+are queued and loaded by a bounded pool of workers. The Isabl client, with
+its persistent connections, and the Elasticsearch clients stay open between
+polls.
+
+.. currentmodule:: alhena_igo.watch
+"""
+import asyncio
+import collections
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+import alhena_igo.isabl_async as isabl_async
+from alhena_igo import defaults
+from alhena_igo import ledger as load_ledger
+from alhena_igo import loader, profiling
+
+logger = logging.getLogger('alhena_igo')
+
+#: Isabl app whose SUCCEEDED analyses are dashboards of each framework
+WATCHED_APPS = defaults.WATCHED_APPS
+
+DEFAULT_INTERVAL = defaults.WATCH_INTERVAL  #: seconds between polls
+DEFAULT_RETRIES = defaults.WATCH_RETRIES  #: retries of a failed load, one per poll
+
+#: An analysis waiting to be loaded
+QueuedLoad = collections.namedtuple('QueuedLoad', ['analysis_id', 'framework', 'version', 'modified', 'action'])
+
+
+class Watcher(object):
+    """
+    Poll Isabl and load new analyses, as a context manager holding the clients and worker pool.
+
+    Args:
+        apps: ``(framework, version)`` pairs to watch.
+        projects: Alhena projects to load analyses into.
+        ledger (ledger.LoadLedger): records loads and the poll cursors.
+
+    KwArgs:
+        isabl_project (str): only watch analyses of this Isabl project.
+        workers (int): analyses loaded at once; above 1, in worker processes.
+        since (str): ISO timestamp to poll from when the ledger has no cursor, default now.
+        retries (int): retries of a failed load, one per poll.
+        bulk (bulk.BulkIndexer): optional indexer to load with.
+        client_options: passed on to `isabl_async.AsyncIsablClient`.
+    """
+
+    def __init__(self, apps: List[Tuple[str, str]], projects: List[str], host: str, port: int, es, ledger,
+                 isabl_project: str = None, workers: int = 1, since: str = None, retries: int = DEFAULT_RETRIES, bulk=None, **client_options):
+        for framework, _ in apps:
+            if framework not in WATCHED_APPS:
+                raise Exception(f"Unknown framework '{framework}'")
+
+        self.apps = list(apps)
+        self.projects = list(projects)
+        self.host = host
+        self.port = port
+        self.es = es
+        self.ledger = ledger
+        self.isabl_project = isabl_project
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.bulk = bulk
+        self.client_options = client_options
+
+        since = since or datetime.now(timezone.utc).isoformat()
+        self.cursors = {app: ledger.get_cursor(self._cursor_name(*app)) or since for app in self.apps}
+
+        self.queue = collections.deque()
+        self.running = {}  #: futures of loads in flight, to their `QueuedLoad`
+        self.failures = collections.Counter()
+        self._retry = []  #: failed loads to queue again at the next poll
+        self._polled = {}  #: latest modification time seen per app
+        self._seen = {}  #: modification time of each analysis last queued or skipped, from the oldest cursor on
+
+        self._loop = None
+        self._client = None
+        self._executor = None
+
+    def _cursor_name(self, framework: str, version: str) -> str:
+        return f"watch:{WATCHED_APPS[framework]}:{version}:{self.isabl_project or '*'}"
+
+    def __enter__(self):
+        self._loop = asyncio.new_event_loop()
+        self._client = isabl_async.AsyncIsablClient(**self.client_options)
+        self._loop.run_until_complete(self._client.__aenter__())
+
+        if self.workers == 1:
+            # the watcher's own Elasticsearch client stays warm for every load
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self._executor = loader.worker_pool(self.host, self.port, self.workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+        self._loop.run_until_complete(self._client.__aexit__(*exc_info))
+        self._loop.close()
+
+    def poll(self) -> int:
+        """Queue analyses of the watched apps that became SUCCEEDED since the cursor, returning how many were queued."""
+        queued = len(self._retry)
+        self.queue.extend(self._retry)
+        self._retry = []
+        alhena_analyses = None
+
+        for framework, version in self.apps:
+            filters = {
+                'application__name': WATCHED_APPS[framework],
+                'application__version': version,
+                'status': 'SUCCEEDED',
+                'modified__gte': self.cursors[(framework, version)],
+            }
+            if self.isabl_project is not None:
+                filters['targets__projects__pk'] = self.isabl_project
+
+            with profiling.stage('watch_poll', app=WATCHED_APPS[framework]):
+                analyses = self._loop.run_until_complete(self._client.get_analyses(**filters))
+
+            # analyses modified exactly at the cursor come back on the next poll too
+            new = [analysis for analysis in analyses if self._seen.get(str(analysis.pk)) != analysis.modified]
+            if analyses:
+                self._polled[(framework, version)] = max(analysis.modified for analysis in analyses)
+            if not new:
+                continue
+
+            pks = [str(analysis.pk) for analysis in new]
+            modified = {str(analysis.pk): analysis.modified for analysis in new}
+            self._loop.run_until_complete(isabl_async.prefetch_with(self._client, pks, framework, version))
+
+            if alhena_analyses is None:
+                alhena_analyses = [record['dashboard_id'] for record in self.es.get_analyses()]
+
+            # analyses modified in Isabl may have new results, so their sources are always compared
+            plan = loader.plan_loads(pks, alhena_analyses, framework, version, self.ledger, verify_sources=True, bulk=self.bulk)
+            for action, analysis_ids in plan.items():
+                for analysis_id in analysis_ids:
+                    self._seen[analysis_id] = modified[analysis_id]
+                    if action == load_ledger.SKIP or self._is_pending(analysis_id):
+                        continue
+                    self.queue.append(QueuedLoad(analysis_id, framework, version, modified[analysis_id], action))
+                    queued += 1
+
+        if queued:
+            logger.info(f"Queued {queued} analyses, {len(self.queue)} waiting and {len(self.running)} loading")
+        self._save_cursors()
+        return queued
+
+    def _is_pending(self, analysis_id: str) -> bool:
+        return any(load.analysis_id == analysis_id for load in list(self.queue) + list(self.running.values()))
+
+    def _save_cursors(self):
+        """Advance each app's cursor up to its oldest analysis not loaded yet, so a restart polls it again."""
+        pending = list(self.queue) + list(self.running.values()) + self._retry
+        advanced = False
+        for app in self.apps:
+            waiting = [load.modified for load in pending if (load.framework, load.version) == app]
+            cursor = min(waiting) if waiting else self._polled.get(app)
+            if cursor is not None and cursor != self.cursors[app]:
+                self.cursors[app] = cursor
+                self.ledger.set_cursor(self._cursor_name(*app), cursor)
+                advanced = True
+
+        if advanced:
+            # polls only return analyses modified from the cursors on, so older ones need not be remembered
+            oldest = min(self.cursors.values())
+            self._seen = {pk: modified for pk, modified in self._seen.items() if modified >= oldest}
+
+    def _submit(self):
+        while self.queue and len(self.running) < self.workers:
+            load = self.queue.popleft()
+            # resumed loads are only cleaned if alhenaloader did not finish, see `loader.index_parsed`
+            clean = True
+            resume = load.action == load_ledger.RESUME
+            if self.workers == 1:
+                future = self._executor.submit(
+                    loader.load_analysis, load.analysis_id, load.framework, load.version, self.projects, self.es,
+                    clean=clean, ledger=self.ledger, resume=resume, bulk=self.bulk,
+                )
+            else:
+                future = self._executor.submit(
+                    loader._load_in_worker, load.analysis_id, load.framework, load.version, self.projects,
+                    clean, self.ledger, resume, self.bulk, {},
+                )
+            self.running[future] = load
+
+    def step(self, timeout: float = None):
+        """Start queued loads and wait up to ``timeout`` seconds for one to finish, yielding ``(analysis_id, error)`` for finished loads."""
+        self._submit()
+        if not self.running:
+            return
+
+        done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+        profiler = profiling.get_profiler()
+        for future in done:
+            load = self.running.pop(future)
+            error = future.exception()
+            if error is None:
+                if self.workers > 1 and profiler is not None:
+                    profiler.extend(future.result())
+            else:
+                logger.error(f"Failed to load {load.analysis_id}: {error}")
+                self.failures[load.analysis_id] += 1
+                if self.failures[load.analysis_id] <= self.retries:
+                    # retried at the next poll, resuming from the steps that completed
+                    self._retry.append(load._replace(action=load_ledger.RESUME))
+            yield load.analysis_id, error
+
+        self._submit()
+        self._save_cursors()
+
+    def run(self, interval: float = DEFAULT_INTERVAL, polls: int = None):
+        """
+        Poll every ``interval`` seconds and load new analyses, yielding ``(analysis_id, error)`` as loads finish.
+
+        Runs until interrupted, or with ``polls``, until that many polls were
+        made and the analyses they queued are loaded.
+        """
+        count = 0
+        while polls is None or count < polls:
+            deadline = time.monotonic() + interval
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Polling Isabl failed, retrying at the next poll")
+            count += 1
+            last = polls is not None and count >= polls
+
+            while self.queue or self.running:
+                yield from self.step(timeout=None if last else max(deadline - time.monotonic(), 0))
+                if not last and time.monotonic() >= deadline:
+                    break
+
+            if not last:
+                time.sleep(max(deadline - time.monotonic(), 0))
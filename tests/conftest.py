@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: conftest
+
+Shared fixtures: synthetic DLP QC tables written as csverve files, and the
+benchmark harness.
+
+Benchmarks are marked ``benchmark`` and only run with ``--benchmark``. Their
+timings are compared against ``tests/benchmark_baseline.json``, which
+``--benchmark-save`` overwrites with the timings of the run.
+"""
+import gzip
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+_benchmark_results = {}
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', help='Run benchmarks')
+    parser.addoption('--benchmark-save', action='store_true', help='Save benchmark timings as the new baseline')
+    parser.addoption('--bench-cells', type=int, default=100, help='Cells per synthetic library in benchmarks')
+    parser.addoption('--bench-bins', type=int, default=1000, help='Bins per cell in synthetic benchmark libraries')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark') or config.getoption('--benchmark-save'):
+        return
+    skip = pytest.mark.skip(reason='benchmark, run with --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not _benchmark_results:
+        return
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    lines = ['', f"{'benchmark':<40} {'seconds':>10} {'baseline':>10} {'change':>8} {'per second':>12}"]
+    for name, result in sorted(_benchmark_results.items()):
+        previous = baseline.get('results', {}).get(name)
+        rate = f"{result['per_second']:>12,.0f}" if 'per_second' in result else f"{'-':>12}"
+        if previous is not None and previous['size'] == result['size']:
+            change = f"{result['seconds'] / previous['seconds'] - 1:+.0%}"
+            lines.append(f"{name:<40} {result['seconds']:>10.3f} {previous['seconds']:>10.3f} {change:>8} {rate}")
+        else:
+            lines.append(f"{name:<40} {result['seconds']:>10.3f} {'-':>10} {'-':>8} {rate}")
+    print('\n'.join(lines))
+
+    if session.config.getoption('--benchmark-save'):
+        results = dict(baseline.get('results', {}))
+        results.update(_benchmark_results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(), 'results': results}, f, indent=2, sort_keys=True)
+
+
+@pytest.fixture
+def bench_size(request):
+    return {'cells': request.config.getoption('--bench-cells'), 'bins': request.config.getoption('--bench-bins')}
+
+
+@pytest.fixture
+def benchmark(bench_size):
+    """
+    Time a callable, keeping the best of ``repeat`` runs.
+
+    ``setup`` is called before each run, untimed, and its result passed to the callable.
+    With ``items``, the number of items each run processes, the throughput is
+    recorded as well.
+    """
+    def run(name, func, setup=None, repeat=3, size=None, items=None):
+        best = None
+        for _ in range(repeat):
+            args = setup() if setup is not None else ()
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        _benchmark_results[name] = {'seconds': best, 'size': size or bench_size}
+        if items is not None:
+            _benchmark_results[name]['per_second'] = items / best
+        return result
+
+    return run
+
+
+def write_csverve(df, filepath):
+    """Write a DataFrame as a gzipped csverve file with its YAML metadata."""
+    with gzip.open(filepath, 'wt') as f:
+        df.to_csv(f, index=False)
+
+    dtypes = {
+        'int64': 'int', 'float64': 'float', 'object': 'str', 'bool': 'bool',
+    }
+    metadata = {
+        'header': True,
+        'sep': ',',
+        'columns': [
+            {'name': col, 'dtype': dtypes.get(df[col].dtype.name, 'str')}
+            for col in df.columns
+        ],
+    }
+    with open(filepath + '.yaml', 'wt') as f:
+        yaml.safe_dump(metadata, f)
+
+    return filepath
+
+
+def make_reads(n_cells=10, n_bins=100, seed=0, library_id='A90554A'):
+    """Return a synthetic hmmcopy reads table, including a 'reference' cell."""
+    rng = np.random.default_rng(seed)
+    cell_ids = [f'SA123-{library_id}-R{i // 20:02d}-C{i % 20:02d}' for i in range(n_cells)] + ['reference']
+    chroms = [str(c) for c in range(1, 23)] + ['X', 'Y']
+    chrom = np.array(chroms)[np.arange(n_bins) * len(chroms) // n_bins]
+    start = np.arange(n_bins) * 500000 + 1
+
+    n = len(cell_ids) * n_bins
+    state = rng.integers(0, 8, n)
+    return pd.DataFrame({
+        'chr': np.tile(chrom, len(cell_ids)),
+        'start': np.tile(start, len(cell_ids)),
+        'end': np.tile(start + 499999, len(cell_ids)),
+        'cell_id': np.repeat(cell_ids, n_bins),
+        'gc': rng.random(n),
+        'reads': rng.integers(0, 1000, n),
+        'copy': state + rng.normal(0, 0.3, n),
+        'state': state,
+        'sample_id': 'SA123',
+        'library_id': library_id,
+    })
+
+
+def make_segments(n_cells=10, n_segments=50, seed=0, library_id='A90554A'):
+    """Return a synthetic hmmcopy segments table."""
+    reads = make_reads(n_cells, n_segments, seed=seed, library_id=library_id)
+    return pd.DataFrame({
+        'chr': reads['chr'],
+        'start': reads['start'],
+        'end': reads['end'],
+        'state': reads['state'],
+        'median': reads['copy'],
+        'multiplier': 1,
+        'cell_id': reads['cell_id'],
+        'sample_id': reads['sample_id'],
+        'library_id': reads['library_id'],
+    })
+
+
+def make_metrics(n_cells=10, seed=0, library_id='A90554A'):
+    """Return a synthetic per-cell metrics table."""
+    rng = np.random.default_rng(seed)
+    cell_ids = make_reads(n_cells, 1, library_id=library_id)['cell_id']
+    n = len(cell_ids)
+    return pd.DataFrame({
+        'cell_id': cell_ids,
+        'sample_id': 'SA123',
+        'library_id': library_id,
+        'total_reads': rng.integers(10000, 2000000, n),
+        'total_mapped_reads': rng.integers(10000, 2000000, n),
+        'mad_neutral_state': rng.random(n),
+        'quality': rng.random(n),
+        'is_contaminated': rng.random(n) < 0.05,
+        'experimental_condition': rng.choice(['A', 'B', 'NTC'], n),
+        'state_mode': rng.integers(1, 5, n),
+        'order': np.arange(n),
+    })
+
+
+def make_gc_metrics(n_cells=10, seed=0, library_id='A90554A'):
+    """Return a synthetic per-cell GC bias table."""
+    rng = np.random.default_rng(seed)
+    cell_ids = make_reads(n_cells, 1, library_id=library_id)['cell_id']
+    gc = pd.DataFrame(rng.random((len(cell_ids), 101)), columns=[str(i) for i in range(101)])
+    gc.insert(0, 'cell_id', cell_ids.values)
+    return gc
+
+
+@pytest.fixture
+def reads_file(tmp_path):
+    return write_csverve(make_reads(), str(tmp_path / 'reads.csv.gz'))
+
+
+@pytest.fixture
+def qc_files(tmp_path):
+    """Synthetic csverve files named as in cataloged MONDRIAN-QC results."""
+    return {
+        'reads': write_csverve(make_reads(), str(tmp_path / 'reads.csv.gz')),
+        'segments': write_csverve(make_segments(), str(tmp_path / 'segments.csv.gz')),
+        'metrics': write_csverve(make_metrics(), str(tmp_path / 'metrics.csv.gz')),
+        'gc_metrics': write_csverve(make_gc_metrics(), str(tmp_path / 'gc_metrics.csv.gz')),
+    }
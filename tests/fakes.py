@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: fakes
+
+In-process stand-ins for isabl_cli and the Elasticsearch side of
+alhenaloader, for tests and benchmarks that run without either service.
+"""
+import fnmatch
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from alhena_igo.defaults import WATCHED_APPS
+from alhena_igo.loader import STREAMED_TABLE_INDEX
+from conftest import make_gc_metrics, make_metrics, make_reads, make_segments, write_csverve
+
+
+def _storage_url(i, results):
+    if results and i in results:
+        return os.path.dirname(results[i]['reads'])
+    return f'/isabl/analyses/{1000 + i}'
+
+
+#: analyses a framework's dashboard analysis is looked up with, by application name
+COMPANION_APPS = {
+    'mondrian': 'MONDRIAN-ALIGNMENT',
+    'scp': 'SCDNA-HMMCOPY',
+}
+
+
+def _lookup(record, path):
+    """Return the values at a Django-style ``__`` path of a record, following every item of list fields."""
+    if isinstance(record, list):
+        return [value for item in record for value in _lookup(item, path)]
+    if not path:
+        return [record]
+    return _lookup(getattr(record, path[0]), path[1:])
+
+
+def _matches(record, key, value):
+    """Whether a record passes an isabl_cli filter, e.g. ``targets__projects__pk=1`` or ``modified__gte=<date>``."""
+    path = key.split('__')
+    lookup = path.pop() if path[-1] in ('gte', 'lte', 'in') else 'exact'
+    values = [str(v) for v in _lookup(record, path)]
+
+    if lookup == 'in':
+        wanted = value.split(',') if isinstance(value, str) else [str(v) for v in value]
+        return any(v in wanted for v in values)
+    if lookup == 'gte':
+        return any(v >= str(value) for v in values)
+    if lookup == 'lte':
+        return any(v <= str(value) for v in values)
+    return str(value) in values
+
+
+class FakeIsabl(object):
+    """
+    Stand-in for the isabl_cli module, for Isabl project 1.
+
+    Every other experiment has a SUCCEEDED analysis of the framework's
+    dashboard application, in ``analyses``, and of the application it is
+    looked up with, if any, in ``companions``. List endpoints apply their
+    filters and count REST round trips the way isabl_cli paginates them.
+    ``results`` optionally maps experiment index to cataloged MONDRIAN-QC results.
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self, n_experiments, results=None, framework='mondrian', version='v1'):
+        self.round_trips = 0
+        self.experiments = [
+            SimpleNamespace(
+                system_id=f'EXP{i}',
+                aliquot_id=f'A{i}',
+                library_id=f'A9055{i}A',
+                sample=SimpleNamespace(identifier=f'SA{i}'),
+                projects=[SimpleNamespace(pk=1)],
+                technique=SimpleNamespace(name='Single Cell DNA Seq'),
+            )
+            for i in range(n_experiments)
+        ]
+
+        def analysis(pk, i, app):
+            return SimpleNamespace(
+                pk=pk,
+                status='SUCCEEDED',
+                targets=[self.experiments[i]],
+                storage_url=_storage_url(i, results),
+                results=(results or {}).get(i),
+                application=SimpleNamespace(name=app, version=version, assembly=SimpleNamespace(name='GRCh37')),
+                modified=f'2024-01-01T00:00:{i:02d}+00:00',
+            )
+
+        # every third experiment has no analysis
+        indices = [i for i in range(n_experiments) if i % 3 != 0]
+        self.analyses = [analysis(1000 + i, i, WATCHED_APPS[framework]) for i in indices]
+        self.companions = [analysis(2000 + i, i, COMPANION_APPS[framework]) for i in indices] if framework in COMPANION_APPS else []
+
+    def _paginate(self, records):
+        self.round_trips += max(1, math.ceil(len(records) / self.PAGE_SIZE))
+        return records
+
+    def get_experiments(self, **filters):
+        return self._paginate([e for e in self.experiments if all(_matches(e, k, v) for k, v in filters.items())])
+
+    def get_analyses(self, **filters):
+        analyses = self.analyses + self.companions
+        return self._paginate([a for a in analyses if all(_matches(a, k, v) for k, v in filters.items())])
+
+    def get_instance(self, endpoint, pk):
+        self.round_trips += 1
+        analysis = next(a for a in self.analyses + self.companions if a.pk == int(pk))
+        target = analysis.targets[0]
+        return {
+            'status': analysis.status,
+            'application': {'assembly': {'name': analysis.application.assembly.name}},
+            'targets': [{
+                'library_id': target.library_id,
+                'sample': {'identifier': target.sample.identifier},
+                'aliquot_id': target.aliquot_id,
+            }],
+        }
+
+
+def _to_json(value):
+    if isinstance(value, SimpleNamespace):
+        return {key: _to_json(v) for key, v in vars(value).items()}
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    return value
+
+
+class _FakeServer(object):
+    """
+    Local threaded HTTP server answering JSON, used as a context manager.
+
+    The next ``fail`` requests get a 503. ``delay`` seconds are spent on
+    every request, so that concurrent requests overlap, and the most requests
+    in flight at once is kept in ``max_in_flight``.
+    """
+
+    def __init__(self, delay=0.01, fail=0):
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                status, body = server.handle(self.command, self.path, self.rfile.read(length))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_port
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def handle(self, method, path, body):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failing = self.fail > 0
+            self.fail -= failing
+        try:
+            time.sleep(self.delay)
+            if failing:
+                return 503, {'detail': 'unavailable'}
+            return self.respond(method, path, body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FakeIsablServer(_FakeServer):
+    """Local HTTP server speaking the Isabl REST API, backed by a `FakeIsabl`. ``url`` is the API URL."""
+
+    def __init__(self, isabl, page_size=100, delay=0.01, fail=0):
+        super().__init__(delay=delay, fail=fail)
+        self.isabl = isabl
+        self.page_size = page_size
+        self.url = f'http://127.0.0.1:{self.port}/api/v1/'
+
+    def respond(self, method, path, body):
+        url = urlsplit(path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        endpoint = url.path[len('/api/v1/'):].strip('/').split('/')
+
+        if endpoint[0] == 'analyses' and len(endpoint) == 2:
+            return 200, self.isabl.get_instance('analyses', endpoint[1])
+
+        filters = {key: value for key, value in params.items() if key not in ('format', 'limit', 'offset')}
+        if endpoint[0] == 'analyses':
+            records = self.isabl.get_analyses(**filters)
+        elif endpoint[0] == 'experiments':
+            records = self.isabl.get_experiments(**filters)
+        else:
+            return 404, {'detail': 'not found'}
+
+        offset = int(params.get('offset', 0))
+        page = records[offset:offset + self.page_size]
+        next_url = None
+        if offset + self.page_size < len(records):
+            query = urlencode({**filters, 'offset': offset + self.page_size})
+            next_url = f'{self.url}{endpoint[0]}?{query}'
+
+        return 200, {'count': len(records), 'next': next_url, 'results': _to_json(page)}
+
+
+class FakeESServer(_FakeServer):
+    """
+    Local HTTP server answering the Elasticsearch requests of a bulk load.
+
+    Counts documents per index in ``docs``, applies index templates to
+    indices created by a bulk request, keeps index settings in ``settings``
+    and deletes indices by name. ``doc_seconds`` are spent per document of a bulk request,
+    as indexing would.
+    """
+
+    def __init__(self, delay=0.002, doc_seconds=2e-6):
+        super().__init__(delay=delay)
+        self.doc_seconds = doc_seconds
+        self.docs = {}
+        self.settings = {}
+        self.templates = {}
+
+    def create_index(self, index, settings=None):
+        with self._lock:
+            if index in self.settings:
+                return
+            self.settings[index] = dict(settings or {})
+            for template in self.templates.values():
+                if any(fnmatch.fnmatch(index, pattern) for pattern in template['index_patterns']):
+                    self.settings[index].update(template['settings']['index'])
+            self.docs.setdefault(index, 0)
+
+    def respond(self, method, path, body):
+        url = urlsplit(path)
+        parts = url.path.strip('/').split('/')
+
+        if method == 'POST' and parts == ['_bulk']:
+            lines = body.decode().splitlines()
+            items = []
+            for action, document in zip(lines[::2], lines[1::2]):
+                index = json.loads(action)['index']['_index']
+                json.loads(document)
+                self.create_index(index)
+                with self._lock:
+                    self.docs[index] += 1
+                items.append({'index': {'_index': index, 'status': 201}})
+            time.sleep(self.doc_seconds * len(items))
+            return 200, {'errors': False, 'items': items}
+
+        if parts[0] == '_template':
+            if method == 'PUT':
+                self.templates[parts[1]] = json.loads(body)
+            else:
+                self.templates.pop(parts[1], None)
+            return 200, {'acknowledged': True}
+
+        if len(parts) == 1 and method == 'DELETE':
+            with self._lock:
+                for index in parts[0].split(','):
+                    self.settings.pop(index)
+                    self.docs.pop(index)
+            return 200, {'acknowledged': True}
+
+        if len(parts) == 2 and parts[1] == '_settings':
+            patterns = parts[0].split(',')
+            indices = [index for index in self.settings if any(fnmatch.fnmatch(index, pattern) for pattern in patterns)]
+            if method == 'GET':
+                return 200, {index: {'settings': {'index': dict(self.settings[index])}} for index in indices}
+            for key, value in json.loads(body)['index'].items():
+                for index in indices:
+                    if value is None:
+                        self.settings[index].pop(key, None)
+                    else:
+                        self.settings[index][key] = value
+            return 200, {'acknowledged': True}
+
+        return 404, {'error': f'no handler for {method} {path}'}
+
+
+class FakeES(object):
+    """
+    Stand-in for `alhenaloader.ES`.
+
+    Documents are serialized to records as a bulk load would, and counted per
+    index rather than stored.
+    """
+
+    ANALYSIS_ENTRY_INDEX = 'analyses'
+
+    def __init__(self, host='localhost', port=9200):
+        self.docs = {}
+        self.analyses = {}
+        self.projects = {}
+        self.requests = 0
+
+    def load_df(self, df, index_name, batch_size=int(1e5)):
+        for start in range(0, len(df), batch_size):
+            records = df.iloc[start:start + batch_size].to_dict(orient='records')
+            self.docs[index_name] = self.docs.get(index_name, 0) + len(records)
+            self.requests += 1
+
+    def load_record(self, record, record_id, index_name):
+        self.analyses[record_id] = record
+        self.requests += 1
+
+    def get_analyses(self):
+        self.requests += 1
+        return list(self.analyses.values())
+
+    def add_analyses_to_project(self, project, analysis_ids):
+        self.projects.setdefault(project, set()).update(analysis_ids)
+        self.requests += 1
+
+    def add_analysis_to_projects(self, analysis_id, projects):
+        for project in projects:
+            self.projects.setdefault(project, set()).add(analysis_id)
+        self.requests += 1
+
+    def get_project_analyses(self, project):
+        self.requests += 1
+        return sorted(self.projects.get(project, set()))
+
+    def remove_analysis_from_projects(self, analysis_id, projects=None):
+        for project in projects or list(self.projects):
+            self.projects.get(project, set()).discard(analysis_id)
+        self.requests += 1
+
+    def delete_index(self, index):
+        self.docs.pop(index, None)
+        self.requests += 1
+
+    def delete_analysis(self, analysis_id):
+        # like alhenaloader, only the indices alhenaloader loads; not those derived at load time
+        prefix = f'{analysis_id.lower()}_'
+        self.docs = {
+            index: n for index, n in self.docs.items()
+            if not index.startswith(prefix) or index.startswith(f'{prefix}bins_') or index == f'{prefix}cells'
+        }
+        self.analyses.pop(analysis_id, None)
+        self.remove_analysis_from_projects(analysis_id)
+
+
+def fake_load_analysis(analysis_id, data, metadata, projects, es, framework):
+    """Stand-in for `alhenaloader.load_analysis`, writing the reads to the same ``<analysis>_bins`` index."""
+    for table, df in data.items():
+        es.load_df(df, f'{analysis_id.lower()}_{STREAMED_TABLE_INDEX.get(table, table)}')
+    es.load_record(metadata, analysis_id, es.ANALYSIS_ENTRY_INDEX)
+    es.add_analysis_to_projects(analysis_id, projects)
+
+
+def fake_clean_analysis(analysis_id, es):
+    """Stand-in for `alhenaloader.clean_analysis`."""
+    es.delete_analysis(analysis_id)
+
+
+def fake_process_analysis_entry(dashboard_id, library_id, sample_id, description, metadata):
+    """Stand-in for `alhenaloader.process_analysis_entry`."""
+    return {
+        'dashboard_id': dashboard_id,
+        'library_id': library_id,
+        'sample_id': sample_id,
+        'description': description,
+        **metadata,
+    }
+
+
+def write_qc_results(directory, n_cells=10, n_bins=100, seed=0, library_id='A90554A'):
+    """Write synthetic cataloged MONDRIAN-QC results of a library to a directory and return them."""
+    os.makedirs(directory, exist_ok=True)
+    return {
+        'reads': write_csverve(make_reads(n_cells, n_bins, seed=seed, library_id=library_id), os.path.join(directory, 'reads.csv.gz')),
+        'segments': write_csverve(make_segments(n_cells, max(n_bins // 10, 1), seed=seed, library_id=library_id), os.path.join(directory, 'segments.csv.gz')),
+        'metrics': write_csverve(make_metrics(n_cells, seed=seed, library_id=library_id), os.path.join(directory, 'metrics.csv.gz')),
+        'gc_metrics': write_csverve(make_gc_metrics(n_cells, seed=seed, library_id=library_id), os.path.join(directory, 'gc_metrics.csv.gz')),
+    }
+
+
+def install(monkeypatch, isabl, es):
+    """
+    Route alhena_igo's Isabl and Elasticsearch calls to the given fakes.
+
+    ``es`` is returned for every `alhenaloader.ES` created, including by the CLI.
+    """
+    import alhenaloader
+    import alhena_igo.isabl
+    import alhena_igo.loader
+
+    monkeypatch.setattr(alhena_igo.isabl, 'ii', isabl)
+    monkeypatch.setattr(alhenaloader, 'ES', lambda host, port: es, raising=False)
+    monkeypatch.setattr(alhenaloader, 'load_analysis', fake_load_analysis, raising=False)
+    monkeypatch.setattr(alhenaloader, 'clean_analysis', fake_clean_analysis, raising=False)
+    monkeypatch.setattr(alhenaloader, 'process_analysis_entry', fake_process_analysis_entry, raising=False)
+
+    def fake_load_qc_results(framework, alignment_results_dir=None, hmmcopy_results_dir=None, **kwargs):
+        # scp/mondrian results are read from the same synthetic csverve files
+        results = {
+            result: os.path.join(hmmcopy_results_dir, f'{result}.csv.gz')
+            for result in ('reads', 'segments', 'metrics', 'gc_metrics')
+        }
+        return alhena_igo.loader.get_mondrian_nf_data(results)
+
+    monkeypatch.setattr(alhena_igo.loader, 'load_qc_results', fake_load_qc_results)
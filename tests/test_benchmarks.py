@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_benchmarks
+
+Timing benchmarks of the parse and load paths against synthetic libraries and
+fake Isabl and Elasticsearch backends. Run with ``pytest --benchmark``; the
+size of the synthetic libraries is set with ``--bench-cells`` and
+``--bench-bins``.
+"""
+import alhenaloader
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner, Result
+
+import alhena_igo.cli as cli
+from alhena_igo import bulk, table_cache, utils
+from fakes import FakeES, FakeESServer, FakeIsabl, install, write_qc_results
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.fixture(scope='module')
+def bench_results(tmp_path_factory, request):
+    """Synthetic results of three analyses, keyed by experiment index as `FakeIsabl` expects."""
+    n_cells = request.config.getoption('--bench-cells')
+    n_bins = request.config.getoption('--bench-bins')
+    directory = tmp_path_factory.mktemp('bench')
+    return {
+        i: write_qc_results(str(directory / f'analysis{i}'), n_cells, n_bins, seed=i, library_id=f'A9055{i}A')
+        for i in (1, 2, 4)
+    }
+
+
+@pytest.mark.parametrize('table,result,categorical_cols,usecols,dtype', [
+    ('reads', 'reads', utils._categorical_cols_hmmcopy, utils.standard_hmmcopy_reads_cols + ['sample_id', 'library_id'], utils._dtypes_hmmcopy_reads),
+    ('segs', 'segments', utils._categorical_cols_hmmcopy, None, utils._dtypes_hmmcopy_segs),
+    ('metrics', 'metrics', utils._categorical_cols_align, None, utils._dtypes_metrics),
+])
+def test_process_data(benchmark, bench_results, table, result, categorical_cols, usecols, dtype):
+    """
+    Arrange: Write a synthetic library.
+    Act: Time `process_data` on one of its tables.
+    Assert: The reference cell is dropped.
+    """
+    filepath = bench_results[1][result]
+
+    data = benchmark(
+        f'process_data[{table}]',
+        lambda: utils.process_data(filepath, categorical_cols, usecols=usecols, dtype=dtype),
+    )
+
+    assert len(data) > 0
+    assert 'reference' not in set(data['cell_id'])
+
+
+@pytest.mark.parametrize('engine', utils.CSV_ENGINES)
+def test_process_data_engine(benchmark, bench_results, engine):
+    """
+    Arrange: Write a synthetic library.
+    Act: Time parsing its reads with each CSV engine, in rows per second.
+    Assert: Every engine parses the same rows.
+    """
+    if engine == 'pyarrow':
+        pytest.importorskip('pyarrow')
+
+    filepath = bench_results[1]['reads']
+    usecols = list(utils.standard_hmmcopy_reads_cols)
+
+    def parse(engine):
+        return utils.process_data(filepath, utils._categorical_cols_hmmcopy, usecols=usecols, dtype=utils._dtypes_hmmcopy_reads, engine=engine)
+
+    rows = len(parse('c'))
+    data = benchmark(f'process_data[reads, {engine} engine]', lambda: parse(engine), items=rows)
+
+    assert len(data) == rows > 0
+
+
+def test_process_data_warm_table_cache(benchmark, bench_results, tmp_path):
+    """
+    Arrange: Parse a synthetic reads table once with the table cache enabled.
+    Act: Time `process_data` on it again.
+    Assert: The warm table equals the parsed one.
+    """
+    filepath = bench_results[1]['reads']
+    args = (filepath, utils._categorical_cols_hmmcopy)
+    kwargs = {'dtype': utils._dtypes_hmmcopy_reads}
+    cold = utils.process_data(*args, **kwargs)
+
+    table_cache.configure(str(tmp_path / 'tables'))
+    try:
+        utils.process_data(*args, **kwargs)
+        warm = benchmark('process_data[reads, warm table cache]', lambda: utils.process_data(*args, **kwargs))
+    finally:
+        table_cache.disable()
+
+    pd.testing.assert_frame_equal(warm, cold)
+
+
+def test_union_categories(benchmark, bench_results):
+    """
+    Arrange: Parse the reads of three synthetic libraries.
+    Act: Time `union_categories` across them.
+    Assert: Every frame shares the same categories.
+    """
+    reads = [
+        utils.process_data(results['reads'], utils._categorical_cols_hmmcopy, dtype=utils._dtypes_hmmcopy_reads)
+        for results in bench_results.values()
+    ]
+
+    benchmark(
+        'union_categories',
+        lambda *dfs: utils.union_categories(list(dfs)),
+        setup=lambda: [df.copy() for df in reads],
+    )
+
+    dfs = [df.copy() for df in reads]
+    utils.union_categories(dfs)
+    for col in utils._categorical_cols_hmmcopy:
+        assert len(set(tuple(df[col].cat.categories) for df in dfs)) == 1
+
+
+def test_union_categories_many_frames(benchmark, bench_size):
+    """
+    Arrange: Build two dozen reads-sized frames whose cell IDs partly overlap.
+    Act: Time `union_categories` across them.
+    Assert: Every frame shares the same cell ID categories.
+    """
+    n_frames = 24
+    n_rows = bench_size['cells'] * bench_size['bins']
+    frames = []
+    for i in range(n_frames):
+        cells = pd.Categorical([f'SA123-A9{i // 2:04d}A-R01-C{c:04d}' for c in range(bench_size['cells'])])
+        frames.append(pd.DataFrame({
+            'cell_id': pd.Categorical.from_codes(np.arange(n_rows) % len(cells.categories), dtype=cells.dtype),
+            'chr': pd.Categorical(np.full(n_rows, str(i % 22 + 1))),
+        }))
+
+    benchmark(
+        'union_categories[many_frames]',
+        lambda *dfs: utils.union_categories(list(dfs)),
+        setup=lambda: [df.copy() for df in frames],
+        size={**bench_size, 'frames': n_frames},
+    )
+
+    dfs = [df.copy() for df in frames]
+    utils.union_categories(dfs)
+    assert all(df['cell_id'].cat.categories.equals(dfs[0]['cell_id'].cat.categories) for df in dfs)
+    assert len(dfs[0]['cell_id'].cat.categories) == n_frames // 2 * bench_size['cells']
+
+
+def test_cli_load(benchmark, bench_results, monkeypatch):
+    """
+    Arrange: Route Isabl and Elasticsearch to fakes serving a synthetic library.
+    Act: Time the `load` subcommand for a mondrian_nf analysis.
+    Assert: Every non-reference bin is indexed.
+    """
+    isabl = FakeIsabl(3, results=bench_results, framework='mondrian_nf')
+    es = FakeES()
+    install(monkeypatch, isabl, es)
+
+    runner: CliRunner = CliRunner()
+    result: Result = benchmark('cli.load', lambda: runner.invoke(cli.cli, [
+        "--no-cache", "load", "--analysis_id", "1001", "--framework", "mondrian_nf", "--version", "v1",
+    ]))
+
+    assert result.exit_code == 0, result.output
+    assert es.docs['1001_bins'] > 0
+
+
+def test_cli_load_project(benchmark, bench_results, monkeypatch):
+    """
+    Arrange: Route Isabl and Elasticsearch to fakes serving a project of synthetic libraries.
+    Act: Time the `load_project` subcommand, loading every analysis each run.
+    Assert: Every analysis is loaded and added to the project.
+    """
+    isabl = FakeIsabl(5, results=bench_results)
+    install(monkeypatch, isabl, FakeES())
+
+    def setup():
+        # a fresh Alhena, so each run loads the whole project
+        es = FakeES()
+        monkeypatch.setattr(alhenaloader, 'ES', lambda host, port: es)
+        return (es,)
+
+    def run(es):
+        runner: CliRunner = CliRunner()
+        result = runner.invoke(cli.cli, [
+            "--no-cache", "load-project", "--isabl", "1", "--framework", "mondrian", "--version", "v1", "--no-ledger",
+        ])
+        return result, es
+
+    result, es = benchmark('cli.load_project', run, setup=setup)
+
+    assert result.exit_code == 0, result.output
+    assert es.projects['DLP'] == set(str(analysis.pk) for analysis in isabl.analyses)
+
+
+@pytest.mark.parametrize('chunk_size,workers', [(500, 1), (5000, 1), (5000, 4), (20000, 4)])
+def test_bulk_load_df(benchmark, bench_results, chunk_size, workers):
+    """
+    Arrange: Parse a synthetic reads table and start a fake Elasticsearch server.
+    Act: Time bulk loading the reads with a chunk size and number of workers, as documents per second.
+    Assert: Every row is indexed.
+    """
+    reads = utils.process_data(bench_results[1]['reads'], utils._categorical_cols_hmmcopy, dtype=utils._dtypes_hmmcopy_reads)
+
+    with FakeESServer() as server:
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, chunk_size=chunk_size, workers=workers)
+        total = benchmark(
+            f'bulk.load_df[chunk={chunk_size},workers={workers}]',
+            lambda: indexer.load_df(reads, 'bench_bins'),
+            items=len(reads),
+        )
+
+    assert total == len(reads)
+
+
+def test_downsample_reads(benchmark, bench_results):
+    """
+    Arrange: Parse a synthetic reads table.
+    Act: Time building its 1 Mb, 10 Mb and chromosome-arm tiers, in rows per second.
+    Assert: Each tier is smaller than the reads.
+    """
+    from alhena_igo import tiers
+
+    reads = utils.process_data(bench_results[1]['reads'], utils._categorical_cols_hmmcopy, dtype=utils._dtypes_hmmcopy_reads)
+
+    data = benchmark('tiers.downsample_reads', lambda: tiers.downsample_reads(reads, assembly='GRCh37'), items=len(reads))
+
+    assert all(0 < len(df) < len(reads) for df in data.values())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_bulk
+
+Tests for tuned bulk indexing against a local fake Elasticsearch server.
+"""
+import pandas as pd
+import pytest
+
+from alhena_igo import bulk, loader
+from fakes import FakeES, FakeESServer, FakeIsabl
+
+
+def _frame(n_rows):
+    return pd.DataFrame({'cell_id': [f'cell{i % 7}' for i in range(n_rows)], 'state': range(n_rows)})
+
+
+@pytest.mark.parametrize('chunk_size,workers', [(100, 1), (7, 4), (5000, 2)])
+def test_load_df_indexes_every_row(chunk_size, workers):
+    """
+    Arrange: Start a fake Elasticsearch server.
+    Act: Bulk load a DataFrame with several chunk sizes and worker counts.
+    Assert: Every row is indexed once, with up to ``workers`` requests in flight.
+    """
+    with FakeESServer() as server:
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, chunk_size=chunk_size, workers=workers)
+        assert indexer.load_df(_frame(250), 'a90551a_bins') == 250
+
+    assert server.docs == {'a90551a_bins': 250}
+    assert server.max_in_flight <= workers
+
+
+def test_tuned_restores_settings():
+    """
+    Arrange: Create one index of an analysis with explicit settings.
+    Act: Load into it and into a new index of the analysis with refreshes and replicas turned off.
+    Assert: Both indices have the tuned settings during the load; afterwards the
+        existing index has its previous settings back, the new one the defaults,
+        and the temporary template is gone.
+    """
+    with FakeESServer() as server:
+        server.create_index('1001_qc', {'refresh_interval': '30s', 'number_of_replicas': 2})
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, refresh_interval='-1', replicas=0)
+
+        with indexer.tuned(['1001_qc', '1001_bins', '1001_segs']):
+            indexer.load_df(_frame(10), '1001_qc')
+            indexer.load_df(_frame(10), '1001_bins')
+            during = {index: dict(settings) for index, settings in server.settings.items()}
+
+    assert during == {
+        '1001_qc': {'refresh_interval': '-1', 'number_of_replicas': 0},
+        '1001_bins': {'refresh_interval': '-1', 'number_of_replicas': 0},
+    }
+    assert server.settings == {'1001_qc': {'refresh_interval': '30s', 'number_of_replicas': 2}, '1001_bins': {}}
+    assert server.templates == {}
+
+
+def test_index_analysis_streams_through_bulk(monkeypatch):
+    """
+    Arrange: Split a reads table into chunks as streamed tables are.
+    Act: Index the analysis with a bulk indexer.
+    Assert: The chunks are written by the bulk indexer, and the other tables by alhenaloader.
+    """
+    loaded = {}
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', lambda analysis_id, data, *args: loaded.update(data))
+    reads = _frame(30)
+    data = {'hmmcopy_reads': iter([reads.iloc[:10], reads.iloc[10:]]), 'metrics': _frame(3)}
+
+    with FakeESServer() as server:
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, chunk_size=4, replicas=0)
+        loader.index_analysis('1001', data, {}, ['DLP'], FakeES(), 'mondrian', bulk=indexer)
+
+    assert len(loaded['hmmcopy_reads']) == 10
+    assert server.docs == {'1001_bins': 20}
+    assert server.settings == {'1001_bins': {}}
+
+
+def test_index_analysis_writes_whole_reads_through_bulk(monkeypatch):
+    """
+    Arrange: Give the reads as one DataFrame, as scp and mondrian parse them.
+    Act: Index the analysis with a bulk indexer.
+    Assert: alhenaloader gets the first rows of the reads, and the bulk indexer writes the rest.
+    """
+    loaded = {}
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', lambda analysis_id, data, *args: loaded.update(data))
+    monkeypatch.setattr(loader, 'BULK_HEAD_ROWS', 10)
+    monkeypatch.setattr(loader, 'BULK_SLICE_ROWS', 8)
+
+    with FakeESServer() as server:
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, chunk_size=4, workers=2)
+        loader.index_analysis('1001', {'hmmcopy_reads': _frame(30), 'metrics': _frame(3)}, {}, ['DLP'], FakeES(), 'mondrian', bulk=indexer)
+
+    assert len(loaded['hmmcopy_reads']) == 10
+    assert len(loaded['metrics']) == 3
+    assert server.docs == {'1001_bins': 20}
+    assert server.requests == 5
+
+
+def test_failed_bulk_request_raises():
+    """
+    Arrange: Make the fake Elasticsearch server fail the first request.
+    Act: Bulk load a DataFrame.
+    Assert: A BulkError is raised.
+    """
+    with FakeESServer() as server:
+        server.fail = 1
+        with pytest.raises(bulk.BulkError):
+            bulk.BulkIndexer('127.0.0.1', server.port).load_df(_frame(10), '1001_bins')
+
+
+def test_index_analysis_indexes_read_tiers(monkeypatch):
+    """
+    Arrange: Split synthetic reads into chunks as streamed tables are.
+    Act: Index the analysis with a bulk indexer that builds read tiers.
+    Assert: Each tier is indexed into its own index, with the rows of the tier of the whole table.
+    """
+    from alhena_igo import tiers
+    from fakes import make_reads
+
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', lambda *args: None)
+    monkeypatch.setattr(loader.alhena_igo.isabl, 'ii', FakeIsabl(3))
+    reads = make_reads(4, 200, seed=1)
+    expected = tiers.downsample_reads(reads, assembly='GRCh37')
+    data = {'hmmcopy_reads': iter([reads.iloc[:300], reads.iloc[300:600], reads.iloc[600:]])}
+
+    with FakeESServer() as server:
+        server.create_index('1001_bins_1mb')
+        server.docs['1001_bins_1mb'] = 7
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, read_tiers=list(tiers.READ_TIERS))
+        loader.index_analysis('1001', data, {}, ['DLP'], FakeES(), 'mondrian_nf', bulk=indexer)
+
+    for tier, df in expected.items():
+        assert server.docs[tiers.tier_index('1001', tier)] == len(df)
+
+
+def test_reload_drops_stale_derived_indices(monkeypatch):
+    """
+    Arrange: Give an analysis tier and cell summary indices from an earlier load.
+    Act: Reload it with clean, without read tiers or cell summary, with and without a bulk indexer.
+    Assert: The derived indices of the earlier load are deleted.
+    """
+    from alhena_igo import tiers
+    from alhena_igo.cell_summary import cell_summary_index
+
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', lambda *args: None)
+    monkeypatch.setattr(loader.alhenaloader, 'clean_analysis', lambda analysis_id, es: None)
+    data = {'hmmcopy_reads': _frame(10)}
+
+    with FakeESServer() as server:
+        for tier in tiers.READ_TIERS:
+            server.create_index(tiers.tier_index('1001', tier))
+        server.create_index(cell_summary_index('1001'))
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port)
+        loader.index_parsed('1001', data, {}, ['DLP'], FakeES(), 'mondrian', clean=True, bulk=indexer)
+
+    assert server.settings == {}
+
+    es = FakeES()
+    es.docs = {tiers.tier_index('1001', tier): 10 for tier in tiers.READ_TIERS}
+    es.docs[cell_summary_index('1001')] = 10
+    loader.index_parsed('1001', data, {}, ['DLP'], es, 'mondrian', clean=True)
+
+    assert es.docs == {}
+
+
+def test_index_analysis_indexes_cell_summary(monkeypatch):
+    """
+    Arrange: Give the align and hmmcopy metrics of an analysis.
+    Act: Index the analysis with a bulk indexer that builds the cell summary.
+    Assert: One summary record per cell is indexed into the cells index.
+    """
+    from alhena_igo.cell_summary import cell_summary_index
+
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', lambda *args: None)
+    cells = [f'cell{i}' for i in range(5)]
+    data = {
+        'hmmcopy_metrics': pd.DataFrame({'cell_id': cells, 'quality': [0.1, 0.5, 0.8, 0.9, 1.0]}),
+        'align_metrics': pd.DataFrame({'cell_id': cells, 'total_mapped_reads': [10, 100, 1000, 10000, 100000]}),
+    }
+
+    with FakeESServer() as server:
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port, cell_summary=True)
+        loader.index_analysis('1001', data, {}, ['DLP'], FakeES(), 'mondrian', bulk=indexer)
+
+    assert server.docs == {cell_summary_index('1001'): 5}
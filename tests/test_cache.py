@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_cache
+
+Tests for the local Isabl lookup cache.
+"""
+import pytest
+
+import alhena_igo.cache as cache
+
+
+@pytest.fixture
+def lookup(tmp_path):
+    calls = []
+
+    @cache.cached('lookup', final=lambda record: record['status'] == 'SUCCEEDED')
+    def lookup(pk, status='SUCCEEDED'):
+        calls.append(pk)
+        return {'pk': pk, 'status': status}
+
+    yield lookup, calls
+    cache.disable()
+
+
+def test_cached_lookup_hits_on_repeat(tmp_path, lookup):
+    """
+    Arrange: Configure a cache.
+    Act: Look up the same analysis twice.
+    Assert: Isabl is only queried once.
+    """
+    lookup, calls = lookup
+    cache.configure(str(tmp_path))
+
+    assert lookup('1') == lookup('1')
+    assert calls == ['1']
+
+
+def test_refresh_requeries(tmp_path, lookup):
+    lookup, calls = lookup
+    cache.configure(str(tmp_path))
+    lookup('1')
+
+    cache.configure(str(tmp_path), refresh=True)
+    lookup('1')
+
+    assert calls == ['1', '1']
+
+
+def test_refresh_reuses_lookups_of_the_same_run(tmp_path, lookup):
+    """
+    Arrange: Cache a lookup, then refresh the cache and share its settings with a second process' cache.
+    Act: Look up the analysis in the refreshed cache, then again with the shared settings.
+    Assert: Isabl is queried once after the refresh, and the shared cache reuses that lookup.
+    """
+    lookup, calls = lookup
+    cache.configure(str(tmp_path))
+    lookup('1')
+
+    refreshed = cache.configure(str(tmp_path), refresh=True)
+    lookup('1')
+    cache_dir, ttl, refresh, refreshed_at = refreshed.settings
+    cache.configure(cache_dir, ttl=ttl, refresh=refresh, refreshed_at=refreshed_at)
+    lookup('1')
+
+    assert calls == ['1', '1']
+
+
+def test_only_unfinished_records_expire(tmp_path, lookup):
+    """
+    Arrange: Configure a cache whose entries expire immediately.
+    Act: Repeat lookups of a SUCCEEDED and a RUNNING analysis.
+    Assert: Only the RUNNING analysis is queried again.
+    """
+    lookup, calls = lookup
+    cache.configure(str(tmp_path), ttl=-1)
+
+    lookup('1')
+    lookup('2', status='RUNNING')
+    lookup('1')
+    lookup('2', status='RUNNING')
+
+    assert calls == ['1', '2', '2']
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_cell_summary
+
+Tests for the per-cell QC summary.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from alhena_igo import cell_summary
+
+
+def test_summary_joins_metrics_and_flags_cells():
+    """
+    Arrange: Give align and hmmcopy metrics of overlapping cells, in different orders and categories.
+    Act: Build the cell summary.
+    Assert: There is one record per cell except the reference, with flags and buckets.
+    """
+    hmmcopy = pd.DataFrame({
+        'cell_id': pd.Categorical(['c1', 'c2', 'c3', 'reference']),
+        'quality': [0.9, 0.5, 0.8, 0.9],
+        'experimental_condition': ['A', 'A', 'NTC', 'A'],
+        'total_reads': [1000, 1000, 1000, 1000],
+    })
+    align = pd.DataFrame({
+        'cell_id': pd.Categorical(['c4', 'c3', 'c1']),
+        'total_reads': [5, 5, 5],
+        'total_mapped_reads': [150000, 0, 99],
+        'is_contaminated': [False, False, True],
+    })
+
+    summary = cell_summary.build_cell_summary(align, hmmcopy, min_quality=0.75).set_index('cell_id')
+
+    assert sorted(summary.index) == ['c1', 'c2', 'c3', 'c4']
+    assert summary.loc['c1', 'total_reads'] == 1000
+    assert summary['passes_quality'].to_dict() == {'c1': True, 'c2': False, 'c3': True, 'c4': False}
+    assert summary['is_control'].to_dict() == {'c1': False, 'c2': False, 'c3': True, 'c4': False}
+    assert summary['passes_filters'].sum() == 0
+    assert summary.loc['c1', 'is_contaminated'] and not summary.loc['c2', 'is_contaminated']
+    assert np.allclose(summary.loc[['c1', 'c2', 'c3'], 'quality_bucket'], [0.9, 0.5, 0.8])
+    assert np.isnan(summary.loc['c4', 'quality_bucket'])
+    assert np.isclose(summary.loc['c4', 'total_mapped_reads_bucket'], 10 ** 5.1, rtol=1e-6)
+    assert np.isnan(summary.loc['c3', 'total_mapped_reads_bucket'])
+
+
+def test_bucket_edges():
+    """
+    Arrange/Act: Bucket values on linear and log scales.
+    Assert: Each value maps to the lower edge of its bucket.
+    """
+    assert cell_summary.bucket([0.0, 0.049, 0.05, 0.99], 'linear', 0.05).tolist() == pytest.approx([0.0, 0.0, 0.05, 0.95])
+    assert cell_summary.bucket([15, 100, 1e6], 'log10', 1.0).tolist() == pytest.approx([10, 100, 1e6])
+    assert np.isnan(cell_summary.bucket([0, -1], 'log10', 0.1)).all()
+
+
+def test_string_flags_are_read_as_bools():
+    """
+    Arrange: Give metrics whose boolean flags were parsed as the strings 'True' and 'False'.
+    Act: Build the cell summary.
+    Assert: The flags are bools with the values of the strings, and contaminated cells fail the filters.
+    """
+    hmmcopy = pd.DataFrame({
+        'cell_id': pd.Categorical(['c1', 'c2', 'c3']),
+        'quality': [0.9, 0.9, 0.9],
+        'is_s_phase': pd.Categorical(['True', 'False', 'true']),
+    })
+    align = pd.DataFrame({
+        'cell_id': pd.Categorical(['c1', 'c2', 'c3']),
+        'is_contaminated': ['False', 'True', 'False'],
+    })
+
+    summary = cell_summary.build_cell_summary(align, hmmcopy).set_index('cell_id')
+
+    assert summary['is_s_phase'].dtype == bool and summary['is_contaminated'].dtype == bool
+    assert summary['is_s_phase'].to_dict() == {'c1': True, 'c2': False, 'c3': True}
+    assert summary['passes_filters'].to_dict() == {'c1': True, 'c2': False, 'c3': True}
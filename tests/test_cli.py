@@ -54,3 +54,172 @@ def test_hello_displays_expected_message():
     assert 'alhena_igo' in result.output.strip(), \
         "'Hello' messages should contain the CLI name."
     # fmt: on
+
+
+def test_profile_writes_json_report(tmp_path, monkeypatch):
+    """
+    Arrange/Act: Run the `clean` subcommand with `--profile`.
+    Assert: A JSON report with a timed clean stage is written.
+    """
+    import json
+
+    import alhenaloader
+    from fakes import FakeES
+
+    monkeypatch.setattr(alhenaloader, 'ES', lambda host, port: FakeES(), raising=False)
+    monkeypatch.setattr(alhenaloader, 'clean_analysis', lambda analysis, es: None)
+    report_path = tmp_path / 'profile.json'
+
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, ["--no-cache", "--profile", str(report_path), "clean", "--analysis", "1"])
+
+    assert result.exit_code == 0, result.output
+    report = json.loads(report_path.read_text())
+    assert report['command'] == 'clean'
+    assert report['totals']['clean']['count'] == 1
+    assert report['stages'][0]['analysis'] == '1'
+    assert report['peak_rss_mb'] > 0
+
+
+def test_load_merged_indexes_one_dashboard(tmp_path, monkeypatch):
+    """
+    Arrange: Route Isabl and Elasticsearch to fakes serving two libraries.
+    Act: Run the `load-merged` subcommand for both analyses.
+    Assert: One dashboard holds the bins of both libraries.
+    """
+    from fakes import FakeES, FakeIsabl, install, write_qc_results
+
+    results = {i: write_qc_results(str(tmp_path / str(i)), n_cells=4, n_bins=10, seed=i, library_id=f'A9055{i}A') for i in (1, 2)}
+    es = FakeES()
+    install(monkeypatch, FakeIsabl(3, results=results, framework='mondrian_nf'), es)
+
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, [
+        "--no-cache", "load-merged", "--analysis_id", "1001", "--analysis_id", "1002",
+        "--framework", "mondrian_nf", "--version", "v1",
+    ])
+
+    assert result.exit_code == 0, result.output
+    assert es.docs['1001_1002_bins'] == 80
+    assert es.analyses['1001_1002']['merged_analyses'] == '1001,1002'
+    assert es.projects['DLP'] == {'1001_1002'}
+
+
+def test_clean_isabl_project(monkeypatch):
+    """
+    Arrange: Load an Isabl project's analyses into fake Alhena and Elasticsearch servers.
+    Act: Run the `clean` subcommand for the Isabl project.
+    Assert: Every analysis' record and indices are removed.
+    """
+    from fakes import FakeES, FakeESServer, FakeIsabl, install
+
+    isabl = FakeIsabl(6)
+    es = FakeES()
+    install(monkeypatch, isabl, es)
+    pks = [str(analysis.pk) for analysis in isabl.analyses]
+    for pk in pks:
+        es.load_record({'dashboard_id': pk}, pk, es.ANALYSIS_ENTRY_INDEX)
+
+    with FakeESServer() as server:
+        for pk in pks:
+            server.create_index(f'{pk}_bins')
+        runner: CliRunner = CliRunner()
+        result: Result = runner.invoke(cli.cli, [
+            "--no-cache", "--host", "127.0.0.1", "--port", str(server.port),
+            "clean", "--isabl", "1", "--framework", "mondrian", "--version", "v1",
+        ])
+
+    assert result.exit_code == 0, result.output
+    assert f'{len(pks)} cleaned, 0 not in Alhena, 0 failed' in result.output
+    assert es.analyses == {}
+    assert server.settings == {}
+
+
+def test_clean_alhena_project_reads_members_from_alhena(monkeypatch):
+    """
+    Arrange: Load two analyses into an Alhena project and a third, merged from them, into another.
+    Act: Run the `clean` subcommand for the first Alhena project.
+    Assert: The project's analyses and their indices are removed, and the merged analysis is kept.
+    """
+    from fakes import FakeES, FakeESServer, FakeIsabl, install
+
+    es = FakeES()
+    install(monkeypatch, FakeIsabl(1), es)
+    for analysis_id, project in (('1', 'SPECTRUM'), ('2', 'SPECTRUM'), ('1_2', 'DLP')):
+        es.load_record({'dashboard_id': analysis_id}, analysis_id, es.ANALYSIS_ENTRY_INDEX)
+        es.add_analysis_to_projects(analysis_id, [project])
+
+    with FakeESServer() as server:
+        for index in ('1_qc', '2_qc', '1_2_qc'):
+            server.create_index(index)
+        runner: CliRunner = CliRunner()
+        result: Result = runner.invoke(cli.cli, [
+            "--no-cache", "--host", "127.0.0.1", "--port", str(server.port),
+            "clean", "--alhena", "SPECTRUM",
+        ])
+
+    assert result.exit_code == 0, result.output
+    assert '2 cleaned, 0 not in Alhena, 0 failed' in result.output
+    assert list(es.analyses) == ['1_2']
+    assert list(server.settings) == ['1_2_qc']
+
+
+#: modules the light commands must not import
+HEAVY_MODULES = ['alhenaloader', 'scgenome', 'isabl_cli', 'pandas', 'numpy', 'csverve']
+
+#: cumulative microseconds `python -X importtime` may report for importing the CLI
+CLI_IMPORT_BUDGET_US = 500000
+
+
+def test_light_commands_skip_heavy_imports():
+    """
+    Arrange/Act: Import the CLI with `-X importtime` in a fresh interpreter, and run `version` and `--help`.
+    Assert: No heavy dependency is imported, and the import is within its time budget.
+    """
+    import subprocess
+    import sys
+
+    script = (
+        "import sys\n"
+        "from alhena_igo.cli import cli\n"
+        "for args in (['version'], ['--help'], ['load', '--help']):\n"
+        "    cli(args, standalone_mode=False)\n"
+        f"print(sorted(name for name in {HEAVY_MODULES!r} if name in sys.modules))\n"
+    )
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True, text=True, check=True)
+
+    assert process.stdout.strip().splitlines()[-1] == '[]'
+    imports = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports[name.strip()] = int(cumulative)
+    assert not set(HEAVY_MODULES) & set(imports)
+    assert imports['alhena_igo.cli'] < CLI_IMPORT_BUDGET_US, imports['alhena_igo.cli']
+
+
+def test_load_passes_bulk_options_to_indexer(tmp_path, monkeypatch):
+    """
+    Arrange: Route Isabl and Elasticsearch to fakes serving one library, and record the indexer the load is given.
+    Act: Run the `load` subcommand with the shared bulk options.
+    Assert: The bulk indexer is built from every one of them.
+    """
+    from alhena_igo import loader
+    from fakes import FakeES, FakeIsabl, install, write_qc_results
+
+    results = {1: write_qc_results(str(tmp_path), n_cells=4, n_bins=10, seed=1)}
+    install(monkeypatch, FakeIsabl(3, results=results, framework='mondrian_nf'), FakeES())
+    indexers = []
+    monkeypatch.setattr(loader, 'index_analysis', lambda *args, bulk=None, **kwargs: indexers.append(bulk))
+
+    runner: CliRunner = CliRunner()
+    result: Result = runner.invoke(cli.cli, [
+        "--no-cache", "load", "--analysis_id", "1001", "--framework", "mondrian_nf", "--version", "v1",
+        "--bulk-chunk-size", "100", "--bulk-workers", "2", "--refresh-interval", "-1", "--replicas", "0",
+        "--read-tier", "1mb", "--cell-summary",
+    ])
+
+    assert result.exit_code == 0, result.output
+    [indexer] = indexers
+    assert (indexer.chunk_size, indexer.workers, indexer.refresh_interval, indexer.replicas) == (100, 2, '-1', 0)
+    assert indexer.read_tiers == ['1mb'] and indexer.cell_summary
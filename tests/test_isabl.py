@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_isabl
+
+Tests for Isabl discovery, run against an in-memory stand-in for isabl_cli.
+"""
+import math
+from types import SimpleNamespace
+
+import pytest
+
+import alhena_igo.isabl
+from fakes import FakeIsabl
+
+
+@pytest.mark.parametrize('n_experiments', [10, 500])
+def test_get_ids_from_isabl_batched_matches_per_experiment(monkeypatch, n_experiments):
+    """
+    Arrange: Fake an Isabl project with many experiments.
+    Act: Discover analyses per experiment and batched.
+    Assert: Both return the same records and batching needs far fewer round trips.
+    """
+    fake = FakeIsabl(n_experiments)
+    monkeypatch.setattr(alhena_igo.isabl, 'ii', fake)
+
+    per_experiment = alhena_igo.isabl.get_ids_from_isabl('1', 'mondrian', 'v1', batched=False)
+    per_experiment_round_trips = fake.round_trips
+
+    fake.round_trips = 0
+    batched = alhena_igo.isabl.get_ids_from_isabl('1', 'mondrian', 'v1')
+    batched_round_trips = fake.round_trips
+
+    assert batched == per_experiment
+    assert len(batched) == len(fake.analyses)
+    assert per_experiment_round_trips > n_experiments
+    assert batched_round_trips <= 2 * math.ceil(n_experiments / FakeIsabl.PAGE_SIZE)
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_get_ids_from_isabl_skips_other_analyses(monkeypatch, batched):
+    """
+    Arrange: Fake an Isabl project with one RUNNING analysis, one of another version and one of another project.
+    Act: Discover the project's analyses.
+    Assert: Only the other SUCCEEDED analyses of the version in the project are returned.
+    """
+    fake = FakeIsabl(12)
+    monkeypatch.setattr(alhena_igo.isabl, 'ii', fake)
+    running, other_version, other_project = fake.analyses[:3]
+    running.status = 'RUNNING'
+    other_version.application.version = 'v2'
+    other_project.targets[0].projects = [SimpleNamespace(pk=2)]
+
+    records = alhena_igo.isabl.get_ids_from_isabl('1', 'mondrian', 'v1', batched=batched)
+
+    assert [record['dashboard_id'] for record in records] == [str(analysis.pk) for analysis in fake.analyses[3:]]
+
+
+def test_lookups_of_succeeded_analyses_do_not_expire(monkeypatch, tmp_path):
+    """
+    Arrange: Configure an Isabl cache whose entries expire immediately, and mark one analysis RUNNING.
+    Act: Look up directories and metadata of a SUCCEEDED and the RUNNING analysis, then again with Isabl unavailable.
+    Assert: The SUCCEEDED analysis' lookups are still cached, and the RUNNING analysis' lookups are not.
+    """
+    import alhenaloader
+
+    import alhena_igo.cache as cache
+    from fakes import fake_process_analysis_entry
+
+    fake = FakeIsabl(3)
+    monkeypatch.setattr(alhena_igo.isabl, 'ii', fake)
+    monkeypatch.setattr(alhenaloader, 'process_analysis_entry', fake_process_analysis_entry, raising=False)
+    succeeded, running = [str(analysis.pk) for analysis in fake.analyses]
+    fake.analyses[1].status = 'RUNNING'
+
+    cache.configure(str(tmp_path), ttl=-1)
+    try:
+        directories = alhena_igo.isabl.get_directories(succeeded, 'mondrian', 'v1')
+        metadata = alhena_igo.isabl.get_metadata(succeeded)
+        alhena_igo.isabl.get_directories(running, 'mondrian', 'v1')
+        alhena_igo.isabl.get_metadata(running)
+
+        monkeypatch.setattr(alhena_igo.isabl, 'ii', None)
+        assert alhena_igo.isabl.get_directories(succeeded, 'mondrian', 'v1') == directories
+        assert alhena_igo.isabl.get_metadata(succeeded) == metadata
+        with pytest.raises(AttributeError):
+            alhena_igo.isabl.get_directories(running, 'mondrian', 'v1')
+        with pytest.raises(AttributeError):
+            alhena_igo.isabl.get_metadata(running)
+    finally:
+        cache.disable()
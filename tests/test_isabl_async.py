@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_isabl_async
+
+Tests for the asynchronous Isabl client against a local fake Isabl server.
+"""
+import asyncio
+
+import pytest
+
+import alhena_igo.cache as cache
+import alhena_igo.isabl
+import alhena_igo.isabl_async as isabl_async
+from fakes import FakeES, FakeIsabl, FakeIsablServer, install
+
+
+@pytest.fixture
+def isabl(monkeypatch):
+    isabl = FakeIsabl(30)
+    install(monkeypatch, isabl, FakeES())
+    return isabl
+
+
+def test_resolve_matches_synchronous_lookups(isabl):
+    """
+    Arrange: Serve a project of analyses from a fake Isabl server.
+    Act: Resolve directories and metadata of every analysis with a concurrency cap of 4.
+    Assert: The results match the synchronous lookups, with several but at most 4 requests in flight.
+    """
+    pks = [str(analysis.pk) for analysis in isabl.analyses]
+
+    with FakeIsablServer(isabl) as server:
+        results = isabl_async.resolve(pks, 'mondrian', 'v1', api_url=server.url, token='', concurrency=4)
+
+    for pk in pks:
+        assert results[pk]['directories'] == alhena_igo.isabl.get_directories(pk, 'mondrian', 'v1')
+        assert results[pk]['metadata'] == alhena_igo.isabl.get_metadata(pk)
+    assert 1 < server.max_in_flight <= 4
+
+
+def test_retries_unavailable_server(isabl):
+    """
+    Arrange: Make the fake Isabl server answer the first three requests with a 503.
+    Act: Fetch an analysis.
+    Assert: The request is retried until it succeeds.
+    """
+    async def fetch(url):
+        async with isabl_async.AsyncIsablClient(api_url=url, token='', backoff=0.01) as client:
+            return await client.get_instance('analyses', 1001), client.requests
+
+    with FakeIsablServer(isabl, fail=3) as server:
+        analysis, requests = asyncio.run(fetch(server.url))
+
+    assert analysis['targets'][0]['library_id'] == 'A90551A'
+    assert requests == server.requests == 4
+
+
+def test_gives_up_after_retries(isabl):
+    """
+    Arrange: Make the fake Isabl server keep failing.
+    Act: Fetch an analysis with two retries.
+    Assert: An IsablRequestError is raised after three attempts.
+    """
+    async def fetch(url):
+        async with isabl_async.AsyncIsablClient(api_url=url, token='', retries=2, backoff=0.01) as client:
+            return await client.get_instance('analyses', 1001)
+
+    with FakeIsablServer(isabl, fail=10) as server:
+        with pytest.raises(isabl_async.IsablRequestError):
+            asyncio.run(fetch(server.url))
+
+    assert server.requests == 3
+
+
+@pytest.mark.parametrize('batched', [True, False])
+def test_discovery_matches_synchronous(isabl, batched):
+    """
+    Arrange: Serve a project with more experiments than fit on one page.
+    Act: Discover the project's analyses asynchronously.
+    Assert: The dashboard records match the synchronous discovery.
+    """
+    async def discover(url):
+        async with isabl_async.AsyncIsablClient(api_url=url, token='') as client:
+            return await isabl_async.get_ids_from_isabl(client, 1, 'mondrian', 'v1', batched=batched)
+
+    with FakeIsablServer(isabl, page_size=7) as server:
+        records = asyncio.run(discover(server.url))
+
+    assert records == alhena_igo.isabl.get_ids_from_isabl(1, 'mondrian', 'v1', batched=batched)
+
+
+def test_prefetch_fills_cache(isabl, tmp_path, monkeypatch):
+    """
+    Arrange: Configure the Isabl cache and prefetch lookups of every analysis.
+    Act: Look the analyses up synchronously with isabl_cli unavailable.
+    Assert: Every lookup is a cache hit.
+    """
+    pks = [str(analysis.pk) for analysis in isabl.analyses]
+    expected = {pk: alhena_igo.isabl.get_directories(pk, 'mondrian', 'v1') for pk in pks}
+    cache.configure(str(tmp_path))
+    try:
+        with FakeIsablServer(isabl) as server:
+            assert isabl_async.prefetch(pks, 'mondrian', 'v1', api_url=server.url, token='') == len(pks)
+            assert isabl_async.prefetch(pks, 'mondrian', 'v1', api_url=server.url, token='') == 0
+
+        monkeypatch.setattr(alhena_igo.isabl, 'ii', None)
+        for pk in pks:
+            assert alhena_igo.isabl.get_directories(pk, 'mondrian', 'v1') == expected[pk]
+            assert alhena_igo.isabl.get_metadata(pk)['dashboard_id'] == pk
+    finally:
+        cache.disable()
+
+
+def test_certificates_are_verified_unless_opted_out(monkeypatch):
+    """
+    Arrange: Make clients of an HTTPS Isabl API with and without ``ISABL_VERIFY_SSL=0``.
+    Act: Read the SSL context of their connection pools.
+    Assert: Certificates are verified by default, and not with the opt-out or ``verify=False``.
+    """
+    import ssl
+
+    url = 'https://isabl.example.org/api/v1/'
+    monkeypatch.delenv('ISABL_VERIFY_SSL', raising=False)
+    assert isabl_async.AsyncIsablClient(api_url=url, token='')._pool._context.verify_mode == ssl.CERT_REQUIRED
+    assert isabl_async.AsyncIsablClient(api_url=url, token='', verify=False)._pool._context.verify_mode == ssl.CERT_NONE
+
+    monkeypatch.setenv('ISABL_VERIFY_SSL', '0')
+    assert isabl_async.AsyncIsablClient(api_url=url, token='')._pool._context.verify_mode == ssl.CERT_NONE
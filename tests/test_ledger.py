@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_ledger
+
+Tests for the local load ledger.
+"""
+import os
+
+import pytest
+
+from alhena_igo import ledger as load_ledger
+
+
+@pytest.fixture
+def sources(tmp_path):
+    results = tmp_path / 'results'
+    results.mkdir()
+    (results / 'metrics.csv.gz').write_text('a')
+    return [str(results)]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return load_ledger.LoadLedger(str(tmp_path / 'ledger.sqlite'))
+
+
+def test_plan_new_and_preexisting_analyses(ledger, sources):
+    fingerprint = load_ledger.fingerprint(sources)
+
+    assert ledger.plan('1', 'v1', fingerprint, {}, in_alhena=False) == load_ledger.LOAD
+    assert ledger.plan('1', 'v1', fingerprint, {}, in_alhena=True) == load_ledger.SKIP
+
+
+def test_plan_follows_load_status_and_inputs(ledger, sources):
+    """
+    Arrange: Record a load of an analysis.
+    Act: Plan it while partial, after it finished, and after its inputs changed.
+    Assert: It is resumed, then skipped, then reloaded.
+    """
+    fingerprint = load_ledger.fingerprint(sources)
+    ledger.start('1', 'mondrian', 'v1', fingerprint, {})
+    ledger.checkpoint('1').done('analysis')
+    ledger.fail('1', 'connection timed out')
+
+    assert ledger.plan('1', 'v1', fingerprint, {}, in_alhena=True) == load_ledger.RESUME
+    assert ledger.checkpoint('1').is_done('analysis')
+
+    ledger.finish('1')
+    assert ledger.plan('1', 'v1', fingerprint, {}, in_alhena=True) == load_ledger.SKIP
+    assert ledger.plan('1', 'v2', fingerprint, {}, in_alhena=True) == load_ledger.RELOAD
+    assert ledger.plan('1', 'v1', fingerprint, {'chunksize': 10}, in_alhena=True) == load_ledger.RELOAD
+
+    with open(os.path.join(sources[0], 'metrics.csv.gz'), 'a') as f:
+        f.write('more rows')
+    assert ledger.plan('1', 'v1', load_ledger.fingerprint(sources), {}, in_alhena=True) == load_ledger.RELOAD
+
+
+def test_restart_drops_completed_steps(ledger, sources):
+    fingerprint = load_ledger.fingerprint(sources)
+    ledger.start('1', 'mondrian', 'v1', fingerprint, {})
+    ledger.checkpoint('1').done('analysis')
+
+    ledger.start('1', 'mondrian', 'v1', fingerprint, {}, resume=True)
+    assert ledger.checkpoint('1').is_done('analysis')
+
+    ledger.start('1', 'mondrian', 'v1', fingerprint, {})
+    assert not ledger.checkpoint('1').is_done('analysis')
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_loader
+
+Tests for loading many analyses at once.
+"""
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import alhena_igo.loader as loader
+from alhena_igo.ledger import LoadLedger
+
+
+def test_load_analyses_continues_after_failure(monkeypatch):
+    """
+    Arrange: Make loading fail for one of three analyses.
+    Act: Load the analyses sequentially.
+    Assert: Every analysis is reported, and only the failing one has an error.
+    """
+    def fake_load_analysis(analysis_id, framework, version, projects, es, clean=False, ledger=None, resume=False, **parse_options):
+        if analysis_id == '2':
+            raise ValueError('bad analysis')
+
+    monkeypatch.setattr(loader, 'load_analysis', fake_load_analysis)
+
+    results = dict(loader.load_analyses(['1', '2', '3'], 'mondrian', 'v1', ['DLP'], 'localhost', 9200, es=object()))
+
+    assert set(results) == {'1', '2', '3'}
+    assert results['1'] is None and results['3'] is None
+    assert isinstance(results['2'], ValueError)
+
+
+def test_index_analysis_streams_chunked_tables(monkeypatch):
+    """
+    Arrange: Give hmmcopy_reads as an iterator of three chunks.
+    Act: Index the analysis.
+    Assert: alhenaloader gets the first chunk, the rest are appended to the bins index.
+    """
+    loaded = {}
+    monkeypatch.setattr(
+        loader.alhenaloader, 'load_analysis',
+        lambda analysis_id, data, metadata, projects, es, framework: loaded.update(data),
+    )
+
+    class FakeES(object):
+        def __init__(self):
+            self.appended = []
+
+        def load_df(self, df, index_name):
+            self.appended.append((index_name, len(df)))
+
+    chunks = [pd.DataFrame({'cell_id': ['a'] * n}) for n in (3, 2, 1)]
+    es = FakeES()
+    loader.index_analysis('ABC', {'hmmcopy_reads': iter(chunks), 'hmmcopy_segs': pd.DataFrame()}, {}, ['DLP'], es, 'mondrian_nf')
+
+    assert len(loaded['hmmcopy_reads']) == 3
+    assert es.appended == [('abc_bins', 2), ('abc_bins', 1)]
+
+
+def test_index_analysis_loads_empty_stream_as_empty_table(monkeypatch):
+    """
+    Arrange: Give hmmcopy_reads as an iterator without chunks.
+    Act: Index the analysis.
+    Assert: alhenaloader gets an empty reads table with the reads columns.
+    """
+    loaded = {}
+    monkeypatch.setattr(
+        loader.alhenaloader, 'load_analysis',
+        lambda analysis_id, data, metadata, projects, es, framework: loaded.update(data),
+    )
+
+    loader.index_analysis('ABC', {'hmmcopy_reads': iter([])}, {}, ['DLP'], object(), 'mondrian_nf')
+
+    assert loaded['hmmcopy_reads'].empty
+    assert list(loaded['hmmcopy_reads'].columns) == loader.standard_hmmcopy_reads_cols
+    assert loaded['hmmcopy_reads']['cell_id'].dtype.name == 'category'
+
+
+def test_mondrian_nf_tables_parse_in_parallel(qc_files):
+    """
+    Arrange: Write synthetic cataloged MONDRIAN-QC results.
+    Act: Parse the QC tables sequentially and with a thread pool.
+    Assert: Both give the same tables.
+    """
+    sequential = loader.get_mondrian_nf_data(qc_files)
+    parallel = loader.get_mondrian_nf_data(qc_files, parse_workers=5)
+
+    assert list(parallel) == list(loader.MONDRIAN_NF_TABLES)
+    for table, data in sequential.items():
+        pd.testing.assert_frame_equal(parallel[table], data)
+
+
+def test_index_analysis_resumes_from_checkpoint(monkeypatch, tmp_path):
+    """
+    Arrange: Record that the analysis and the second reads chunk were loaded.
+    Act: Index the analysis again with the checkpoint.
+    Assert: Only the missing third chunk is loaded.
+    """
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', lambda *args: pytest.fail('analysis already loaded'))
+
+    ledger = LoadLedger(str(tmp_path / 'ledger.sqlite'))
+    checkpoint = ledger.checkpoint('ABC')
+    checkpoint.done('analysis')
+    checkpoint.done('hmmcopy_reads:1')
+
+    class FakeES(object):
+        def __init__(self):
+            self.appended = []
+
+        def load_df(self, df, index_name):
+            self.appended.append((index_name, len(df)))
+
+    chunks = [pd.DataFrame({'cell_id': ['a'] * n}) for n in (3, 2, 1)]
+    es = FakeES()
+    loader.index_analysis('ABC', {'hmmcopy_reads': iter(chunks)}, {}, ['DLP'], es, 'mondrian_nf', checkpoint=checkpoint)
+
+    assert es.appended == [('abc_bins', 1)]
+    assert checkpoint.is_done('hmmcopy_reads:2')
+
+
+@pytest.mark.parametrize('analysis_done', [False, True])
+def test_index_parsed_cleans_resume_before_analysis_step(monkeypatch, tmp_path, analysis_done):
+    """
+    Arrange: Record a partial load, with or without the analysis step done.
+    Act: Index it again with clean set.
+    Assert: It is cleaned only if alhenaloader had not finished loading it.
+    """
+    from fakes import FakeES
+
+    cleaned = []
+    monkeypatch.setattr(loader.alhenaloader, 'clean_analysis', lambda analysis_id, es: cleaned.append(analysis_id))
+    monkeypatch.setattr(loader, 'index_analysis', lambda *args, **kwargs: None)
+
+    ledger = LoadLedger(str(tmp_path / 'ledger.sqlite'))
+    ledger.start('ABC', 'mondrian_nf', 'v1', {}, {})
+    checkpoint = ledger.checkpoint('ABC')
+    if analysis_done:
+        checkpoint.done('analysis')
+
+    loader.index_parsed('ABC', {}, {}, ['DLP'], FakeES(), 'mondrian_nf', clean=True, ledger=ledger, checkpoint=checkpoint)
+
+    assert cleaned == ([] if analysis_done else ['ABC'])
+
+
+def test_plan_loads_skips_loaded_analyses_without_fingerprint(monkeypatch, tmp_path):
+    """
+    Arrange: Record a finished load and a partial load of two analyses in Alhena.
+    Act: Plan them, with and without verifying sources.
+    Assert: Only the partial load, or both when verifying, have their sources looked up.
+    """
+    ledger = LoadLedger(str(tmp_path / 'ledger.sqlite'))
+    for analysis_id in ('1', '2'):
+        ledger.start(analysis_id, 'mondrian_nf', 'v1', {}, {})
+    ledger.finish('1')
+
+    looked_up = []
+    monkeypatch.setattr(loader, 'get_sources', lambda analysis_id, framework, version: looked_up.append(analysis_id) or [])
+
+    plan = loader.plan_loads(['1', '2'], ['1', '2'], 'mondrian_nf', 'v1', ledger)
+    assert plan['skip'] == ['1'] and plan['resume'] == ['2']
+    assert looked_up == ['2']
+
+    loader.plan_loads(['1', '2'], ['1', '2'], 'mondrian_nf', 'v1', ledger, verify_sources=True)
+    assert looked_up == ['2', '1', '2']
+
+
+def test_resume_across_stream_layout_change_reloads(monkeypatch, tmp_path):
+    """
+    Arrange: Record a load with a bulk indexer that stopped after the first slice of the reads.
+    Act: Plan it again with and without the indexer, and with other slice sizes, then load the plan without the indexer.
+    Assert: Only the same layout resumes, and the reload indexes every row.
+    """
+    from fakes import FakeES, fake_clean_analysis, fake_load_analysis
+
+    reads = pd.DataFrame({'cell_id': ['a'] * 10})
+    monkeypatch.setattr(loader, 'BULK_HEAD_ROWS', 2)
+    monkeypatch.setattr(loader, 'BULK_SLICE_ROWS', 2)
+    monkeypatch.setattr(loader, 'get_sources', lambda analysis_id, framework, version: [])
+    monkeypatch.setattr(loader, 'get_qc_data', lambda analysis_id, framework, version, **options: {'hmmcopy_reads': reads})
+    monkeypatch.setattr(loader.alhena_igo.isabl, 'get_metadata', lambda analysis_id: {})
+    monkeypatch.setattr(loader.alhenaloader, 'load_analysis', fake_load_analysis)
+    monkeypatch.setattr(loader.alhenaloader, 'clean_analysis', fake_clean_analysis)
+
+    bulk = object()
+    ledger = LoadLedger(str(tmp_path / 'ledger.sqlite'))
+    _, _, checkpoint = loader.parse_analysis('1', 'mondrian_nf', 'v1', ledger=ledger, bulk=bulk)
+    checkpoint.done('analysis')
+    checkpoint.done('hmmcopy_reads:1')
+
+    assert loader.plan_loads(['1'], [], 'mondrian_nf', 'v1', ledger, bulk=bulk)['resume'] == ['1']
+    plan = loader.plan_loads(['1'], [], 'mondrian_nf', 'v1', ledger)
+    assert plan['reload'] == ['1']
+    monkeypatch.setattr(loader, 'BULK_SLICE_ROWS', 3)
+    assert loader.plan_loads(['1'], [], 'mondrian_nf', 'v1', ledger, bulk=bulk)['reload'] == ['1']
+
+    es = FakeES()
+    results = list(loader.load_analyses(plan['reload'], 'mondrian_nf', 'v1', ['DLP'], 'localhost', 9200, clean=True, es=es, ledger=ledger, resume=plan['resume']))
+
+    assert results == [('1', None)]
+    assert sum(es.docs.values()) == 10
+    assert ledger.is_loaded('1', 'v1', {})
+
+
+def test_merged_qc_data_shares_categories(tmp_path, monkeypatch):
+    """
+    Arrange: Write two synthetic libraries with different cells.
+    Act: Parse them as one merged analysis.
+    Assert: Tables hold the rows of both libraries and share one set of cell IDs.
+    """
+    from fakes import write_qc_results
+
+    results = {
+        '1': write_qc_results(str(tmp_path / 'a'), n_cells=4, n_bins=10, seed=1, library_id='A90551A'),
+        '2': write_qc_results(str(tmp_path / 'b'), n_cells=6, n_bins=10, seed=2, library_id='A90552A'),
+    }
+    monkeypatch.setattr(loader.alhena_igo.isabl, 'get_isabl_cataloged_qc_results', lambda pk, framework, version: results[pk])
+
+    merged = loader.get_merged_qc_data(['1', '2'], 'mondrian_nf', 'v1')
+
+    reads = list(merged['hmmcopy_reads'])
+    assert [len(df) for df in reads] == [40, 60]
+    assert len(merged['hmmcopy_metrics']) == 10
+    assert merged['hmmcopy_segs']['cell_id'].dtype.name == 'category'
+    categories = reads[0]['cell_id'].cat.categories
+    assert len(categories) == 10
+    assert reads[1]['cell_id'].cat.categories.equals(categories)
+    assert merged['hmmcopy_metrics']['cell_id'].cat.categories.equals(categories)
+
+
+def test_min_quality_filters_every_table(qc_files):
+    """
+    Arrange: Write synthetic cataloged MONDRIAN-QC results.
+    Act: Parse the QC tables keeping only cells above a quality threshold.
+    Assert: Every table holds exactly the passing cells.
+    """
+    from alhena_igo.utils import read_csverve
+
+    metrics = read_csverve(qc_files['metrics'])
+    passing = set(metrics.loc[(metrics['quality'] >= 0.5) & (metrics['cell_id'] != 'reference'), 'cell_id'])
+
+    data = loader.get_mondrian_nf_data(qc_files, min_quality=0.5)
+
+    for table, df in data.items():
+        assert set(df['cell_id'].astype(str)) == passing, table
+
+
+@pytest.fixture
+def slow_stages(monkeypatch):
+    """
+    Parse and index stages that each take 50 ms, tracking how many parsed analyses wait to be indexed
+    and the start and end time of each stage, keyed by stage and analysis.
+    """
+    held = {'now': 0, 'max': 0, 'times': {}}
+    lock = threading.Lock()
+
+    def parse_analysis(analysis_id, framework, version, ledger=None, resume=False, **parse_options):
+        start = time.perf_counter()
+        time.sleep(0.05)
+        if analysis_id == 'bad':
+            raise ValueError('bad analysis')
+        with lock:
+            held['now'] += 1
+            held['max'] = max(held['max'], held['now'])
+            held['times']['parse', analysis_id] = (start, time.perf_counter())
+        return {}, {}, None
+
+    def index_parsed(analysis_id, data, metadata, projects, es, framework, clean=False, ledger=None, checkpoint=None, bulk=None):
+        start = time.perf_counter()
+        time.sleep(0.05)
+        with lock:
+            held['now'] -= 1
+            held['times']['index', analysis_id] = (start, time.perf_counter())
+
+    monkeypatch.setattr(loader, 'parse_analysis', parse_analysis)
+    monkeypatch.setattr(loader, 'index_parsed', index_parsed)
+    return held
+
+
+def test_pipelined_load_overlaps_parse_and_index(slow_stages):
+    """
+    Arrange: Make parsing and indexing each take 50 ms per analysis.
+    Act: Load ten analyses with a pipeline of depth 1.
+    Assert: Each analysis is indexed while the next one is parsed, holding at most 3 parsed analyses.
+    """
+    ids = [str(i) for i in range(10)]
+    results = list(loader.load_analyses(ids, 'mondrian', 'v1', ['DLP'], 'localhost', 9200, es=object(), pipeline_depth=1))
+
+    assert results == [(analysis_id, None) for analysis_id in ids]
+    times = slow_stages['times']
+    for current, following in zip(ids, ids[1:]):
+        index_start, index_end = times['index', current]
+        parse_start, parse_end = times['parse', following]
+        assert parse_start < index_end and index_start < parse_end, (current, following)
+    assert slow_stages['max'] <= 3
+
+
+def test_pipelined_load_reports_parse_failures(slow_stages):
+    """
+    Arrange: Make parsing fail for one of three analyses.
+    Act: Load them with a pipeline.
+    Assert: Every analysis is reported in order, and only the failing one has an error.
+    """
+    results = list(loader.load_pipelined(['1', 'bad', '3'], 'mondrian', 'v1', ['DLP'], object(), depth=2))
+
+    assert [analysis_id for analysis_id, _ in results] == ['1', 'bad', '3']
+    assert isinstance(results[1][1], ValueError)
+    assert results[0][1] is None and results[2][1] is None
+
+
+def test_clean_analyses_batches_and_skips_missing(monkeypatch):
+    """
+    Arrange: Load two analyses into Alhena, give a third indices but no record, leave a fourth out, and merge the first two.
+    Act: Clean the four analyses in batches of two.
+    Assert: The three known analyses are cleaned with one index lookup and one delete per batch, the fourth
+        is skipped, and the merged analysis is left alone.
+    """
+    from alhena_igo import bulk
+    from fakes import FakeES, FakeESServer, fake_clean_analysis
+
+    monkeypatch.setattr(loader.alhenaloader, 'clean_analysis', fake_clean_analysis)
+    es = FakeES()
+    for analysis_id in ('1', '2'):
+        es.load_record({'dashboard_id': analysis_id}, analysis_id, es.ANALYSIS_ENTRY_INDEX)
+        es.add_analysis_to_projects(analysis_id, ['DLP'])
+
+    with FakeESServer() as server:
+        for index in ('1_qc', '1_bins', '1_bins_arm', '3_bins', '30_bins', '1_2_qc'):
+            server.create_index(index)
+        indexer = bulk.BulkIndexer('127.0.0.1', server.port)
+        results = list(loader.clean_analyses(['1', '2', '3', '4'], es, bulk=indexer, workers=2, batch_size=2))
+
+    assert sorted(results) == [('1', None), ('2', None), ('3', None)]
+    assert sorted(server.settings) == ['1_2_qc', '30_bins']
+    assert server.requests == 4
+    assert es.analyses == {} and es.projects['DLP'] == set()
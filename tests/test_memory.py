@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_memory
+
+Tests for memory-budgeted loading.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from alhena_igo import loader, memory
+from conftest import make_metrics, make_reads
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(memory, 'MIN_CHUNK_ROWS', 10)
+
+
+def test_parse_size():
+    assert memory.parse_size('8G') == 8000000000
+    assert memory.parse_size('1.5gb') == 1500000000
+    assert memory.parse_size(512) == 512
+    assert memory.format_size(2500000) == '2.5 MB'
+    with pytest.raises(ValueError):
+        memory.parse_size('lots')
+
+
+def test_reads_stream_when_over_budget(qc_files):
+    """
+    Arrange: Write synthetic cataloged MONDRIAN-QC results.
+    Act: Parse them with a budget that fits the other tables but not the whole reads.
+    Assert: The reads come in chunks that add up to the whole table.
+    """
+    whole = loader.get_mondrian_nf_data(qc_files)
+    fixed = sum(memory.frame_bytes(df) for table, df in whole.items() if table not in ('hmmcopy_reads', 'align_metrics'))
+    reads_bytes = memory.frame_bytes(whole['hmmcopy_reads'])
+
+    data = loader.get_mondrian_nf_data(qc_files, max_memory=fixed * 2 + reads_bytes)
+
+    assert not isinstance(data['hmmcopy_reads'], pd.DataFrame)
+    chunks = list(data['hmmcopy_reads'])
+    assert len(chunks) > 1
+    streamed = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(streamed.astype(str), whole['hmmcopy_reads'].reset_index(drop=True).astype(str))
+
+
+def test_fail_early_when_tables_cannot_fit(qc_files, monkeypatch):
+    """
+    Arrange: Write synthetic cataloged MONDRIAN-QC results.
+    Act: Parse them with a budget smaller than the tables that cannot be streamed.
+    Assert: A MemoryBudgetError with the estimate is raised before any table is parsed.
+    """
+    def parse(*args, **kwargs):
+        raise AssertionError('parsed a table')
+
+    monkeypatch.setattr(loader.TableLoader, 'load', parse)
+
+    with pytest.raises(memory.MemoryBudgetError, match=r'needs an estimated .* over the memory budget of 1\.0 KB'):
+        loader.get_mondrian_nf_data(qc_files, max_memory=1000)
+
+
+def test_spill_parsed_reads():
+    """
+    Arrange: Parse reads and metrics whole, as scgenome does.
+    Act: Fit them to a budget that only holds the metrics and a few chunks of reads.
+    Assert: The reads are spilled to a temp file and read back in chunks, and the file is removed.
+    """
+    reads = make_reads(10, 100)
+    reads['cell_id'] = reads['cell_id'].astype('category')
+    metrics = make_metrics(10)
+    budget = memory.MemoryBudget(memory.frame_bytes(metrics) + memory.frame_bytes(reads))
+
+    data = loader._fit_memory_budget({'hmmcopy_reads': reads, 'hmmcopy_metrics': metrics}, budget)
+
+    spilled = data['hmmcopy_reads']
+    assert isinstance(spilled, memory.SpilledTable) and os.path.exists(spilled.path)
+    assert data['hmmcopy_metrics'] is metrics
+    chunks = list(spilled)
+    assert len(chunks) > 1
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), reads)
+    assert not os.path.exists(spilled.path)
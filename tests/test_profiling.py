@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_profiling
+
+Tests for stage-level profiling.
+"""
+import numpy as np
+import pytest
+
+from alhena_igo import profiling
+
+
+@pytest.fixture
+def profiler():
+    yield profiling.enable()
+    profiling.disable()
+
+
+@pytest.mark.skipif(profiling.rss_mb() is None, reason="needs /proc to read the resident set size")
+def test_stages_record_their_own_memory_growth(profiler):
+    """
+    Arrange: Allocate 200 MB in a first stage and nothing in a second.
+    Act: Build the profile report.
+    Assert: Only the first stage grew the resident set, and file and memory bytes are totalled apart.
+    """
+    with profiling.stage('table', table='reads') as record:
+        data = np.ones(25000000)
+        record['memory_bytes'] = data.nbytes
+    with profiling.stage('parse') as record:
+        record['file_bytes'] = 1000
+
+    report = profiler.report()
+    table, parse = report['stages']
+
+    assert table['rss_delta_mb'] > 150
+    assert abs(parse['rss_delta_mb']) < 50
+    assert report['totals']['table']['memory_bytes'] == 200000000 and report['totals']['table']['file_bytes'] == 0
+    assert report['totals']['parse']['file_bytes'] == 1000
+    assert report['peak_rss_mb'] >= table['rss_mb']
+    del data
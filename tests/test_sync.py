@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_sync
+
+Tests for planning a project-wide sync.
+"""
+import alhena_igo.isabl
+from alhena_igo import ledger as load_ledger
+from alhena_igo import sync
+
+
+class FakeES(object):
+    def __init__(self, analyses, projects=None):
+        self.analyses = analyses
+        self.projects = projects or {}
+
+    def get_analyses(self):
+        return [{'dashboard_id': analysis_id} for analysis_id in self.analyses]
+
+    def get_project_analyses(self, project):
+        return sorted(self.projects.get(project, ()))
+
+
+def test_plan_sync(monkeypatch, tmp_path):
+    """
+    Arrange: Sync analyses 1 and 2 into DLP, then drop 2 from the Isabl project and add 3. Give
+        DLP an analysis of another Isabl project, and take 1 out of DLP in Alhena.
+    Act: Plan a sync into DLP and SPECTRUM.
+    Assert: 3 is loaded, 2 is removed, memberships follow what is in Alhena, and the analysis
+        of the other Isabl project is left alone.
+    """
+    ledger = load_ledger.LoadLedger(str(tmp_path / 'ledger.sqlite'))
+    ledger.add_members('7', 'DLP', ['1', '2'])
+
+    monkeypatch.setattr(
+        alhena_igo.isabl, 'get_ids_from_isabl',
+        lambda project, framework, version: [{'dashboard_id': '1'}, {'dashboard_id': '3'}],
+    )
+
+    es = FakeES(['1', '2', '9'], projects={'DLP': {'2', '9'}})
+    plan = sync.plan_sync('7', ['DLP', 'SPECTRUM'], 'mondrian', 'v1', es, ledger)
+
+    assert plan.loads[load_ledger.SKIP] == ['1']
+    assert plan.to_load == ['3']
+    assert plan.remove == ['2']
+    assert plan.members_add == {'DLP': ['1', '3'], 'SPECTRUM': ['1', '3']}
+    assert plan.members_remove == {'DLP': ['2'], 'SPECTRUM': []}
+
+
+def test_run_sync_removes_with_clean_analyses(monkeypatch, tmp_path):
+    """
+    Arrange: Load an Isabl project's analyses 1 and 2, then plan a sync after 2 left the project.
+    Act: Run the sync.
+    Assert: 2 is cleaned through `loader.clean_analyses` and dropped from the ledger, and 1 stays in DLP.
+    """
+    from alhena_igo import loader
+    from fakes import FakeES as FullFakeES, FakeESServer, fake_clean_analysis
+
+    monkeypatch.setattr(loader.alhenaloader, 'clean_analysis', fake_clean_analysis)
+    cleaned = []
+    clean_analyses = loader.clean_analyses
+    monkeypatch.setattr(loader, 'clean_analyses', lambda analysis_ids, *args, **kwargs: cleaned.extend(analysis_ids) or clean_analyses(analysis_ids, *args, **kwargs))
+    monkeypatch.setattr(alhena_igo.isabl, 'get_ids_from_isabl', lambda project, framework, version: [{'dashboard_id': '1'}])
+
+    ledger = load_ledger.LoadLedger(str(tmp_path / 'ledger.sqlite'))
+    es = FullFakeES()
+    for analysis_id in ('1', '2'):
+        ledger.start(analysis_id, 'mondrian', 'v1', {}, {})
+        ledger.finish(analysis_id)
+        es.load_record({'dashboard_id': analysis_id}, analysis_id, es.ANALYSIS_ENTRY_INDEX)
+    es.add_analyses_to_project('DLP', ['1', '2'])
+    ledger.add_members('7', 'DLP', ['1', '2'])
+
+    plan = sync.plan_sync('7', ['DLP'], 'mondrian', 'v1', es, ledger)
+    with FakeESServer() as server:
+        server.create_index('2_bins')
+        assert list(sync.run_sync(plan, 'mondrian', 'v1', '127.0.0.1', server.port, es, ledger)) == []
+
+    assert server.settings == {}
+    assert cleaned == ['2']
+    assert list(es.analyses) == ['1']
+    assert es.projects['DLP'] == {'1'}
+    assert ledger.get('2') is None
+    assert ledger.get_members('7') == {'DLP': {'1'}}
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_table_cache
+
+Tests for the local cache of parsed QC tables.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import alhena_igo.table_cache as table_cache
+from alhena_igo import utils
+from alhena_igo.utils import _categorical_cols_hmmcopy, _dtypes_hmmcopy_reads
+
+
+@pytest.fixture
+def enabled_cache(tmp_path):
+    yield table_cache.configure(str(tmp_path / 'tables'))
+    table_cache.disable()
+
+
+def test_warm_read_skips_parsing(reads_file, enabled_cache, monkeypatch):
+    """
+    Arrange: Parse a reads file once with the cache enabled.
+    Act: Parse it again with CSV parsing disabled.
+    Assert: The cached table equals the parsed one, with the same dtypes.
+    """
+    cold = utils.process_data(reads_file, _categorical_cols_hmmcopy, dtype=_dtypes_hmmcopy_reads)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('parsed the CSV again')
+
+    monkeypatch.setattr(utils, 'read_csverve', fail)
+    warm = utils.process_data(reads_file, _categorical_cols_hmmcopy, dtype=_dtypes_hmmcopy_reads)
+
+    pd.testing.assert_frame_equal(warm, cold)
+
+
+def test_changed_source_or_dtypes_miss(reads_file, enabled_cache):
+    """
+    Arrange: Parse a reads file with the cache enabled.
+    Act: Touch the file, and separately parse it with other dtypes.
+    Assert: Each creates a new cache entry.
+    """
+    utils.read_table(reads_file, dtype=_dtypes_hmmcopy_reads)
+    utils.read_table(reads_file)
+    stat = os.stat(reads_file)
+    os.utime(reads_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    utils.read_table(reads_file, dtype=_dtypes_hmmcopy_reads)
+
+    assert len(os.listdir(enabled_cache.cache_dir)) == 3
+
+
+def test_evicts_least_recently_used(tmp_path):
+    """
+    Arrange: Bound the cache to about two tables.
+    Act: Store three tables, reading the first before storing the third.
+    Assert: The second, least recently used, table is evicted.
+    """
+    frames = {name: pd.DataFrame({'value': range(1000)}) for name in 'abc'}
+    cache = table_cache.TableCache(str(tmp_path))
+    cache.set('a', frames['a'])
+    cache.max_bytes = int(cache.size() * 2.5)
+
+    cache.set('b', frames['b'])
+    os.utime(cache._path('a'), (0, 0))
+    os.utime(cache._path('b'), (1, 1))
+    assert cache.get('a') is not None
+    cache.set('c', frames['c'])
+
+    assert cache.get('b') is None
+    pd.testing.assert_frame_equal(cache.get('a'), frames['a'])
+    pd.testing.assert_frame_equal(cache.get('c'), frames['c'])
+
+
+def test_tables_without_manifest_when_one_fails(enabled_cache):
+    """
+    Arrange: Store two tables under a key, then store them again with one that Arrow cannot convert.
+    Act: Read the tables of the key back.
+    Assert: The first store is read back, and after the failed store the key is a miss.
+    """
+    good = pd.DataFrame({'a': [1, 2]})
+    enabled_cache.set_tables('analysis', {'reads': good, 'segs': good})
+    assert set(enabled_cache.get_tables('analysis')) == {'reads', 'segs'}
+
+    enabled_cache.set_tables('analysis', {'reads': good, 'segs': pd.DataFrame({'a': [1, 'x']})})
+
+    assert enabled_cache.get_tables('analysis') is None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_tiers
+
+Tests for downsampled tiers of the hmmcopy reads.
+"""
+import pandas as pd
+import pytest
+
+from alhena_igo import tiers
+from fakes import make_reads
+
+
+def test_tiers_aggregate_bins():
+    """
+    Arrange: Give one cell four 500 kb bins on chromosome 1 around 1 Mb, and one on each arm of chromosome 2.
+    Act: Downsample the reads.
+    Assert: Copy is averaged, state is the rounded mean, reads are summed and bins are split by arm.
+    """
+    reads = pd.DataFrame({
+        'chr': pd.Categorical(['1', '1', '1', '1', '2', '2']),
+        'start': [1, 500001, 1000001, 1500001, 1, 100000001],
+        'end': [500000, 1000000, 1500000, 2000000, 500000, 100500000],
+        'cell_id': pd.Categorical(['c1'] * 6),
+        'gc': [0.4, 0.6, -1.0, 0.5, 0.5, 0.5],
+        'reads': [10, 20, 30, 40, 50, 60],
+        'copy': [1.0, 3.0, 2.0, float('nan'), 4.0, 5.0],
+        'state': [1, 4, 2, 2, 4, 5],
+    })
+
+    data = tiers.downsample_reads(reads, assembly='GRCh37')
+
+    mb = data['1mb']
+    assert mb[['chr', 'start', 'end', 'n_bins']].astype(str).values.tolist() == [
+        ['1', '1', '1000000', '2'], ['1', '1000001', '2000000', '2'], ['2', '1', '500000', '1'], ['2', '100000001', '100500000', '1'],
+    ]
+    assert mb['copy'].tolist() == [2.0, 2.0, 4.0, 5.0]
+    assert mb['state'].tolist() == [2, 2, 4, 5]
+    assert mb['reads'].tolist() == [30, 70, 50, 60]
+    assert mb['gc'].round(2).tolist() == [0.5, 0.5, 0.5, 0.5]
+
+    arm = data['arm']
+    assert arm[['chr', 'arm']].astype(str).values.tolist() == [['1', 'p'], ['2', 'p'], ['2', 'q']]
+    assert len(data['10mb']) == 3
+
+
+def test_chunked_tiers_match_whole_table():
+    """
+    Arrange: Make synthetic reads of several cells.
+    Act: Downsample them whole, and chunk by chunk with chunks splitting cells and coarse bins.
+    Assert: The tiers are the same, and the chunks are folded into one row of 4-byte sums per cell and coarse bin.
+    """
+    reads = make_reads(5, 300, seed=3)
+
+    whole = tiers.downsample_reads(reads, assembly='GRCh37')
+    read_tiers = tiers.ReadTiers(assembly='GRCh37')
+    for start in range(0, len(reads), 171):
+        read_tiers.add(reads.iloc[start:start + 171])
+    chunked = read_tiers.tables()
+
+    for total in read_tiers._totals.values():
+        assert total.index.is_unique
+        assert all(dtype.itemsize == 4 for dtype in total.dtypes)
+    for tier, data in whole.items():
+        pd.testing.assert_frame_equal(chunked[tier], data, check_categorical=False)
+
+
+def test_arms_follow_the_assembly():
+    """
+    Arrange: Give a bin of chromosome 3 between the midpoints of its GRCh38 and GRCh37 centromeres.
+    Act: Build the arm tier for either assembly, and for an assembly without centromeres.
+    Assert: The bin is on the q arm in GRCh38 and the p arm in GRCh37, and the unknown assembly is refused.
+    """
+    reads = pd.DataFrame({
+        'chr': pd.Categorical(['3']), 'start': [91200001], 'end': [91700000], 'cell_id': pd.Categorical(['c1']),
+        'gc': [0.5], 'reads': [10], 'copy': [2.0], 'state': [2],
+    })
+
+    assert tiers.downsample_reads(reads, ['arm'], assembly='GRCh37')['arm']['arm'].tolist() == ['p']
+    assert tiers.downsample_reads(reads, ['arm'], assembly='GRCh38')['arm']['arm'].tolist() == ['q']
+    with pytest.raises(ValueError, match='GRCm38'):
+        tiers.ReadTiers(['arm'], assembly='GRCm38')
+    assert len(tiers.downsample_reads(reads, ['1mb'], assembly='GRCm38')['1mb']) == 1
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_utils
+
+Tests for parsing QC tables.
+"""
+
+import pandas as pd
+import pytest
+
+from alhena_igo import utils
+from alhena_igo.utils import TableLoader, estimate_rows, process_data, process_data_chunks, memory_report, standard_hmmcopy_reads_cols
+from alhena_igo.utils import _categorical_cols_align, _categorical_cols_hmmcopy
+from alhena_igo.utils import _dtypes_hmmcopy_reads, _dtypes_hmmcopy_segs, _dtypes_metrics, _dtypes_gc_metrics
+from conftest import make_reads, write_csverve
+
+
+def test_process_data_chunks_matches_process_data(reads_file):
+    """
+    Arrange: Write a synthetic reads file.
+    Act: Parse it whole and in small chunks.
+    Assert: The chunks are bounded in size and together give the same rows.
+    """
+    usecols = standard_hmmcopy_reads_cols.copy()
+    data = process_data(reads_file, _categorical_cols_hmmcopy, usecols=usecols)
+    chunks = list(process_data_chunks(reads_file, _categorical_cols_hmmcopy, usecols=usecols, chunksize=128))
+
+    assert all(len(chunk) <= 128 for chunk in chunks)
+    assert all(chunk['cell_id'].dtype.name == 'category' for chunk in chunks)
+
+    streamed = pd.concat([chunk for chunk in chunks if len(chunk) > 0])
+    assert 'reference' not in set(streamed['cell_id'])
+    pd.testing.assert_frame_equal(
+        streamed.astype({'cell_id': str, 'chr': str}),
+        data.astype({'cell_id': str, 'chr': str}),
+    )
+
+
+def test_compact_dtypes_shrink_reads(reads_file):
+    """
+    Arrange: Write a synthetic reads file.
+    Act: Parse it with and without the compact reads schema.
+    Assert: Values are unchanged and the table uses well under the memory.
+    """
+    usecols = standard_hmmcopy_reads_cols.copy()
+    default = process_data(reads_file, _categorical_cols_hmmcopy, usecols=usecols)
+    compact = process_data(reads_file, _categorical_cols_hmmcopy, usecols=usecols, dtype=_dtypes_hmmcopy_reads)
+
+    assert compact['state'].dtype.name == 'int8'
+    assert compact['start'].dtype.name == 'int32'
+    pd.testing.assert_frame_equal(compact, default, check_dtype=False, atol=1e-6)
+
+    report = memory_report({'default': default, 'compact': compact}).set_index('table')
+    assert report.loc['compact', 'megabytes'] < 0.6 * report.loc['default', 'megabytes']
+
+
+@pytest.mark.parametrize('table, categorical_cols, dtype', [
+    ('reads', _categorical_cols_hmmcopy, _dtypes_hmmcopy_reads),
+    ('segments', _categorical_cols_hmmcopy, _dtypes_hmmcopy_segs),
+    ('metrics', _categorical_cols_align, _dtypes_metrics),
+    ('gc_metrics', _categorical_cols_align, _dtypes_gc_metrics),
+])
+def test_pyarrow_engine_matches_c_engine(qc_files, table, categorical_cols, dtype):
+    """
+    Arrange: Write synthetic QC files.
+    Act: Parse each with the c and pyarrow engines.
+    Assert: Both engines give identical DataFrames, dtypes included.
+    """
+    pytest.importorskip('pyarrow')
+
+    expected = process_data(qc_files[table], categorical_cols, dtype=dtype, engine='c')
+    result = process_data(qc_files[table], categorical_cols, dtype=dtype, engine='pyarrow')
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_table_loader_reads_shared_file_once(qc_files, monkeypatch):
+    """
+    Arrange: Count reads of csverve files.
+    Act: Load align and hmmcopy metrics from the same metrics file.
+    Assert: The file is read once and both tables match `process_data`.
+    """
+    reads = []
+    read_csverve = utils.read_csverve
+
+    def counting_read_csverve(filepath, **kwargs):
+        reads.append(filepath)
+        return read_csverve(filepath, **kwargs)
+
+    monkeypatch.setattr(utils, 'read_csverve', counting_read_csverve)
+
+    table_loader = TableLoader()
+    align = table_loader.load(qc_files['metrics'], _categorical_cols_align, dtype=_dtypes_metrics)
+    hmmcopy = table_loader.load(qc_files['metrics'], _categorical_cols_hmmcopy, dtype=_dtypes_metrics)
+
+    assert reads == [qc_files['metrics']]
+    pd.testing.assert_frame_equal(align, process_data(qc_files['metrics'], _categorical_cols_align, dtype=_dtypes_metrics))
+    pd.testing.assert_frame_equal(hmmcopy, process_data(qc_files['metrics'], _categorical_cols_hmmcopy, dtype=_dtypes_metrics))
+
+
+def test_estimate_rows(tmp_path):
+    reads = make_reads(n_cells=20, n_bins=500)
+    filepath = write_csverve(reads, str(tmp_path / 'reads.csv.gz'))
+
+    assert abs(estimate_rows(filepath) - len(reads)) < 0.05 * len(reads)
+    assert estimate_rows(filepath, sample_rows=len(reads) + 10) == len(reads)
+
+
+def test_estimate_rows_past_4_gib(tmp_path, monkeypatch):
+    """
+    Arrange: Make a gzipped CSV look 4 GiB larger by scaling its compressed size, keeping its gzip trailer.
+    Act: Estimate its rows.
+    Assert: The estimate adds the 4 GiB the trailer wraps around.
+    """
+    import os
+
+    reads = make_reads(n_cells=20, n_bins=500)
+    filepath = write_csverve(reads, str(tmp_path / 'reads.csv.gz'))
+    uncompressed = len(reads.to_csv(index=False).encode())
+    getsize = os.path.getsize
+    monkeypatch.setattr(os.path, 'getsize', lambda path: getsize(path) * (uncompressed + 2 ** 32) / uncompressed)
+
+    expected = len(reads) * (uncompressed + 2 ** 32) / uncompressed
+    assert abs(estimate_rows(filepath) - expected) < 0.05 * expected
+
+
+@pytest.mark.parametrize('chunksize', [None, 100])
+def test_read_csverve_rejects_metadata_mismatch(tmp_path, chunksize):
+    """
+    Arrange: Write a csverve file, then drop a column from its data but not from its metadata.
+    Act: Read it, whole or in chunks.
+    Assert: A CsverveParseError is raised, as csverve raises.
+    """
+    from csverve.errors import CsverveParseError
+
+    reads = make_reads(n_cells=2, n_bins=100)
+    filepath = write_csverve(reads, str(tmp_path / 'reads.csv.gz'))
+    reads.drop(columns=['gc']).to_csv(filepath, index=False, compression='gzip')
+
+    with pytest.raises(CsverveParseError):
+        data = utils.read_csverve(filepath, chunksize=chunksize)
+        if chunksize:
+            list(data)
+
+
+def test_union_categories_shares_categories_and_keeps_values():
+    """
+    Arrange: Build frames with overlapping categorical and plain string columns.
+    Act: Union their categories.
+    Assert: Every frame has the same categories and its values are unchanged.
+    """
+    dfs = [
+        pd.DataFrame({'cell_id': pd.Categorical(['a', 'b', 'a']), 'chr': ['1', '2', '1']}),
+        pd.DataFrame({'cell_id': pd.Categorical(['c', None]), 'chr': ['X', 'X']}),
+        pd.DataFrame({'chr': pd.Categorical(['2', 'Y'])}),
+    ]
+    expected = [df.astype(str) for df in dfs]
+
+    utils.union_categories(dfs, cat_cols=['cell_id', 'chr'])
+
+    assert list(dfs[0]['cell_id'].cat.categories) == ['a', 'b', 'c']
+    assert dfs[0]['cell_id'].cat.categories.equals(dfs[1]['cell_id'].cat.categories)
+    assert set(dfs[0]['chr'].cat.categories) == {'1', '2', 'X', 'Y'}
+    assert all(df['chr'].cat.categories.equals(dfs[0]['chr'].cat.categories) for df in dfs)
+    assert dfs[1]['cell_id'].isna().tolist() == [False, True]
+    for df, before in zip(dfs, expected):
+        pd.testing.assert_frame_equal(df.astype(str), before)
+
+
+def test_read_filtered_matches_filtering_after_parse(reads_file):
+    """
+    Arrange: Write a synthetic reads file and pick some cells and chromosomes.
+    Act: Read it with the filter applied in small chunks.
+    Assert: The rows and columns match filtering the fully parsed table.
+    """
+    full = process_data(reads_file, _categorical_cols_hmmcopy, dtype=_dtypes_hmmcopy_reads)
+    cells = list(full['cell_id'].cat.categories[:3]) + ['reference']
+    row_filter = utils.RowFilter(cells=cells, chromosomes=['1', 'X'])
+    usecols = ['start', 'end', 'copy', 'state']
+
+    data = utils.read_filtered(reads_file, row_filter, usecols=usecols, dtype=_dtypes_hmmcopy_reads, chunksize=37)
+
+    expected = full[full['cell_id'].isin(cells) & full['chr'].isin(['1', 'X'])]
+    assert list(data.columns) == usecols
+    assert len(data) == len(expected) > 0
+    pd.testing.assert_frame_equal(data, expected[usecols].reset_index(drop=True))
+
+
+def test_row_filter_skips_missing_columns(qc_files):
+    """
+    Arrange: Filter on cells and chromosomes.
+    Act: Read the metrics table, which has no chr column, in chunks.
+    Assert: Only the cell predicate is applied.
+    """
+    metrics = process_data(qc_files['metrics'], _categorical_cols_align)
+    cells = list(metrics['cell_id'][:4])
+
+    chunks = list(process_data_chunks(
+        qc_files['metrics'], _categorical_cols_align, chunksize=3,
+        row_filter=utils.RowFilter(cells=cells, chromosomes=['1']),
+    ))
+
+    assert sorted(pd.concat([chunk['cell_id'].astype(str) for chunk in chunks])) == sorted(cells)
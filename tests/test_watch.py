@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+.. currentmodule:: test_watch
+
+Tests for watching Isabl for new analyses against a local fake Isabl server.
+"""
+import pytest
+
+from alhena_igo import watch
+from alhena_igo.ledger import LoadLedger
+from fakes import FakeES, FakeIsabl, FakeIsablServer, install, write_qc_results
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    results = {i: write_qc_results(str(tmp_path / str(i)), n_cells=4, n_bins=10, seed=i) for i in (1, 2, 4)}
+    isabl = FakeIsabl(5, results=results, framework='mondrian_nf')
+    es = FakeES()
+    install(monkeypatch, isabl, es)
+    return isabl, es, LoadLedger(str(tmp_path / 'ledger.sqlite'))
+
+
+def _watcher(server, es, ledger, **kwargs):
+    return watch.Watcher(
+        [('mondrian_nf', 'v1')], ['DLP'], 'localhost', 9200, es, ledger,
+        api_url=server.url, token='', **kwargs
+    )
+
+
+def test_watch_loads_new_analyses_once(project):
+    """
+    Arrange: Serve analyses modified after the start of the watch from a fake Isabl server.
+    Act: Poll and load them, then poll again and restart the watch with the same ledger.
+    Assert: Each analysis is loaded once, only the analysis at the cursor is remembered, and the cursor is kept in the ledger.
+    """
+    isabl, es, ledger = project
+    pks = [str(analysis.pk) for analysis in isabl.analyses]
+
+    with FakeIsablServer(isabl) as server:
+        with _watcher(server, es, ledger, since='2024-01-01T00:00:00+00:00') as watcher:
+            loaded = list(watcher.run(interval=0, polls=1))
+            assert watcher.poll() == 0
+            assert list(watcher._seen) == [pks[-1]]
+
+        with _watcher(server, es, ledger) as watcher:
+            assert watcher.cursors[('mondrian_nf', 'v1')] == isabl.analyses[-1].modified
+            assert watcher.poll() == 0
+
+    assert sorted(loaded) == [(pk, None) for pk in pks]
+    assert set(es.analyses) == set(pks)
+    assert es.projects['DLP'] == set(pks)
+
+
+def test_watch_picks_up_later_analyses(project):
+    """
+    Arrange: Watch from after the existing analyses were modified.
+    Act: Poll, then mark one analysis as modified later and poll again.
+    Assert: Only that analysis is loaded.
+    """
+    isabl, es, ledger = project
+
+    with FakeIsablServer(isabl) as server:
+        with _watcher(server, es, ledger, since='2024-06-01T00:00:00+00:00') as watcher:
+            assert watcher.poll() == 0
+            isabl.analyses[0].modified = '2024-07-01T00:00:00+00:00'
+            loaded = list(watcher.run(interval=0, polls=1))
+
+    assert loaded == [(str(isabl.analyses[0].pk), None)]
+
+
+def test_failed_load_is_retried(project, monkeypatch):
+    """
+    Arrange: Make the first load of an analysis fail.
+    Act: Run the watch for two polls.
+    Assert: The analysis is loaded at the second poll.
+    """
+    isabl, es, ledger = project
+    load_analysis = watch.loader.load_analysis
+    attempts = []
+
+    def flaky_load_analysis(analysis_id, *args, **kwargs):
+        attempts.append(analysis_id)
+        if len(attempts) == 1:
+            raise ValueError('Elasticsearch unavailable')
+        return load_analysis(analysis_id, *args, **kwargs)
+
+    monkeypatch.setattr(watch.loader, 'load_analysis', flaky_load_analysis)
+    isabl.analyses = isabl.analyses[:1]
+    pk = str(isabl.analyses[0].pk)
+
+    with FakeIsablServer(isabl) as server:
+        with _watcher(server, es, ledger, since='2024-01-01T00:00:00+00:00') as watcher:
+            results = list(watcher.run(interval=0.2, polls=2))
+
+    assert [analysis_id for analysis_id, _ in results] == [pk, pk]
+    assert isinstance(results[0][1], ValueError) and results[1][1] is None
+    assert pk in es.analyses